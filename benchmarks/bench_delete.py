@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the deletion of records from EGCData.
+
+The EGC file is loaded and a random sample of its records is deleted
+(in random order); the time for loading the file and for the deletions
+is reported.
+
+Usage:
+  bench_delete.py [options] <egcfile>
+
+Arguments:
+  <egcfile>  EGC file (large file recommended)
+
+Options:
+  -f --fraction F         fraction of the records to delete [default: 0.1]
+  -s --seed S             random seed [default: 42]
+  -g --graph-backend GB   graph backend (dict or compact) [default: dict]
+  --cache                 use the cache file
+  -h --help               Show this screen.
+"""
+import time
+import random
+from docopt import docopt
+from egctools.egcdata import EGCData
+
+def main(args):
+  start = time.perf_counter()
+  egc = EGCData.from_file(args["<egcfile>"], cache=args["--cache"],
+                          graph_backend=args["--graph-backend"])
+  load_time = time.perf_counter() - start
+  record_ids = list(egc.id2rnum.keys())
+  rng = random.Random(int(args["--seed"]))
+  to_delete = rng.sample(record_ids,
+                         int(len(record_ids) * float(args["--fraction"])))
+  start = time.perf_counter()
+  for record_id in to_delete:
+    egc.delete(record_id)
+  delete_time = time.perf_counter() - start
+  print("records\tdeleted\tload_s\tdelete_s\tdelete_us_per_record")
+  per_record = delete_time / max(len(to_delete), 1) * 1e6
+  print(f"{len(record_ids)}\t{len(to_delete)}\t{load_time:.2f}\t"+\
+        f"{delete_time:.2f}\t{per_record:.1f}")
+
+if __name__ == "__main__":
+  main(docopt(__doc__))
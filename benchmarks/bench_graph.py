@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the reference graph backends (egctools.graph).
+
+A synthetic graph with the structure of a EGC file is constructed
+(S/T records referencing D records, V/C records referencing S/T, A and G
+records, A records referencing U records, G records referencing G records),
+using each of the backends. The construction time, the memory used by the
+graph (measured using tracemalloc, in a separate run, as tracing slows
+down the construction) and the time for looking up the
+references of all nodes are reported.
+
+Usage:
+  bench_graph.py [options]
+
+Options:
+  -n --n-values N  number of V records of the synthetic graph [default: 100000]
+  -s --seed S      random seed [default: 42]
+  -h --help        Show this screen.
+"""
+import gc
+import time
+import random
+import tracemalloc
+from docopt import docopt
+from egctools import graph as egcgraph
+
+def _edges(n_values, seed):
+  rng = random.Random(seed)
+  n_docs = max(n_values // 50, 1)
+  n_sources = max(n_values // 10, 1)
+  n_attrs = max(n_values // 100, 1)
+  n_groups = max(n_values // 20, 1)
+  n_units = max(n_attrs // 2, 1)
+  edges = []
+  for i in range(n_sources):
+    edges.append(('S', f"S{i}", 'D', f"D-PMID-{rng.randrange(n_docs)}"))
+  for i in range(n_units):
+    edges.append(('U', f"U{i}", 'U', f"U{rng.randrange(n_units)}"))
+  for i in range(n_attrs):
+    edges.append(('A', f"A{i}", 'U', f"U{rng.randrange(n_units)}"))
+  for i in range(n_groups):
+    if i > 0 and rng.random() < 0.2:
+      edges.append(('G', f"G{i}", 'G', f"G{rng.randrange(i)}"))
+  for i in range(n_values):
+    edges.append(('V', f"V{i}", 'S', f"S{rng.randrange(n_sources)}"))
+    edges.append(('V', f"V{i}", 'A', f"A{rng.randrange(n_attrs)}"))
+    edges.append(('V', f"V{i}", 'G', f"G{rng.randrange(n_groups)}"))
+  return edges
+
+def _build(backend, edges):
+  graph = egcgraph.create(backend)
+  for rt1, id1, rt2, id2 in edges:
+    graph.connect(rt1, id1, rt2, id2)
+  graph.finalize()
+  return graph
+
+def _lookup(graph, edges):
+  n = 0
+  for rt1, id1, rt2, id2 in edges:
+    n += len(graph.refs(rt1, id1, rt2))
+    n += len(graph.ref_by(rt2, id2, rt1))
+  return n
+
+def main(args):
+  edges = _edges(int(args["--n-values"]), int(args["--seed"]))
+  print(f"# {len(edges)} edges")
+  print("backend\tbuild_s\tmemory_MB\tlookup_s")
+  for backend in egcgraph.GRAPH_BACKENDS:
+    gc.collect()
+    start = time.perf_counter()
+    graph = _build(backend, edges)
+    build_time = time.perf_counter() - start
+    del graph
+    gc.collect()
+    tracemalloc.start()
+    graph = _build(backend, edges)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    start = time.perf_counter()
+    _lookup(graph, edges)
+    lookup_time = time.perf_counter() - start
+    print(f"{backend}\t{build_time:.2f}\t{memory/2**20:.1f}\t{lookup_time:.2f}")
+    del graph
+
+if __name__ == "__main__":
+  main(docopt(__doc__))
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the import time of egctools and of the startup time
+of the command line scripts.
+
+Each statement or command is run in a fresh interpreter several times;
+the minimum and median wall clock time are reported.
+
+Usage:
+  bench_import.py [options]
+
+Options:
+  -r --repeats N  number of runs for each statement/command [default: 10]
+  -h --help       Show this screen.
+"""
+import os
+import sys
+import time
+import statistics
+import subprocess
+from docopt import docopt
+
+BINDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      os.pardir, "bin")
+
+STATEMENTS = [
+  "pass",
+  "import egctools",
+  "import egctools.parser",
+  "import egctools.egcdata",
+  "import egctools.stats",
+  "import egctools.extractor",
+]
+
+SCRIPTS = [
+  "egctools-merge",
+  "egctools-extract",
+  "egctools-stats",
+  "egctools-table",
+]
+
+def _time_run(cmd, repeats):
+  times = []
+  for i in range(repeats):
+    start = time.perf_counter()
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+    times.append(time.perf_counter() - start)
+  return min(times), statistics.median(times)
+
+def main(args):
+  repeats = int(args["--repeats"])
+  print("what\tmin_ms\tmedian_ms")
+  for statement in STATEMENTS:
+    t_min, t_med = _time_run([sys.executable, "-c", statement], repeats)
+    print(f"{statement}\t{t_min*1000:.1f}\t{t_med*1000:.1f}")
+  for script in SCRIPTS:
+    cmd = [sys.executable, os.path.join(BINDIR, script), "--version"]
+    t_min, t_med = _time_run(cmd, repeats)
+    print(f"{script} --version\t{t_min*1000:.1f}\t{t_med*1000:.1f}")
+
+if __name__ == "__main__":
+  main(docopt(__doc__))
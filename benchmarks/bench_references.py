@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the extraction of the references of the records
+(egctools.references) and of the construction of the reference graph
+of EGCData from the records.
+
+Synthetic records of each record type are created (as decoded records,
+thus the parser is not involved). For each record type, the time per record
+for extracting the referenced IDs is reported; then the time per record
+for constructing the index and reference graph of all records.
+
+Usage:
+  bench_references.py [options]
+
+Options:
+  -n --n-records N  number of records of each type [default: 20000]
+  -r --repeat R     number of repetitions, the best is reported [default: 5]
+  -g --graph B      graph backend [default: dict]
+  -s --seed S       random seed [default: 42]
+  -h --help         Show this screen.
+"""
+import time
+import random
+from docopt import docopt
+from egctools import references as r
+from egctools.egcdata import EGCData
+
+GETTERS = {
+  'S': [r.get_ST_to_D],
+  'T': [r.get_ST_to_D],
+  'G': [r.get_G_to_G],
+  'U': [r.get_U_to_U],
+  'A': [r.get_A_to_U],
+  'M': [r.get_M_to_U],
+  'V': [r.get_VC_to_ST, r.get_VC_to_A, r.get_VC_to_G],
+  'C': [r.get_VC_to_ST, r.get_VC_to_A, r.get_VC_to_G],
+}
+
+def _utype(base_type, enumerating=False):
+  return {'kind': 'set' if enumerating else 'gene', 'base_type': base_type,
+          'multi': False, 'enumerating': enumerating}
+
+def _records(n, seed):
+  rng = random.Random(seed)
+  records = {rt: [] for rt in GETTERS}
+  for i in range(n):
+    records['S'].append({'record_type': 'S', 'id': f"S{i}",
+        'document_id': {'resource_prefix': 'PMID', 'item': str(i % 1000)}})
+    records['T'].append({'record_type': 'T', 'id': f"T{i}",
+        'document_id': {'resource_prefix': 'PMID', 'item': str(i % 1000)}})
+    if i < 10 or rng.random() < 0.6:
+      gtype, definition = 'taxonomic', f"NCBI:{i}"
+    elif rng.random() < 0.8:
+      gtype = 'combined'
+      definition = "+".join(f"G{rng.randrange(i)}" for k in range(3))
+    else:
+      gtype, definition = 'strain', f"derived:G{rng.randrange(i)}:x"
+    records['G'].append({'record_type': 'G', 'id': f"G{i}", 'name': ".",
+                         'type': gtype, 'definition': definition})
+    choice = rng.random()
+    if i < 10 or choice < 0.5:
+      utype, definition = _utype('specific_gene'), "."
+    elif choice < 0.7:
+      utype = _utype('gene_cluster', True)
+      definition = ",".join(f"U{rng.randrange(i)}" for k in range(3))
+    elif choice < 0.8:
+      utype = _utype('arrangement', True)
+      definition = ",".join(f"U{rng.randrange(i)}" for k in range(3))
+    elif choice < 0.9:
+      utype, definition = _utype('gene_homologs'), f"homolog:U{i - 1}"
+    else:
+      utype, definition = _utype('specific_gene'), f"derived:U{i - 1}:x"
+    records['U'].append({'record_type': 'U', 'id': f"U{i}", 'type': utype,
+        'symbol': ".", 'description': ".", 'definition': definition})
+    mode = 'count' if rng.random() < 0.8 else \
+        {'mode': 'relative_count', 'reference': f"U{rng.randrange(n)}"}
+    records['A'].append({'record_type': 'A', 'id': f"A{i}",
+                         'unit_id': f"U{rng.randrange(n)}", 'mode': mode})
+    records['M'].append({'record_type': 'M', 'unit_id': f"U{i}",
+                         'resource_id': 'Pfam', 'model_id': f"PF{i}"})
+    source = f"S{rng.randrange(n)}" if rng.random() < 0.8 else \
+        [f"S{rng.randrange(n)}", f"T{rng.randrange(n)}"]
+    records['V'].append({'record_type': 'V', 'id': f"V{i}",
+        'source': source, 'attribute': f"A{rng.randrange(n)}",
+        'group': {'id': f"G{rng.randrange(n)}"}, 'operator': '>',
+        'reference': '0'})
+    records['C'].append({'record_type': 'C', 'id': f"C{i}",
+        'source': f"T{rng.randrange(n)}", 'attribute': f"A{rng.randrange(n)}",
+        'group1': {'id': f"G{rng.randrange(n)}"},
+        'group2': {'id': f"G{rng.randrange(n)}"}, 'operator': '>'})
+  return records
+
+def _best(func, repeat):
+  best = None
+  for i in range(repeat):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return best
+
+def _extract(records, getters):
+  for record in records:
+    for getter in getters:
+      getter(record)
+
+def main(args):
+  n = int(args["--n-records"])
+  repeat = int(args["--repeat"])
+  records = _records(n, int(args["--seed"]))
+  print("record_type\tus_per_record")
+  for rt, getters in GETTERS.items():
+    t = _best(lambda: _extract(records[rt], getters), repeat)
+    print(f"{rt}\t{t / n * 1e6:.3f}")
+  all_records = [record for rt in GETTERS for record in records[rt]]
+  t = _best(lambda: EGCData(None, all_records, [None] * len(all_records),
+                            args["--graph"]), repeat)
+  print(f"graph\t{t / len(all_records) * 1e6:.3f}")
+
+if __name__ == "__main__":
+  main(docopt(__doc__))
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite of egctools, on synthetic EGC files (egctools.synthetic).
+
+For each size (number of records), a synthetic file is generated (or reused,
+if it exists in the data directory) and the following benchmarks are run:
+
+  parse        decoding all lines (egctools.parser.parsed_lines)
+  load         EGCData.from_file, without cache
+  load_cached  EGCData.from_file, from the cache file
+  create       EGCData.create of V records
+  update       EGCData.update of V records
+  delete       EGCData.delete of V records
+  rename       EGCData.rename_many of A records (referenced by V/C records)
+  extract      Extractor.extract of random G, U and A records
+  stats        stats.collect, without cache
+  report       stats.report
+
+The results (time and number of processed records or operations) are
+printed and optionally saved as JSON; a previous JSON output can be given
+for comparison (ratio of the times).
+
+Usage:
+  bench_suite.py [options]
+
+Options:
+  --sizes N,...      numbers of records [default: 10000,100000,1000000]
+  --only B,...       run only the given benchmarks
+  --ops N            number of edit operations and extractions [default: 1000]
+  --seed S           random seed [default: 42]
+  --data-dir DIR     directory for the synthetic files and caches
+                     (default: a temporary directory)
+  -o --output FILE   save the results as JSON
+  --compare FILE     compare to the results of a previous run (JSON)
+  -h --help          Show this screen.
+"""
+import os
+import sys
+import copy
+import json
+import time
+import random
+import platform
+import tempfile
+from docopt import docopt
+import egctools
+from egctools import synthetic, stats
+from egctools.parser import parsed_lines
+from egctools.egcdata import EGCData
+from egctools.extractor import Extractor
+
+BENCHMARKS = ["parse", "load", "load_cached", "create", "update", "delete",
+              "rename", "extract", "stats", "report"]
+
+# benchmarks using an EGCData object
+_EGC_BENCHMARKS = BENCHMARKS[1:8]
+
+class _Timer:
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc):
+    self.seconds = time.perf_counter() - self.start
+
+def _corpus(data_dir, size, seed):
+  fname = os.path.join(data_dir, f"synthetic_{size}_{seed}.egc")
+  if not os.path.exists(fname):
+    synthetic.write(fname, size, seed=seed)
+  return fname
+
+def _run(benchmarks, fname, data_dir, n_ops, seed):
+  rng = random.Random(seed)
+  cache_dir = os.path.join(data_dir, "cache")
+  os.makedirs(cache_dir, exist_ok=True)
+  results = {}
+  def result(name, timer, n):
+    if name in benchmarks:
+      results[name] = {'seconds': timer.seconds, 'n': n}
+  if "parse" in benchmarks:
+    with _Timer() as t:
+      n = sum(1 for record in parsed_lines(fname))
+    result("parse", t, n)
+  if set(benchmarks) & set(_EGC_BENCHMARKS):
+    with _Timer() as t:
+      egc = EGCData.from_file(fname, cache=False)
+    n_records = len(egc.id2rnum)
+    result("load", t, n_records)
+    if "load_cached" in benchmarks:
+      EGCData.from_file(fname, cache=True, cache_dir=cache_dir)
+      with _Timer() as t:
+        EGCData.from_file(fname, cache=True, cache_dir=cache_dir)
+      result("load_cached", t, n_records)
+    V_ids = egc.find_all_ids('V')
+    A_ids = egc.find_all_ids('A')
+    V_records = [copy.deepcopy(egc.find(rng.choice(V_ids))) \
+                 for i in range(n_ops)]
+    new_ids = [f"Vbench{i}" for i in range(n_ops)]
+    with _Timer() as t:
+      for record, new_id in zip(V_records, new_ids):
+        record['id'] = new_id
+        egc.create(record)
+    result("create", t, n_ops)
+    with _Timer() as t:
+      for new_id in new_ids:
+        record = copy.deepcopy(egc.find(new_id))
+        record['operator'] = '='
+        egc.update(new_id, record)
+    result("update", t, n_ops)
+    with _Timer() as t:
+      for new_id in new_ids:
+        egc.delete(new_id)
+    result("delete", t, n_ops)
+    renamed = rng.sample(A_ids, min(n_ops, len(A_ids)))
+    with _Timer() as t:
+      for old_id in renamed:
+        egc.rename_many({old_id: old_id + "_renamed"})
+    result("rename", t, len(renamed))
+    if "extract" in benchmarks:
+      extractor = Extractor(egc)
+      ids = [rng.choice(egc.find_all_ids(rt)) for rt in ['G', 'U', 'A'] \
+             for i in range(n_ops // 3)]
+      with _Timer() as t:
+        for record_id in ids:
+          extractor.extract(record_id)
+      result("extract", t, len(ids))
+  if "stats" in benchmarks or "report" in benchmarks:
+    with _Timer() as t:
+      s = stats.collect(fname, cache=False)
+    result("stats", t, s['total_count'])
+    with _Timer() as t:
+      stats.report(s)
+    result("report", t, 1)
+  return results
+
+def _compare(results, previous):
+  before = {(r['size'], r['benchmark']): r for r in previous['results']}
+  print("size\tbenchmark\tseconds\tprevious\tratio")
+  for r in results:
+    p = before.get((r['size'], r['benchmark']))
+    if p is not None:
+      ratio = r['seconds'] / p['seconds'] if p['seconds'] else float('nan')
+      print(f"{r['size']}\t{r['benchmark']}\t{r['seconds']:.4f}\t"+\
+            f"{p['seconds']:.4f}\t{ratio:.2f}")
+
+def main(args):
+  sizes = [int(s) for s in args["--sizes"].split(",")]
+  benchmarks = BENCHMARKS if args["--only"] is None else \
+               args["--only"].split(",")
+  for b in benchmarks:
+    if b not in BENCHMARKS:
+      sys.exit(f"Unknown benchmark: {b}")
+  seed = int(args["--seed"])
+  data_dir = args["--data-dir"]
+  if data_dir is None:
+    tmp_dir = tempfile.TemporaryDirectory()
+    data_dir = tmp_dir.name
+  else:
+    os.makedirs(data_dir, exist_ok=True)
+  results = []
+  print("size\tbenchmark\tseconds\tn\tper_second")
+  for size in sizes:
+    fname = _corpus(data_dir, size, seed)
+    size_results = _run(benchmarks, fname, data_dir, int(args["--ops"]), seed)
+    for benchmark in BENCHMARKS:
+      if benchmark in size_results:
+        r = size_results[benchmark]
+        per_second = r['n'] / r['seconds'] if r['seconds'] else None
+        results.append({'size': size, 'benchmark': benchmark,
+                        'seconds': r['seconds'], 'n': r['n'],
+                        'per_second': per_second})
+        print(f"{size}\t{benchmark}\t{r['seconds']:.4f}\t{r['n']}\t"+\
+              f"{per_second or 0:.1f}", flush=True)
+  if args["--output"]:
+    with open(args["--output"], "w") as f:
+      json.dump({'egctools_version': egctools.__version__,
+                 'python': platform.python_version(),
+                 'platform': platform.platform(),
+                 'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                 'seed': seed, 'results': results}, f, indent=2)
+  if args["--compare"]:
+    with open(args["--compare"]) as f:
+      _compare(results, json.load(f))
+
+if __name__ == "__main__":
+  main(docopt(__doc__))
@@ -1,10 +1,18 @@
-from . import parser
-from . import table
-from . import stats
-from . import index
-from . import egcdata
-from . import extractor
-from . import references
-from . import id_generator
-from . import pgto
+import importlib
 __version__="0.1"
+
+# submodules are imported on first access (e.g. egctools.stats),
+# so that e.g. scripts only needing the parser do not pay the
+# import time of the other modules and their dependencies
+_submodules = ["parser", "index", "table", "stats", "egcdata", "extractor",
+               "references", "id_generator", "pgto", "cache", "graph",
+               "sqlindex", "linestore", "merge", "templates",
+               "synthetic", "profiling"]
+
+def __getattr__(name):
+  if name in _submodules:
+    return importlib.import_module("." + name, __name__)
+  raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+  return sorted(list(globals().keys()) + _submodules)
@@ -0,0 +1,193 @@
+#
+# Persistent cache of the decoded contents of EGC files
+#
+# The cache is only used if requested (e.g. EGCData.from_file(cache=True)),
+# as the cache files are unpickled, which can execute arbitrary code: the
+# cache files are stored in a directory under the control of the user
+# (by default the egctools cache directory, see user_cache_dir), never
+# next to the EGC files.
+#
+# The cache file (the EGC filename with a hash of its absolute path and the
+# suffix '.egccache') contains a sequence of pickled objects: a header,
+# describing the EGC file from which the cache was computed (size,
+# modification time and sha256 of the content) and listing the keys of the
+# cached data, followed by the offsets of the data of each key in the file
+# (8 bytes each) and the data: one pickled object for each key ('lines',
+# 'records' and optionally further keys, such as the 'index' of EGCData),
+# thus each key can be loaded without reading the others. The records are
+# pickled in chunks, so that they can be iterated without loading all of them
+# (iter_records).
+#
+# The cache is only used if the size of the EGC file did not change
+# and either the modification time or the sha256 of the content
+# are unchanged.
+#
+import os
+import pickle
+import struct
+import hashlib
+from . import profiling
+
+CACHE_SUFFIX = ".egccache"
+CACHE_VERSION = 4
+
+# number of records pickled together
+RECORDS_CHUNK_SIZE = 10000
+
+def file_sha256(file_path, blocksize=1<<20):
+  hasher = hashlib.sha256()
+  with open(file_path, 'rb') as f:
+    for block in iter(lambda: f.read(blocksize), b''):
+      hasher.update(block)
+  return hasher.hexdigest()
+
+def user_cache_dir():
+  """
+  The egctools cache directory: EGCTOOLS_CACHE_DIR (environment variable),
+  otherwise $XDG_CACHE_HOME/egctools or ~/.cache/egctools.
+  """
+  cache_dir = os.environ.get("EGCTOOLS_CACHE_DIR")
+  if cache_dir is None:
+    cache_home = os.environ.get("XDG_CACHE_HOME",
+                                os.path.join(os.path.expanduser("~"), ".cache"))
+    cache_dir = os.path.join(cache_home, "egctools")
+  return cache_dir
+
+def cache_path(file_path, cache_dir=None):
+  """
+  Path of the cache file for a given EGC file, in cache_dir (by default
+  the egctools cache directory, see user_cache_dir); to avoid collisions
+  between files with the same name in different directories, a hash
+  of the absolute path of the EGC file is added to the cache filename.
+  """
+  if cache_dir is None:
+    cache_dir = user_cache_dir()
+  path_hash = hashlib.sha256(os.path.abspath(file_path).encode()).hexdigest()
+  cache_filename = f"{os.path.basename(file_path)}.{path_hash[:8]}"
+  return os.path.join(cache_dir, cache_filename + CACHE_SUFFIX)
+
+def _header(file_path, keys):
+  st = os.stat(file_path)
+  return {'version': CACHE_VERSION, 'size': st.st_size,
+          'mtime_ns': st.st_mtime_ns, 'sha256': file_sha256(file_path),
+          'keys': keys}
+
+def _is_valid(header, file_path):
+  if header.get('version') != CACHE_VERSION:
+    return False
+  st = os.stat(file_path)
+  if header['size'] != st.st_size:
+    return False
+  if header['mtime_ns'] == st.st_mtime_ns:
+    return True
+  return header['sha256'] == file_sha256(file_path)
+
+def load(file_path, cache_dir=None, keys=('lines', 'records')):
+  """
+  Load the cached data for a EGC file, as a dict containing the given keys.
+
+  Returns None if no cache file exists, if it is stale or unreadable,
+  or if it does not contain all the given keys.
+  """
+  with profiling.timer("cache.load"):
+    data = _load(file_path, cache_dir, keys)
+  profiling.count("cache.misses" if data is None else "cache.hits")
+  return data
+
+def _open(file_path, cache_dir, keys):
+  """
+  Open the cache file and read its header; returns the open file and a dict
+  of the offsets of the keys, or None if the cache file cannot be used.
+  """
+  f = open(cache_path(file_path, cache_dir), 'rb')
+  try:
+    header = pickle.load(f)
+    if _is_valid(header, file_path) and set(keys).issubset(header['keys']):
+      n_keys = len(header['keys'])
+      offsets = struct.unpack(f"<{n_keys}Q", f.read(8 * n_keys))
+      return f, dict(zip(header['keys'], offsets))
+  except Exception:
+    pass
+  f.close()
+  return None
+
+def _iter_chunks(f):
+  n_chunks = pickle.load(f)
+  for i in range(n_chunks):
+    yield from pickle.load(f)
+
+def _load(file_path, cache_dir, keys):
+  try:
+    opened = _open(file_path, cache_dir, keys)
+    if opened is None:
+      return None
+    f, offsets = opened
+    with f:
+      data = {}
+      for key in keys:
+        f.seek(offsets[key])
+        if key == 'records':
+          data[key] = list(_iter_chunks(f))
+        else:
+          data[key] = pickle.load(f)
+      return data
+  except Exception:
+    return None
+
+def iter_records(file_path, cache_dir=None):
+  """
+  Iterator over the cached records of a EGC file, which are read one chunk
+  at a time; None if they are not available (see load).
+  """
+  try:
+    opened = _open(file_path, cache_dir, ['records'])
+  except OSError:
+    opened = None
+  profiling.count("cache.misses" if opened is None else "cache.hits")
+  if opened is None:
+    return None
+  f, offsets = opened
+  def records():
+    with f:
+      f.seek(offsets['records'])
+      yield from _iter_chunks(f)
+  return records()
+
+def _dump(obj, f):
+  pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def store(file_path, data, cache_dir=None):
+  """
+  Store data in the cache file for a EGC file.
+
+  The cache file is written atomically; failures to write it
+  (e.g. read-only directories, data which cannot be pickled)
+  are silently ignored. The cache directory is created if needed,
+  accessible only by the user.
+  """
+  path = cache_path(file_path, cache_dir)
+  tmp_path = f"{path}.{os.getpid()}.tmp"
+  try:
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    keys = list(data.keys())
+    with profiling.timer("cache.store"), open(tmp_path, 'wb') as f:
+      _dump(_header(file_path, keys), f)
+      offsets_pos = f.tell()
+      f.write(bytes(8 * len(keys)))
+      offsets = []
+      for key in keys:
+        offsets.append(f.tell())
+        if key == 'records':
+          records = data[key]
+          _dump((len(records) + RECORDS_CHUNK_SIZE - 1) // \
+                RECORDS_CHUNK_SIZE, f)
+          for i in range(0, len(records), RECORDS_CHUNK_SIZE):
+            _dump(records[i:i + RECORDS_CHUNK_SIZE], f)
+        else:
+          _dump(data[key], f)
+      f.seek(offsets_pos)
+      f.write(struct.pack(f"<{len(keys)}Q", *offsets))
+    os.replace(tmp_path, path)
+  except Exception:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
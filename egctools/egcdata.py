@@ -1,15 +1,83 @@
 import os
-import hashlib
+import copy
 import shutil
-from .parser import unparsed_and_parsed_lines, encode_line
-from .references import get_G_to_G, get_U_to_U, get_A_to_U, get_VC_to_ST, \
-                        get_VC_to_A, get_VC_to_G, update_G_in_G, \
+import hashlib
+import contextlib
+from .parser import unparsed_and_parsed_lines, parsed_line, encode_line, \
+                    ENCODING
+from . import cache as egccache
+from . import graph as egcgraph
+from .linestore import MappedLines
+from .id_generator import IDAllocationIndex
+from .references import REFS_BY_RECORD_TYPE, get_VC_to_ST, \
+                        scan_line, \
+                        update_G_in_G, \
                         update_G_in_VC, update_U_in_U, update_U_in_A, \
-                        update_U_in_M, update_ST_in_VC, update_A_in_VC
-from collections import defaultdict
+                        update_U_in_M, update_ST_in_VC, update_A_in_VC, \
+                        ids_regex, update_ids_in_definition, \
+                        update_ids_in_A, update_ids_in_VC, update_ids_in_M
+from collections import defaultdict, OrderedDict
 from . import pgto
-import lexpr
-import fardes
+from . import profiling
+
+class _LazyRecords:
+    """
+    List-like container of the records of EGCData in lazy mode.
+
+    Records are decoded from the lines on first access and kept in a LRU
+    cache of limited size. Records which are explicitly set (created, updated
+    or deleted records) are kept until they are set again.
+    """
+
+    def __init__(self, lines, lru_size):
+      self._lines = lines
+      self._lru = OrderedDict()
+      self._lru_size = lru_size
+      self._set = {}
+      self._n = len(lines)
+
+    def __len__(self):
+      return self._n
+
+    def __getitem__(self, record_num):
+      if isinstance(record_num, slice):
+        return [self[i] for i in range(*record_num.indices(self._n))]
+      if record_num < 0:
+        record_num += self._n
+      if record_num in self._set:
+        return self._set[record_num]
+      record = self._lru.get(record_num)
+      if record is not None:
+        self._lru.move_to_end(record_num)
+        return record
+      line = self._lines[record_num]
+      if line is None:
+        return None
+      record = parsed_line(line)
+      self._lru[record_num] = record
+      if len(self._lru) > self._lru_size:
+        self._lru.popitem(last=False)
+      return record
+
+    def __setitem__(self, record_num, record):
+      if record_num < 0:
+        record_num += self._n
+      self._lru.pop(record_num, None)
+      self._set[record_num] = record
+
+    def __iter__(self):
+      for i in range(self._n):
+        yield self[i]
+
+    def append(self, record):
+      self._set[self._n] = record
+      self._n += 1
+
+    def truncate(self, n):
+      for record_num in range(n, self._n):
+        self._set.pop(record_num, None)
+        self._lru.pop(record_num, None)
+      self._n = min(n, self._n)
 
 class EGCData:
     """
@@ -41,6 +109,9 @@ class EGCData:
 
     - ``id_exists(record_id)``: Check if record with that ID already exists
     - ``has_unique_id(record)``: Check if a not-yet-added record has a unique ID
+    - ``id_allocation_index()``: Index of the used IDs ending with a number,
+      by prefix, used for generating new IDs (see ``egctools.id_generator``);
+      it is created on first use and kept up to date by the edits
 
     # Finding records
 
@@ -48,6 +119,9 @@ class EGCData:
     - ``line(record_id)``: Get EGC line for a record by its ID
     - ``find_all(record_type)``: Get all records of a given type
     - ``find_all_ids(record_type)``: Get all record IDs of a given type
+    - ``rnums_of(record_type)``: Get the record numbers of the records of a
+      given type (ordered, read-only view); ``rt2rnums`` is a dict of lists
+      of the record numbers of each type
 
     # Editing records
 
@@ -55,6 +129,30 @@ class EGCData:
     - ``update(record_id, record)``: Update a record with new data;
       the record_type is not allowed to change
     - ``delete(record_id)``: Delete a record by ID
+    - ``rename_many(mapping)``: Change the IDs of multiple records
+      at once, given a dict {old_id: new_id}, updating all references
+      to them
+
+    ## Observers
+
+    - ``add_observer(observer)``, ``remove_observer(observer)``: register
+      an object which is notified of the edits, e.g. for maintaining
+      derived data (see ``egctools.stats.StatsObserver``); its method
+      ``before_change(egc_data, record_type, record_id)`` is called before
+      a record (existing, or with the ID of a record to create) is changed,
+      ``after_changes(egc_data)`` after each edit (at the end of a batch)
+      and ``reset(egc_data)`` after a batch is rolled back
+
+    ## Batches
+
+    - ``with egc.batch(): ...``: group multiple edits; the resolution of
+      the references of V/C records to S/T records and the encoding of the
+      lines of the edited records are done once, when the batch ends;
+      if an exception is raised, all edits of the batch are rolled back
+    - ``create_many(records)``, ``update_many(updates)``,
+      ``delete_many(record_ids)``: edit multiple records in a batch,
+      after checking that all IDs are valid; ``updates`` is a dict
+      or a list of (existing_id, record) tuples
 
     # References
 
@@ -71,10 +169,51 @@ class EGCData:
 
     # File handling
 
+    - ``from_file(filename, jobs=N)``: Load the data from a file, decoding
+      the lines using N worker processes (None or 0: one per CPU)
+    - ``from_file(filename, cache=True)``: Load the data from a file,
+      storing the decoded records and the index in a cache file, which is
+      used by later loads, as long as the file content did not change;
+      the cache files are unpickled, thus they are stored in the egctools
+      cache directory of the user (see cache.user_cache_dir), or in
+      ``cache_dir``, never next to the file
+    - ``from_file(filename, lazy=True)``: Load the data from a file,
+      keeping only the lines and the index in memory; the records are
+      decoded when they are accessed (the last ``lru_size`` decoded records
+      are kept in memory); if no cache is available, the index is
+      constructed by scanning the IDs and references in the lines, which
+      are only decoded if their references cannot be scanned (``jobs``
+      is then not used)
+    - ``from_file(filename, graph_backend="compact")``: Load the data from
+      a file, storing the reference graph in integer arrays instead of
+      nested dicts (see ``egctools.graph``), which uses much less memory
+      for large files
+    - ``from_file(filename, mmap_lines=True)``: Load the data from a file,
+      keeping only the offset and length of each line in memory (the lines
+      are read from the memory-mapped file when they are accessed);
+      together with ``lazy=True`` this is suitable for read-mostly uses
+      of large files
+    - ``egctools.sqlindex.IndexedEGCData.from_file(filename)``: use an
+      on-disk SQLite index of the file (created if needed, or using the
+      ``egctools-index`` script), so that records are read from the file
+      only when they are accessed
     - ``save(filename)``: Save the data to a file
     - ``save(filename, True)``: Save the data to a file, and create a
       backup of the original file; the name of the backup file is the original
       filename with an hash appended and the extension '.bak'
+
+    ## Journal
+
+    - ``from_file(filename, journal=True)``: Load the data from a file,
+      and save changes to a journal file (filename with the extension
+      '.egcjournal'), to which ``save()`` only appends the operations
+      (create/update/delete/rename) done since the last save
+    - ``compact()``: Write all records to the file (via a temporary
+      file, which atomically replaces the original file), and remove the
+      journal file; ``save()`` does the same, if not in journal mode
+    - if a journal file exists, ``from_file()`` replays its operations,
+      after loading the file; the journal header contains the size and hash
+      of the file, so that a journal is not applied to a modified file
     """
 
     @staticmethod
@@ -124,12 +263,44 @@ class EGCData:
         return record['id']
 
     def _connect(self, rt1, id1, rt2, id2):
-      self.graph[rt1][id1]['refs'][rt2].append(id2)
-      self.graph[rt2][id2]['ref_by'][rt1].append(id1)
+      self.graph.connect(rt1, id1, rt2, id2)
+
+    def add_observer(self, observer):
+      self._observers.append(observer)
+
+    def remove_observer(self, observer):
+      self._observers.remove(observer)
+
+    def _before_change(self, record_type, record_id):
+      for observer in self._observers:
+        observer.before_change(self, record_type, record_id)
+
+    def _after_changes(self):
+      if self._batch is None:
+        for observer in self._observers:
+          observer.after_changes(self)
+
+    def _reset_observers(self):
+      for observer in self._observers:
+        observer.reset(self)
+
+    def id_allocation_index(self):
+      if self._id_index is None:
+        self._id_index = IDAllocationIndex(self.id2rnum)
+      return self._id_index
+
+    def _id_changed(self, old_id, new_id):
+      if self._id_index is not None:
+        if old_id is not None:
+          self._id_index.remove(old_id)
+        if new_id is not None:
+          self._id_index.add(new_id)
 
     def _update_reference(self, record_id, record_type,
                           ref_type, ref_old_id, ref_new_id):
+      self._before_change(record_type, record_id)
       record_num = self.id2rnum[record_id]
+      self._batch_save(record_num, True)
       record = self.records[record_num]
       if ref_type == 'U':
         if record_type == 'U':
@@ -141,10 +312,10 @@ class EGCData:
           new_M_id = self.record_id(record)
           self.id2rnum[new_M_id] = self.id2rnum[record_id]
           del self.id2rnum[record_id]
-          self.graph['M'][new_M_id] = self.graph['M'][record_id]
-          del self.graph['M'][record_id]
-          self.graph['U'][ref_old_id]['ref_by']['M'].remove(record_id)
-          self.graph['U'][ref_old_id]['ref_by']['M'].append(new_M_id)
+          self._id_changed(record_id, new_M_id)
+          self._rename_node('M', record_id, new_M_id)
+          self.graph.replace_in_ref_by('U', ref_old_id, 'M',
+                                       record_id, new_M_id)
         else:
           assert False
       elif ref_type in ['S', 'T']:
@@ -169,207 +340,684 @@ class EGCData:
         pfx, item = self.parse_composed_id(ref_new_id)
         record['document_id']['item'] = item
         record['document_id']['resource_prefix'] = pfx
-      self.lines[record_num] = encode_line(record)
+      # in lazy mode, setting the record keeps it in memory
+      self.records[record_num] = record
+      self._set_line(record_num)
       return self.record_id(record)
 
+    def _batch_save_node(self, rt, record_id):
+      """
+      Save the records referencing a node, before it is removed or renamed
+      for the first time in the batch, so that the edges from the records
+      which are not edited in the batch can be restored by a rollback.
+      """
+      if self._batch is not None and \
+          (rt, record_id) not in self._batch['nodes'] and \
+          self.graph.has_node(rt, record_id):
+        self._batch['nodes'][(rt, record_id)] = \
+            [(rt2, id2) for rt2 in self.graph.ref_by_types(rt, record_id) \
+                        for id2 in self.graph.ref_by(rt, record_id, rt2)]
+
+    def _remove_node(self, rt, record_id):
+      self._batch_save_node(rt, record_id)
+      self.graph.remove_node(rt, record_id)
+
+    def _rename_node(self, rt, old_id, new_id):
+      self._batch_save_node(rt, old_id)
+      self._batch_save_node(rt, new_id)
+      self.graph.rename_node(rt, old_id, new_id)
+
     def _disconnect(self, rt, record_id):
-      for rt2, id2s in self.graph[rt][record_id]['refs'].items():
-        for id2 in id2s:
-          if 'ref_by' in self.graph[rt2][id2]:
-            if record_id in self.graph[rt2][id2]['ref_by'][rt]:
-              self.graph[rt2][id2]['ref_by'][rt].remove(record_id)
-      for rt2, id2s in self.graph[rt][record_id]['ref_by'].items():
-        for id2 in id2s:
-          if 'refs' in self.graph[rt][record_id]:
-            if record_id in self.graph[rt2][id2]['refs'][rt]:
-              self.graph[rt2][id2]['refs'][rt].remove(record_id)
-      del self.graph[rt][record_id]
+      self._remove_node(rt, record_id)
 
     def _disconnect_ref_and_update_ref_by(self, rt, record_id, new_record_id):
-      for rt2, id2s in self.graph[rt][record_id]['refs'].items():
-        for id2 in id2s:
-          if 'ref_by' in self.graph[rt2][id2]:
-            if record_id in self.graph[rt2][id2]['ref_by'][rt]:
-              self.graph[rt2][id2]['ref_by'][rt].remove(record_id)
-      self.graph[rt][record_id]['refs'] = defaultdict(list)
+      self.graph.clear_refs(rt, record_id)
       if new_record_id != record_id:
-        for rt2, in self.graph[rt][record_id]['ref_by'].keys():
-          ref_by_ids = list(self.graph[rt][record_id]['ref_by'][rt2])
+        self._batch_save_node(rt, record_id)
+        for rt2 in self.graph.ref_by_types(rt, record_id):
+          ref_by_ids = list(self.graph.ref_by(rt, record_id, rt2))
           for id2 in ref_by_ids:
-            if 'refs' in self.graph[rt2][id2]:
-              if record_id in self.graph[rt2][id2]['refs'][rt]:
-                  new_id2 = self._update_reference(id2, rt2,
-                                         rt, record_id, new_record_id)
-                  self.graph[rt2][new_id2]['refs'][rt].remove(record_id)
-                  self.graph[rt2][new_id2]['refs'][rt].append(new_record_id)
-        self.graph[rt][new_record_id] = self.graph[rt][record_id]
-        del self.graph[rt][record_id]
-
-    def _graph_add_S(self, record_id, record):
-      document_id = self.compute_docid(record)
-      self._connect('S', record_id, 'D', document_id)
-
-    def _graph_add_T(self, record_id, record):
-      document_id = self.compute_docid(record)
-      self._connect('T', record_id, 'D', document_id)
-
-    def _graph_add_G(self, record_id, record):
-      for parent_id in get_G_to_G(record):
-        self._connect('G', record_id, 'G', parent_id)
-
-    def _graph_add_U(self, record_id, record):
-      for parent_id in get_U_to_U(record):
-        self._connect('U', record_id, 'U', parent_id)
-
-    def _graph_add_A(self, record_id, record):
-      for unit_id in get_A_to_U(record):
-        self._connect('A', record_id, 'U', unit_id)
-
-    def _graph_add_M(self, record_id, record):
-      self._connect('M', record_id, 'U', record['unit_id'])
-
-    def _graph_add_VC(self, rt, record_id, record):
+            if self.graph.has_edge(rt2, id2, rt, record_id):
+              new_id2 = self._update_reference(id2, rt2,
+                                     rt, record_id, new_record_id)
+              self.graph.replace_in_refs(rt2, new_id2, rt,
+                                         record_id, new_record_id)
+        self._rename_node(rt, record_id, new_record_id)
+
+    def _graph_add_VC_to_ST(self, rt, record_id, record):
       for source_id in get_VC_to_ST(record):
-        self.graph['S_or_T'][source_id]['ref_by'][rt].append(record_id)
-      for attribute_id in get_VC_to_A(record):
-        self._connect(rt, record_id, 'A', attribute_id)
-      for group_id in get_VC_to_G(record):
-        self._connect(rt, record_id, 'G', group_id)
-
-    def _graph_add_V(self, record_id, record):
-      self._graph_add_VC('V', record_id, record)
-
-    def _graph_add_C(self, record_id, record):
-      self._graph_add_VC('C', record_id, record)
-
-    def _graph_add_D(self, record_id, record):
-      pass
+        self._VC_to_S_or_T[source_id][rt][record_id] = None
 
     def _graph_solve_VC_ST(self):
-      for source_id in self.graph['S_or_T'].keys():
-        for rt2 in self.graph['S_or_T'][source_id]['ref_by']:
-          for record_id in self.graph['S_or_T'][source_id]['ref_by'][rt2]:
-            rt = 'S' if source_id in self.graph['S'] else 'T'
-            self._connect(rt2, record_id, rt, source_id)
-      del self.graph['S_or_T']
+      # the V/C records reference S or T records by ID, thus the
+      # type of the referenced record is only known when all S records
+      # have been added to the graph
+      with profiling.timer("egcdata.solve_VC_ST") as t:
+        for source_id, ref_by in self._VC_to_S_or_T.items():
+          rt = 'S' if self.graph.has_node('S', source_id) else 'T'
+          for rt2, record_ids in ref_by.items():
+            for record_id in record_ids:
+              self._connect(rt2, record_id, rt, source_id)
+          t.n_records += 1
+      self._VC_to_S_or_T = defaultdict(lambda: defaultdict(dict))
+
+    def _graph_unsolved_VC_ST_remove(self, rt, record_id, record):
+      for source_id in get_VC_to_ST(record):
+        if source_id in self._VC_to_S_or_T:
+          self._VC_to_S_or_T[source_id][rt].pop(record_id, None)
+
+    def _graph_before_edit(self, rt, record_id, record):
+      # references of V/C records to S/T records are not yet resolved
+      # inside a batch: resolve them before editing S/T records and
+      # forget them before editing the V/C records
+      if self._VC_to_S_or_T:
+        if rt in ['S', 'T']:
+          self._graph_solve_VC_ST()
+        elif rt in ['V', 'C']:
+          self._graph_unsolved_VC_ST_remove(rt, record_id, record)
 
     def _graph_add_record(self, record_id, record, solve_VC_ST = False):
       rt = record['record_type']
-      getattr(self, '_graph_add_' + rt)(record_id, record)
+      if rt in ['V', 'C']:
+        self._graph_add_VC_to_ST(rt, record_id, record)
+      for ref_type, get_ids in REFS_BY_RECORD_TYPE[rt]:
+        for ref_id in get_ids(record):
+          self._connect(rt, record_id, ref_type, ref_id)
       if solve_VC_ST:
         self._graph_solve_VC_ST()
 
-    def _create_index(self):
-      for i, record in enumerate(self.records):
-        rt = record['record_type']
-        self.rt2rnums[rt].append(i)
-        record_id = self.record_id(record)
-        self.id2rnum[record_id] = i
+    def _index_record(self, record_num, record):
+      rt = record['record_type']
+      self._rt2rnums[rt][record_num] = None
+      record_id = self.record_id(record)
+      self.id2rnum[record_id] = record_num
+      with profiling.timer("egcdata.graph", 1):
         self._graph_add_record(record_id, record)
+
+    def _index_line(self, record_num, line):
+      # as _index_record, but without decoding the line, if the ID and the
+      # references of the record can be scanned (see references.scan_line)
+      scanned = scan_line(line)
+      if scanned is None:
+        profiling.count("egcdata.decoded_lines")
+        self._index_record(record_num, parsed_line(line))
+        return
+      record, refs = scanned
+      rt = record['record_type']
+      self._rt2rnums[rt][record_num] = None
+      record_id = self.record_id(record)
+      self.id2rnum[record_id] = record_num
+      with profiling.timer("egcdata.graph", 1):
+        if rt in ['V', 'C']:
+          self._graph_add_VC_to_ST(rt, record_id, record)
+        for ref_type, ref_id in refs:
+          self._connect(rt, record_id, ref_type, ref_id)
+
+    def _finalize_graph(self):
       self._graph_solve_VC_ST()
+      with profiling.timer("egcdata.graph_finalize"):
+        self.graph.finalize()
 
-    def __init__(self, file_path, records = [], lines = []):
+    def _create_index(self):
+      with profiling.timer("egcdata.index") as t:
+        for i, record in enumerate(self.records):
+          if record is not None:
+            self._index_record(i, record)
+            t.n_records += 1
+        self._finalize_graph()
+
+    def __init__(self, file_path, records = [], lines = [],
+                 graph_backend = "dict"):
         self.file_path = file_path
         self.records = records
         self.lines = lines
         if len(lines) != len(records):
           raise ValueError('Number of lines does not match number of records')
+        self.journal = False
+        self._journal_pending = []
+        self._batch = None
+        self._observers = []
+        self._id_index = None
+        self._file_sha256 = None
         self.id2rnum = {}
-        self.rt2rnums = defaultdict(list)
-        self.graph = defaultdict(\
-                lambda: defaultdict(lambda: {
-                           'ref_by': defaultdict(list),
-                           'refs': defaultdict(list)}))
+        # record numbers of each record type, as ordered sets (dicts with
+        # None values), so that deleted records are removed in constant time
+        self._rt2rnums = defaultdict(dict)
+        self.graph_backend = graph_backend
+        self.graph = egcgraph.create(graph_backend)
+        self._VC_to_S_or_T = defaultdict(lambda: defaultdict(dict))
         if len(records) > 0:
           self._create_index()
 
+    def _index_data(self):
+      return {'id2rnum': self.id2rnum, 'rt2rnums': dict(self._rt2rnums),
+              'graph_backend': self.graph_backend,
+              'graph': self.graph.to_data()}
+
+    def _set_index_data(self, index_data):
+      self.id2rnum = index_data['id2rnum']
+      self._rt2rnums.update(index_data['rt2rnums'])
+      self.graph = egcgraph.GRAPH_BACKENDS[self.graph_backend].\
+                     from_data(index_data['graph'])
+
+    LRU_SIZE = 10000
+
     @classmethod
-    def from_file(cls, file_path, backup=False):
+    def from_file(cls, file_path, backup=False, jobs=1,
+                  cache=False, cache_dir=None, lazy=False, lru_size=LRU_SIZE,
+                  journal=False, graph_backend="dict", mmap_lines=False):
         if not os.path.exists(file_path):
           raise FileNotFoundError('File not found: {}'.format(file_path))
-        records = []
-        lines = []
-        for unparsed, parsed in unparsed_and_parsed_lines(file_path):
-          lines.append(unparsed)
-          records.append(parsed)
         if backup:
           backup_file_path = EGCData._get_backup_file_path(file_path)
           if not os.path.exists(backup_file_path):
             shutil.copyfile(file_path, backup_file_path)
-        return cls(file_path, records, lines)
+        egc_data = cls(file_path, [], [], graph_backend)
+        def has_index(cached):
+          return cached is not None and 'index' in cached and \
+              cached['index'].get('graph_backend', 'dict') == graph_backend
+        with profiling.timer("egcdata.load") as load_timer:
+          cached = None
+          if cache:
+            index_keys = ['index'] if mmap_lines else ['lines', 'index']
+            if not lazy:
+              index_keys.append('records')
+            cached = egccache.load(file_path, cache_dir, index_keys)
+            if not has_index(cached):
+              cached = egccache.load(file_path, cache_dir,
+                                     ['lines', 'records'])
+          if has_index(cached):
+            lines = cached.get('lines')
+            records = cached.get('records')
+            with profiling.timer("egcdata.load_index"):
+              egc_data._set_index_data(cached['index'])
+          else:
+            with profiling.timer("egcdata.index") as t:
+              lines = []
+              records = None if lazy else []
+              if lazy and cached is None:
+                # the lines are only decoded if they cannot be scanned
+                with open(file_path, encoding=ENCODING) as f:
+                  for i, line in enumerate(f):
+                    line = line.rstrip("\n")
+                    lines.append(line)
+                    egc_data._index_line(i, line)
+              else:
+                if cached is not None:
+                  decoded = zip(cached['lines'], cached['records'])
+                else:
+                  decoded = unparsed_and_parsed_lines(file_path, jobs)
+                for i, (unparsed, parsed) in enumerate(decoded):
+                  lines.append(unparsed)
+                  if not lazy:
+                    records.append(parsed)
+                  egc_data._index_record(i, parsed)
+              egc_data._finalize_graph()
+              t.n_records = len(lines)
+            if cache:
+              data = {'lines': lines, 'index': egc_data._index_data()}
+              if not lazy:
+                data['records'] = records
+              elif cached is not None:
+                data['records'] = cached['records']
+              egccache.store(file_path, data, cache_dir)
+          if mmap_lines:
+            lines = MappedLines(file_path)
+          egc_data.lines = lines
+          egc_data.records = _LazyRecords(lines, lru_size) if lazy \
+                             else records
+          egc_data._replay_journal()
+          load_timer.n_records = len(egc_data.lines)
+        egc_data.journal = journal
+        return egc_data
 
     @staticmethod
     def _get_backup_file_path(file_path, prefix_length=8):
       # Calculate the hash of the original file content
-        hasher = hashlib.sha256()
-        with open(file_path, 'rb') as f:
-          hasher.update(f.read())
-        hash_prefix = hasher.hexdigest()[:prefix_length]
+        hash_prefix = egccache.file_sha256(file_path)[:prefix_length]
 
         # Construct the backup file path
         backup_file_path = f"{file_path}.{hash_prefix}.bak"
         return backup_file_path
 
-    def save(self, backup=False):
-      if backup:
-        backup_file_path = EGCData._get_backup_file_path(self.file_path)
-        if not os.path.exists(backup_file_path):
-          shutil.copyfile(self.file_path, backup_file_path)
+    JOURNAL_SUFFIX = ".egcjournal"
+    JOURNAL_VERSION = "1"
 
-      with open(self.file_path, 'w') as f:
+    @staticmethod
+    def journal_path(file_path):
+      return file_path + EGCData.JOURNAL_SUFFIX
+
+    def _get_file_sha256(self):
+      if self._file_sha256 is None:
+        self._file_sha256 = egccache.file_sha256(self.file_path)
+      return self._file_sha256
+
+    def _backup(self, prefix_length=8):
+      backup_file_path = \
+          f"{self.file_path}.{self._get_file_sha256()[:prefix_length]}.bak"
+      if not os.path.exists(backup_file_path):
+        shutil.copyfile(self.file_path, backup_file_path)
+
+    def _journal_header(self):
+      return "\t".join(["#egcjournal", self.JOURNAL_VERSION,
+                        str(os.path.getsize(self.file_path)),
+                        self._get_file_sha256()])
+
+    def _journal_add(self, op, *args):
+      if not self.journal:
+        return
+      self._journal_pending.append("\t".join((op,) + args))
+
+    def _replay_journal(self):
+      journal_path = self.journal_path(self.file_path)
+      if not os.path.exists(journal_path):
+        return
+      with open(journal_path, encoding=ENCODING) as f:
+        header = f.readline().rstrip("\n")
+        if header != self._journal_header():
+          raise ValueError('Journal file {} does not match the file {}'.\
+              format(journal_path, self.file_path))
+        for entry in f:
+          op, data = entry.rstrip("\n").split("\t", 1)
+          if op == "create":
+            self.create(parsed_line(data))
+          elif op == "update":
+            existing_id, line = data.split("\t", 1)
+            self.update(existing_id, parsed_line(line))
+          elif op == "delete":
+            self.delete(data)
+          elif op == "rename":
+            record_ids = data.split("\t")
+            self.rename_many(dict(zip(record_ids[::2], record_ids[1::2])))
+          else:
+            raise ValueError('Invalid journal entry: {}'.format(entry))
+      self._journal_pending = []
+
+    def _write_journal(self):
+      journal_path = self.journal_path(self.file_path)
+      new_journal = not os.path.exists(journal_path)
+      with open(journal_path, 'a', encoding=ENCODING) as f:
+        if new_journal:
+          f.write(self._journal_header() + "\n")
+        for entry in self._journal_pending:
+          f.write(entry + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+      self._journal_pending = []
+
+    def compact(self, backup=False):
+      """
+      Write all records to the file and remove the journal.
+
+      The data is written to a temporary file, which atomically replaces
+      the original file. If backup is True, a backup of the original file
+      is created before replacing it.
+      """
+      if backup:
+        self._backup()
+      self._encode_dirty_lines()
+      tmp_file_path = f"{self.file_path}.{os.getpid()}.tmp"
+      hasher = hashlib.sha256()
+      with open(tmp_file_path, 'wb') as f:
         for line in self.lines:
           if line is not None:
-            f.write(line + "\n")
+            data = (line + "\n").encode(ENCODING)
+            f.write(data)
+            hasher.update(data)
+        f.flush()
+        os.fsync(f.fileno())
+      if os.path.exists(self.file_path):
+        shutil.copymode(self.file_path, tmp_file_path)
+      os.replace(tmp_file_path, self.file_path)
+      if isinstance(self.lines, MappedLines):
+        self.lines.remap(self.file_path)
+      self._file_sha256 = hasher.hexdigest()
+      journal_path = self.journal_path(self.file_path)
+      if os.path.exists(journal_path):
+        os.remove(journal_path)
+      self._journal_pending = []
+
+    def save(self, backup=False):
+      if self.journal:
+        if backup:
+          self._backup()
+        self._write_journal()
+      else:
+        self.compact(backup)
 
     def create(self, record_data):
       record_id = self.record_id(record_data)
       if record_id in self.id2rnum:
           raise ValueError('Record already exists: {}'.format(record_id))
+      rt = record_data["record_type"]
+      self._before_change(rt, record_id)
       self.records.append(record_data)
-      self.lines.append(encode_line(record_data))
+      self.lines.append(None)
       record_num = len(self.records) - 1
+      self._set_line(record_num, self.journal)
+      self._journal_add("create", self.lines[record_num])
       self.id2rnum[record_id] = record_num
-      rt = record_data["record_type"]
-      self.rt2rnums[rt].append(record_num)
-      self._graph_add_record(record_id, record_data, True)
+      self._id_changed(None, record_id)
+      self._rt2rnums[rt][record_num] = None
+      self._graph_add_record(record_id, record_data, self._batch is None)
+      self._after_changes()
 
     def delete(self, record_id):
       if record_id not in self.id2rnum:
           raise ValueError('Record does not exist: {}'.format(record_id))
       record_num = self.id2rnum[record_id]
-      record_type = self.records[record_num]["record_type"]
-      self.rt2rnums[record_type].remove(record_num)
+      self._batch_save(record_num)
+      record = self.records[record_num]
+      record_type = record["record_type"]
+      self._before_change(record_type, record_id)
+      self._graph_before_edit(record_type, record_id, record)
+      del self._rt2rnums[record_type][record_num]
       self.records[record_num] = None
       self.lines[record_num] = None
       self._disconnect(record_type, record_id)
       del self.id2rnum[record_id]
+      self._id_changed(record_id, None)
+      self._journal_add("delete", record_id)
+      self._after_changes()
 
     def update(self, existing_id, updated_data):
       if existing_id not in self.id2rnum:
           raise ValueError('Record does not exist: {}'.format(existing_id))
       record_num = self.id2rnum[existing_id]
-      record_type = self.records[record_num]["record_type"]
+      record = self.records[record_num]
+      record_type = record["record_type"]
       if record_type != updated_data["record_type"]:
           raise ValueError('Record type cannot be changed')
       updated_id = self.record_id(updated_data)
       if updated_id != existing_id:
           if updated_id in self.id2rnum:
               raise ValueError('Record already exists: {}'.format(updated_id))
+      self._before_change(record_type, existing_id)
+      if updated_id != existing_id:
+        self._before_change(record_type, updated_id)
+      self._batch_save(record_num)
+      self._graph_before_edit(record_type, existing_id, record)
+      if updated_id != existing_id:
           self.id2rnum[updated_id] = record_num
           del self.id2rnum[existing_id]
+          self._id_changed(existing_id, updated_id)
       self.records[record_num] = updated_data
-      self.lines[record_num] = encode_line(updated_data)
-      record_type = updated_data["record_type"]
+      self._set_line(record_num, self.journal)
+      self._journal_add("update", existing_id, self.lines[record_num])
       self._disconnect_ref_and_update_ref_by(\
           record_type, existing_id, updated_id)
-      self._graph_add_record(updated_id, updated_data, True)
+      self._graph_add_record(updated_id, updated_data, self._batch is None)
+      self._after_changes()
+
+    def _set_line(self, record_num, now=False):
+      if self._batch is None or now:
+        self.lines[record_num] = encode_line(self.records[record_num])
+        if self._batch is not None:
+          self._batch['dirty'].discard(record_num)
+      else:
+        self._batch['dirty'].add(record_num)
+
+    def _encode_dirty_lines(self):
+      if self._batch is not None:
+        for record_num in sorted(self._batch['dirty']):
+          if self.records[record_num] is not None:
+            self.lines[record_num] = encode_line(self.records[record_num])
+        self._batch['dirty'] = set()
+
+    def _batch_save(self, record_num, copy_record=False):
+      """
+      Save the record and line of a record existing before the batch
+      started, before they are edited for the first time in the batch.
+      """
+      if self._batch is not None and \
+          record_num < self._batch['n_records'] and \
+          record_num not in self._batch['saved']:
+        record = self.records[record_num]
+        if copy_record:
+          record = copy.deepcopy(record)
+        self._batch['saved'][record_num] = (record, self.lines[record_num])
+
+    @contextlib.contextmanager
+    def batch(self):
+      """
+      Context manager for grouping multiple edits.
+
+      The resolution of the references of V/C to S/T records and the
+      encoding of the edited lines are done at the end of the batch.
+      If an exception is raised, all edits of the batch are rolled back.
+      Nested batches are part of the outermost batch.
+      """
+      if self._batch is not None:
+        yield self
+        return
+      self._batch = {'n_records': len(self.records),
+                     'n_journal_pending': len(self._journal_pending),
+                     'saved': {}, 'nodes': {}, 'dirty': set()}
+      try:
+        yield self
+        self._graph_solve_VC_ST()
+        self._encode_dirty_lines()
+        for observer in self._observers:
+          observer.after_changes(self)
+      except BaseException:
+        self._rollback_batch()
+        raise
+      finally:
+        self._batch = None
+
+    def _rollback_batch(self):
+      # only the index and graph entries of the records edited in the batch
+      # are rolled back, thus in lazy mode no other record is decoded
+      b = self._batch
+      edited = set(b['saved']) | set(range(b['n_records'], len(self.records)))
+      self._VC_to_S_or_T = defaultdict(lambda: defaultdict(dict))
+      nodes = []
+      for record_num in edited:
+        record = self.records[record_num]
+        if record is not None:
+          rt = record['record_type']
+          record_id = self.record_id(record)
+          del self._rt2rnums[rt][record_num]
+          del self.id2rnum[record_id]
+          self._id_changed(record_id, None)
+          self.graph.clear_refs(rt, record_id)
+          nodes.append((rt, record_id))
+      # nodes still referenced by other records are kept,
+      # as for referenced IDs without a record
+      for rt, record_id in nodes:
+        if self.graph.has_node(rt, record_id) and \
+            not self.graph.is_ref_by(rt, record_id):
+          self.graph.remove_node(rt, record_id)
+      for record_num, (record, line) in b['saved'].items():
+        self.records[record_num] = record
+        self.lines[record_num] = line
+      if isinstance(self.records, _LazyRecords):
+        self.records.truncate(b['n_records'])
+      else:
+        del self.records[b['n_records']:]
+      del self.lines[b['n_records']:]
+      del self._journal_pending[b['n_journal_pending']:]
+      self._batch = None
+      restored_types = set()
+      for record_num, (record, line) in b['saved'].items():
+        if record is not None:
+          self._index_record(record_num, record)
+          self._id_changed(None, self.record_id(record))
+          restored_types.add(record['record_type'])
+      for rt in restored_types:
+        self._rt2rnums[rt] = dict.fromkeys(sorted(self._rt2rnums[rt]))
+      # edges from the records not edited in the batch to the nodes
+      # removed or renamed in the batch
+      for (rt, record_id), ref_by in b['nodes'].items():
+        for rt2, id2 in ref_by:
+          record_num = self.id2rnum.get(id2)
+          if record_num is not None and record_num not in edited:
+            self._connect(rt2, id2, rt, record_id)
+      self._graph_solve_VC_ST()
+      self._reset_observers()
+
+    def create_many(self, records):
+      record_ids = set()
+      for record in records:
+        record_id = self.record_id(record)
+        if record_id in self.id2rnum or record_id in record_ids:
+          raise ValueError('Record already exists: {}'.format(record_id))
+        record_ids.add(record_id)
+      with self.batch():
+        for record in records:
+          self.create(record)
+
+    def update_many(self, updates):
+      if isinstance(updates, dict):
+        updates = list(updates.items())
+      existing_ids = set()
+      updated_ids = set()
+      for existing_id, updated_data in updates:
+        if existing_id not in self.id2rnum or existing_id in existing_ids:
+          raise ValueError('Record does not exist: {}'.format(existing_id))
+        existing_ids.add(existing_id)
+        record = self.records[self.id2rnum[existing_id]]
+        if record["record_type"] != updated_data["record_type"]:
+          raise ValueError('Record type cannot be changed')
+        updated_id = self.record_id(updated_data)
+        if updated_id in updated_ids or \
+            (updated_id != existing_id and updated_id in self.id2rnum):
+          raise ValueError('Record already exists: {}'.format(updated_id))
+        updated_ids.add(updated_id)
+      with self.batch():
+        for existing_id, updated_data in updates:
+          self.update(existing_id, updated_data)
+
+    def delete_many(self, record_ids):
+      to_delete = set()
+      for record_id in record_ids:
+        if record_id not in self.id2rnum or record_id in to_delete:
+          raise ValueError('Record does not exist: {}'.format(record_id))
+        to_delete.add(record_id)
+      with self.batch():
+        for record_id in record_ids:
+          self.delete(record_id)
+
+    def _check_rename(self, mapping):
+      renamed = defaultdict(dict)
+      for old_id, new_id in mapping.items():
+        if old_id not in self.id2rnum:
+          raise ValueError('Record does not exist: {}'.format(old_id))
+        rt = self.records[self.id2rnum[old_id]]['record_type']
+        if rt == 'M':
+          raise ValueError('The ID of a M record cannot be changed '+\
+              'directly: {}'.format(old_id))
+        elif rt == 'D':
+          if not new_id.startswith('D-'):
+            raise ValueError('Invalid document ID: {}'.format(new_id))
+          self.parse_composed_id(new_id)
+        renamed[rt][old_id] = new_id
+      new_ids = set()
+      for new_id in mapping.values():
+        if new_id in new_ids or \
+            (new_id in self.id2rnum and new_id not in mapping):
+          raise ValueError('Record already exists: {}'.format(new_id))
+        new_ids.add(new_id)
+      return renamed
+
+    def _rename_in_record(self, record, record_id, mapping, regexes):
+      rt = record['record_type']
+      if rt in ['D', 'S', 'T']:
+        document_id = self.compute_docid(record)
+        if document_id in mapping:
+          pfx, item = self.parse_composed_id(mapping[document_id])
+          record['document_id']['resource_prefix'] = pfx
+          record['document_id']['item'] = item
+      if rt != 'D' and record_id in mapping:
+        record['id'] = mapping[record_id]
+      if rt in regexes:
+        update_ids_in_definition(record, regexes[rt], mapping)
+      elif rt == 'A':
+        update_ids_in_A(record, mapping)
+      elif rt == 'M':
+        update_ids_in_M(record, mapping)
+      elif rt in ['V', 'C']:
+        update_ids_in_VC(record, mapping)
+
+    def rename_many(self, mapping):
+      """
+      Change the IDs of multiple records, given a dict {old_id: new_id},
+      and update the references to them.
+
+      The IDs are changed simultaneously, thus e.g. two IDs can be swapped.
+      The records referencing the renamed records are collected from the
+      graph; all renamed IDs are replaced in the G and U definitions using
+      a single regular expression and each changed line is encoded once.
+      The IDs of M records are changed by renaming their unit.
+      """
+      mapping = {old_id: new_id for old_id, new_id in mapping.items() \
+                 if old_id != new_id}
+      renamed = self._check_rename(mapping)
+      if not mapping:
+        return
+      self._graph_solve_VC_ST()
+      # records to change: the renamed records and those referencing them
+      changed = {}
+      for rt, rt_mapping in renamed.items():
+        for old_id in rt_mapping:
+          changed[self.id2rnum[old_id]] = old_id
+          for rt2 in self.graph.ref_by_types(rt, old_id):
+            for id2 in self.graph.ref_by(rt, old_id, rt2):
+              if id2 in self.id2rnum:
+                changed[self.id2rnum[id2]] = id2
+      # G definitions only reference G records, U definitions U records
+      regexes = {rt: ids_regex(renamed[rt]) for rt in ['G', 'U'] \
+                 if rt in renamed}
+      for record_num, record_id in changed.items():
+        self._before_change(self.records[record_num]['record_type'],
+                            record_id)
+      for rt, rt_mapping in renamed.items():
+        for new_id in rt_mapping.values():
+          self._before_change(rt, new_id)
+      new_record_ids = {}
+      for record_num, record_id in changed.items():
+        self._batch_save(record_num, True)
+        record = self.records[record_num]
+        rt = record['record_type']
+        self.graph.clear_refs(rt, record_id)
+        self._rename_in_record(record, record_id, mapping, regexes)
+        self.records[record_num] = record
+        self._set_line(record_num)
+        new_record_id = self.record_id(record)
+        if new_record_id != record_id:
+          del self.id2rnum[record_id]
+          self._id_changed(record_id, None)
+          self._remove_node(rt, record_id)
+        new_record_ids[record_num] = new_record_id
+      for record_num, new_record_id in new_record_ids.items():
+        if new_record_id not in self.id2rnum:
+          self._id_changed(None, new_record_id)
+        self.id2rnum[new_record_id] = record_num
+        self._graph_add_record(new_record_id, self.records[record_num])
+      if self._batch is None:
+        self._graph_solve_VC_ST()
+      self._journal_add("rename",
+          *[record_id for item in mapping.items() for record_id in item])
+      self._after_changes()
+
+    def rnums_of(self, record_type):
+      return self._rt2rnums[record_type].keys()
+
+    @property
+    def rt2rnums(self):
+      rt2rnums = defaultdict(list)
+      for rt in REFS_BY_RECORD_TYPE:
+        rnums = list(self.rnums_of(rt))
+        if rnums:
+          rt2rnums[rt] = rnums
+      return rt2rnums
 
     def find_all(self, record_type):
-      return [self.records[i] for i in self.rt2rnums[record_type]]
+      return [self.records[i] for i in self.rnums_of(record_type)]
 
     def find_all_ids(self, record_type):
       return [self.record_id(self.records[i]) \
-          for i in self.rt2rnums[record_type]]
+          for i in self.rnums_of(record_type)]
 
     def find(self, record_id):
       record_num = self.id2rnum[record_id]
@@ -379,6 +1027,8 @@ class EGCData:
 
     def line(self, record_id):
       record_num = self.id2rnum[record_id]
+      if self._batch is not None and record_num in self._batch['dirty']:
+        self._set_line(record_num, True)
       return self.lines[record_num]
 
     def get_record(self, record_data):
@@ -392,10 +1042,10 @@ class EGCData:
       return record_id in self.id2rnum
 
     def _refs_ids(self, rt, record_id, ref_rt):
-      return self.graph[rt][record_id]['refs'][ref_rt]
+      return self.graph.refs(rt, record_id, ref_rt)
 
     def _ref_by_ids(self, rt, record_id, ref_by_rt):
-      return self.graph[rt][record_id]['ref_by'][ref_by_rt]
+      return self.graph.ref_by(rt, record_id, ref_by_rt)
 
     def refs(self, rt, record_id, ref_rt):
       return [self.find(ref_id) \
@@ -413,14 +1063,7 @@ class EGCData:
 
     def is_ref_by(self, record_id):
       record = self.records[self.id2rnum[record_id]]
-      rt = record['record_type']
-      if rt in self.graph:
-        if record_id in self.graph[rt]:
-          if 'ref_by' in self.graph[rt][record_id]:
-            for rt2 in self.graph[rt][record_id]['ref_by']:
-              if self.graph[rt][record_id]['ref_by'][rt2]:
-                return True
-      return False
+      return self.graph.is_ref_by(record['record_type'], record_id)
 
     @staticmethod
     def pgto_choices():
@@ -432,19 +1075,27 @@ class EGCData:
 
     @staticmethod
     def validate_fardes(fardes_str):
+      import fardes
       try:
         fardes.parse(fardes_str)
         return True
       except Exception:
         return False
 
-    _lexpr_parser = lexpr.Parser()
+    _lexpr_parser = None
+
+    @staticmethod
+    def _get_lexpr_parser():
+      if EGCData._lexpr_parser is None:
+        import lexpr
+        EGCData._lexpr_parser = lexpr.Parser()
+      return EGCData._lexpr_parser
 
     @staticmethod
     def validate_lexpr(lexpr_str):
-      EGCData._lexpr_parser.parse(lexpr_str)
+      EGCData._get_lexpr_parser().parse(lexpr_str)
       return True
 
     @staticmethod
     def get_lexpr_ids(lexpr_str):
-      return EGCData._lexpr_parser.list_identifiers(lexpr_str)
+      return EGCData._get_lexpr_parser().list_identifiers(lexpr_str)
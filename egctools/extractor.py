@@ -1,186 +1,262 @@
-import textformats
-import importlib.resources
-from .index import create as create_index
-from .parser import parsed_line
-_data = importlib.resources.files("egctools").joinpath("data")
-_egcspec = _data.joinpath("egc-spec")
-_specfile = _egcspec.joinpath("egc.tf.yaml")
-SPEC = textformats.Specification(str(_specfile))
-
-def _extract_V_or_C(rule_rt, rule_id, lines, lines_idx, skip, indent, indented,
-                    numbered, follow_G, exclude_G_id, follow_A, exclude_A_id,
-                    follow_ST):
-  n = lines_idx[rule_rt][rule_id]['line']
-  nstr = f"[{n+1}]\t" if numbered else ""
-  results = [nstr + indent + lines[n]]
-  skip.append(rule_id)
-  indent1 = indent + "  " if indented else ""
+#
+# Extraction of a record and of the records connected to it
+#
+# The connected records are visited according to the rules described in
+# extraction_plan.txt: for each type of the extracted record, the types of
+# the records which are visited (->: referenced by the record, <-: referencing
+# the record) or not visited (!), recursively (r) or except the record from
+# which they were reached (*); UM are U records, with the M records
+# referencing them. Each record is output only once.
+#
+# The traversal is done by a loop over an explicit stack of generators
+# (one for each visited record, see the _visit_* functions), which yield
+# either an output line or a further record to visit. The lines are
+# output as soon as they are found, so that the memory used does not
+# depend on the size of the output.
+#
+# The records and their connections are taken from an EGCData object
+# (its lines and its reference graph), so that an already loaded dataset
+# can be used without parsing the file again.
+#
+from .egcdata import EGCData
+from . import profiling
+
+def _visit_V_or_C(ctx, depth, rule_rt, rule_id, follow_G, exclude_G_id,
+                  follow_A, exclude_A_id, follow_ST):
+  refs, skip = ctx['refs'], ctx['skip']
+  yield (depth, None, rule_id)
+  skip.add(rule_id)
   if follow_G:
-    for group_id in lines_idx[rule_rt][rule_id]['refs']['G']:
+    for group_id in refs(rule_rt, rule_id, 'G'):
       if group_id != exclude_G_id and group_id not in skip:
-        results.extend(_extract_G(group_id, lines, lines_idx, skip,
-                indent1, indented, numbered, True, False, exclude_G_id, False))
+        yield (depth + 1, _visit_G,
+               (group_id, True, False, exclude_G_id, False))
   if follow_A:
-    for attr_id in lines_idx[rule_rt][rule_id]['refs']['A']:
+    for attr_id in refs(rule_rt, rule_id, 'A'):
       if attr_id != exclude_A_id and attr_id not in skip:
-        results.extend(_extract_A(attr_id, lines, lines_idx, skip,
-                            indent1, indented, numbered, True, None, False))
+        yield (depth + 1, _visit_A, (attr_id, True, None, False))
   if follow_ST:
     for source_rt in ['S', 'T']:
-      for source_id in lines_idx[rule_rt][rule_id]['refs'][source_rt]:
+      for source_id in refs(rule_rt, rule_id, source_rt):
         if source_id not in skip:
-          results.extend(_extract_S_or_T(source_rt, source_id, lines, lines_idx,
-            skip, indent1, indented, numbered, True, False))
-  return results
-
-def _extract_S_or_T(source_rt, source_id, lines, lines_idx, skip, indent,
-                    indented, numbered, follow_D, climb_VC):
-  n = lines_idx[source_rt][source_id]['line']
-  nstr = f"[{n+1}]\t" if numbered else ""
-  results = [nstr + indent + lines[n]]
-  skip.append(source_id)
-  line = parsed_line(lines[n])
-  document_id_dt = SPEC["external_resource::external_resource_link"]
-  document_id = document_id_dt.encode(line['document_id'])
-  indent1 = indent + "  " if indented else ""
+          yield (depth + 1, _visit_S_or_T,
+                 (source_rt, source_id, True, False))
+
+def _visit_S_or_T(ctx, depth, source_rt, source_id, follow_D, climb_VC):
+  refs, ref_by, skip = ctx['refs'], ctx['ref_by'], ctx['skip']
+  yield (depth, None, source_id)
+  skip.add(source_id)
   if follow_D:
-    if document_id not in skip:
-      results.extend(_extract_D(document_id, lines, lines_idx, skip,
-                                indent1, indented, numbered, False))
+    for document_id in refs(source_rt, source_id, 'D'):
+      if document_id not in skip:
+        yield (depth + 1, _visit_D, (document_id, False))
   if climb_VC:
     for rt in ['V', 'C']:
-      for line_id in lines_idx[source_rt][source_id]['ref_by'][rt]:
+      for line_id in ref_by(source_rt, source_id, rt):
         if line_id not in skip:
-          results.extend(_extract_V_or_C(rt, line_id, lines, lines_idx, skip,
-            indent1, indented, numbered, True, None, True, None, False))
-  return results
-
-def _extract_A(attr_id, lines, lines_idx, skip, indent, indented, numbered,
-               follow_U, exclude_U_id, climb_VC):
-  n = lines_idx['A'][attr_id]['line']
-  nstr = f"[{n+1}]\t" if numbered else ""
-  results = [nstr + indent + lines[n]]
-  skip.append(attr_id)
-  indent1 = indent + "  " if indented else ""
+          yield (depth + 1, _visit_V_or_C,
+                 (rt, line_id, True, None, True, None, False))
+
+def _visit_A(ctx, depth, attr_id, follow_U, exclude_U_id, climb_VC):
+  refs, ref_by, skip = ctx['refs'], ctx['ref_by'], ctx['skip']
+  yield (depth, None, attr_id)
+  skip.add(attr_id)
   if follow_U:
-    for unit_id in lines_idx['A'][attr_id]['refs']['U']:
+    for unit_id in refs('A', attr_id, 'U'):
       if unit_id != exclude_U_id and unit_id not in skip:
-        results.extend(_extract_U(unit_id, lines, lines_idx, skip, indent1,
-                indented, numbered, True, False, exclude_U_id, True, False))
+        yield (depth + 1, _visit_U,
+               (unit_id, True, False, exclude_U_id, True, False))
   if climb_VC:
     for rt in ['V', 'C']:
-      for line_id in lines_idx['A'][attr_id]['ref_by'][rt]:
+      for line_id in ref_by('A', attr_id, rt):
         if line_id not in skip:
-          results.extend(_extract_V_or_C(rt, line_id, lines, lines_idx, skip,
-            indent1, indented, numbered, True, None, True, attr_id, True))
-  return results
-
-def _extract_recursively(rt, line_id, lines, lines_idx, skip, indent, indented,
-                         numbered, follow_M, exclude_id, direction):
-  results = []
-  stack = [(ln, indent) for ln in lines_idx[rt][line_id][direction][rt]]
-  while len(stack) > 0:
-    line2_id, indent1 = stack.pop()
+          yield (depth + 1, _visit_V_or_C,
+                 (rt, line_id, True, None, True, attr_id, True))
+
+def _visit_M(ctx, depth, rt, line_id):
+  for model_id in ctx['ref_by'](rt, line_id, 'M'):
+    yield (depth, None, model_id)
+
+def _visit_hierarchy(ctx, depth, rt, line_id, follow_M, exclude_id,
+                     direction):
+  # the records are visited depth-first, each list of connected records
+  # in reverse order
+  connected, skip = ctx[direction], ctx['skip']
+  for line2_id in reversed(list(connected(rt, line_id, rt))):
     if line2_id not in skip:
-      n = lines_idx[rt][line2_id]['line']
-      nstr = f"[{n+1}]\t" if numbered else ""
-      results.append(nstr + indent1 + lines[n])
-      skip.append(line2_id)
-      indent2 = indent1 + "  " if indented else ""
-      if follow_M:
-        for model_lineno in lines_idx[rt][line2_id]['ref_by']['M']:
-          nstr = f"[{model_lineno+1}]\t" if numbered else ""
-          results.append(nstr + indent2 + lines[model_lineno])
-      for line3_id in lines_idx[rt][line2_id][direction][rt]:
-        if line3_id not in skip and line3_id != exclude_id:
-          stack.append((line3_id, indent2))
-  return results
-
-def _extract_U(unit_id, lines, lines_idx, skip, indent, indented, numbered,
-               follow_U, climb_U, exclude_U_id, follow_M, climb_A):
-  n = lines_idx['U'][unit_id]['line']
-  nstr = f"[{n+1}]\t" if numbered else ""
-  results = [nstr + indent + lines[n]]
-  indent1 = indent + "  " if indented else ""
-  skip.append(unit_id)
+      yield (depth, _visit_hierarchy_node,
+             (rt, line2_id, follow_M, exclude_id, direction))
+
+def _visit_hierarchy_node(ctx, depth, rt, line_id, follow_M, exclude_id,
+                          direction):
+  connected, skip = ctx[direction], ctx['skip']
+  yield (depth, None, line_id)
+  skip.add(line_id)
   if follow_M:
-    for model_lineno in lines_idx['U'][unit_id]['ref_by']['M']:
-      nstr = f"[{model_lineno+1}]\t" if numbered else ""
-      results.append(nstr + indent1 + lines[model_lineno])
+    yield from _visit_M(ctx, depth + 1, rt, line_id)
+  for line2_id in reversed(list(connected(rt, line_id, rt))):
+    if line2_id not in skip and line2_id != exclude_id:
+      yield (depth + 1, _visit_hierarchy_node,
+             (rt, line2_id, follow_M, exclude_id, direction))
+
+def _visit_U(ctx, depth, unit_id, follow_U, climb_U, exclude_U_id,
+             follow_M, climb_A):
+  ref_by, skip = ctx['ref_by'], ctx['skip']
+  yield (depth, None, unit_id)
+  skip.add(unit_id)
+  if follow_M:
+    yield from _visit_M(ctx, depth + 1, 'U', unit_id)
   if follow_U:
-    results.extend(_extract_recursively('U', unit_id, lines, lines_idx, skip,
-                indent1, indented, numbered, follow_M, exclude_U_id, 'refs'))
+    yield (depth + 1, _visit_hierarchy,
+           ('U', unit_id, follow_M, exclude_U_id, 'refs'))
   if climb_U:
-    results.extend(_extract_recursively('U', unit_id, lines, lines_idx, skip,
-                indent1, indented, numbered, follow_M, exclude_U_id, 'ref_by'))
+    yield (depth + 1, _visit_hierarchy,
+           ('U', unit_id, follow_M, exclude_U_id, 'ref_by'))
   if climb_A:
-    for attr_id in lines_idx['U'][unit_id]['ref_by']['A']:
+    for attr_id in ref_by('U', unit_id, 'A'):
       if attr_id not in skip:
-        results.extend(_extract_A(attr_id, lines, lines_idx, skip, indent1,
-          indented, numbered, True, unit_id, True))
-  return results
-
-def _extract_G(group_id, lines, lines_idx, skip, indent, indented, numbered,
-               follow_G, climb_G, exclude_G_id, climb_VC):
-  n = lines_idx['G'][group_id]['line']
-  nstr = f"[{n+1}]\t" if numbered else ""
-  results = [nstr + indent + lines[n]]
-  skip.append(group_id)
-  indent1 = indent + "  " if indented else ""
+        yield (depth + 1, _visit_A, (attr_id, True, unit_id, True))
+
+def _visit_G(ctx, depth, group_id, follow_G, climb_G, exclude_G_id,
+             climb_VC):
+  ref_by, skip = ctx['ref_by'], ctx['skip']
+  yield (depth, None, group_id)
+  skip.add(group_id)
   if follow_G:
-    results.extend(_extract_recursively('G', group_id, lines, lines_idx, skip,
-                     indent1, indented, numbered, False, exclude_G_id, 'refs'))
+    yield (depth + 1, _visit_hierarchy,
+           ('G', group_id, False, exclude_G_id, 'refs'))
   if climb_G:
-    results.extend(_extract_recursively('G', group_id, lines, lines_idx, skip,
-                indent1, indented, numbered, False, exclude_G_id, 'ref_by'))
+    yield (depth + 1, _visit_hierarchy,
+           ('G', group_id, False, exclude_G_id, 'ref_by'))
   if climb_VC:
     for rt in ['V', 'C']:
-      for line_id in lines_idx['G'][group_id]['ref_by'][rt]:
+      for line_id in ref_by('G', group_id, rt):
         if line_id not in skip:
-          results.extend(_extract_V_or_C(rt, line_id, lines, lines_idx, skip,
-            indent1, indented, numbered, False, group_id, True, None, True))
-  return results
-
-def _extract_D(document_id, lines, lines_idx, skip, indent, indented, numbered,
-              climb_ST):
-  n = lines_idx['D'][document_id]['line']
-  nstr = f"[{n+1}]\t" if numbered else ""
-  results = [nstr + indent + lines[n]]
-  skip.append(document_id)
-  indent1 = indent + "  " if indented else ""
+          yield (depth + 1, _visit_V_or_C,
+                 (rt, line_id, True, group_id, True, None, True))
+
+def _visit_D(ctx, depth, document_id, climb_ST):
+  ref_by, skip = ctx['ref_by'], ctx['skip']
+  yield (depth, None, document_id)
+  skip.add(document_id)
   if climb_ST:
     for source_rt in ['S', 'T']:
-      for source_id in lines_idx['D'][document_id]['ref_by'][source_rt]:
+      for source_id in ref_by('D', document_id, source_rt):
         if source_id not in skip:
-          results += _extract_S_or_T(source_rt, source_id, lines,
-              lines_idx, skip, indent1, indented, numbered, False, True)
-  return results
-
-def extract(line_id, fname, indented, numbered):
-  lines, lines_idx = create_index(fname)
-  if line_id in lines_idx['D']:
-    return _extract_D(line_id, lines, lines_idx, [],
-                      "", indented, numbered, True)
-  elif line_id in lines_idx['S']:
-    return _extract_S_or_T('S', line_id, lines, lines_idx, [],
-                           "", indented, numbered, True, True)
-  elif line_id in lines_idx['T']:
-    return _extract_S_or_T('T', line_id, lines, lines_idx, [],
-                           "", indented, numbered, True, True)
-  elif line_id in lines_idx['G']:
-    return _extract_G(line_id, lines, lines_idx, [],
-                      "", indented, numbered, True, True, None, True)
-  elif line_id in lines_idx['A']:
-    return _extract_A(line_id, lines, lines_idx, [],
-                      "", indented, numbered, True, None, True)
-  elif line_id in lines_idx['U']:
-    return _extract_U(line_id, lines, lines_idx, [],
-                      "", indented, numbered, True, True, line_id, True,
-        True)
-  elif line_id in lines_idx['V']:
-    return _extract_V_or_C('V', line_id, lines, lines_idx, [],
-                           "", indented, numbered, True, None, True, None, True)
-  elif line_id in lines_idx['C']:
-    return _extract_V_or_C('C', line_id, lines, lines_idx, [],
-                           "", indented, numbered, True, None, True, None, True)
-  raise ValueError("Unknown line ID: " + line_id)
+          yield (depth + 1, _visit_S_or_T,
+                 (source_rt, source_id, False, True))
+
+def _traverse(ctx, visitor, args, indented, numbered,
+              max_depth=None, max_records=None):
+  egc = ctx['egc']
+  n_records = 0
+  stack = [visitor(ctx, 0, *args)]
+  while stack:
+    item = next(stack[-1], None)
+    if item is None:
+      stack.pop()
+      continue
+    depth, visitor, args = item
+    if max_depth is not None and depth > max_depth:
+      continue
+    if visitor is not None:
+      stack.append(visitor(ctx, depth, *args))
+      continue
+    nstr = f"[{egc.id2rnum[args]+1}]\t" if numbered else ""
+    indent = "  " * depth if indented else ""
+    yield nstr + indent + egc.line(args)
+    n_records += 1
+    if max_records is not None and n_records >= max_records:
+      return
+
+class Extractor:
+  """
+  Extraction of records and of the records connected to them.
+
+  The records are taken from an EGCData object (which can be shared with
+  other code, e.g. a service editing the data); extract() can then be called
+  for any number of IDs. Use from_file() for loading the data from an EGC
+  file (with cache=True, using the cache of the index, if available, so that
+  in this case the records are not decoded; the lines are read from the
+  memory-mapped file when they are output).
+
+  Document records can be extracted using either the document ID of the
+  D record (prefix:item) or the composed record ID (D-prefix-item).
+  """
+
+  def __init__(self, egc_data):
+    self.egc = egc_data
+
+  @classmethod
+  def from_file(cls, fname, jobs=1, cache=False, cache_dir=None):
+    return cls(EGCData.from_file(fname, jobs=jobs, cache=cache,
+                                 cache_dir=cache_dir, lazy=True,
+                                 mmap_lines=True))
+
+  def _record_id(self, line_id):
+    if line_id not in self.egc.id2rnum and ':' in line_id:
+      prefix, item = line_id.split(':', 1)
+      return EGCData.compose_id('D', prefix, item)
+    return line_id
+
+  def _record_type(self, record_id):
+    record_num = self.egc.id2rnum.get(record_id)
+    if record_num is not None:
+      for rt in ['D', 'S', 'T', 'G', 'A', 'U', 'V', 'C']:
+        if record_num in self.egc.rnums_of(rt):
+          return rt
+    return None
+
+  def _root(self, record_id):
+    rt = self._record_type(record_id)
+    if rt == 'D':
+      return _visit_D, (record_id, True)
+    elif rt in ['S', 'T']:
+      return _visit_S_or_T, (rt, record_id, True, True)
+    elif rt == 'G':
+      return _visit_G, (record_id, True, True, None, True)
+    elif rt == 'A':
+      return _visit_A, (record_id, True, None, True)
+    elif rt == 'U':
+      return _visit_U, (record_id, True, True, record_id, True, True)
+    elif rt in ['V', 'C']:
+      return _visit_V_or_C, (rt, record_id, True, None, True, None, True)
+    raise ValueError("Unknown line ID: " + record_id)
+
+  def iter_extract(self, line_id, indented=False, numbered=False, skip=None,
+                   max_depth=None, max_records=None):
+    """
+    Extract the record with the given ID and the records connected to it.
+
+    Returns an iterator over the lines, which are yielded as soon as they
+    are found. If skip is given, it is a set of record IDs of records which
+    are not output again (e.g. because they were already output for other
+    IDs); the IDs of the output records are added to it. The traversal can
+    be limited to records with a maximal distance (max_depth) from the
+    extracted record and to a maximal number of output lines (max_records).
+    """
+    record_id = self._record_id(line_id)
+    visitor, args = self._root(record_id)
+    if skip is None:
+      skip = set()
+    elif record_id in skip:
+      return iter(())
+    graph = self.egc.graph
+    ctx = {'egc': self.egc, 'refs': graph.refs, 'ref_by': graph.ref_by,
+           'skip': skip}
+    return profiling.timed("extractor.extract",
+        _traverse(ctx, visitor, args, indented, numbered,
+                  max_depth, max_records))
+
+  def extract(self, line_id, indented=False, numbered=False, skip=None,
+              max_depth=None, max_records=None):
+    """
+    As iter_extract(), but returns a list of lines.
+    """
+    return list(self.iter_extract(line_id, indented, numbered, skip,
+                                  max_depth, max_records))
+
+def extract(line_id, fname, indented, numbered, jobs=1,
+            cache=False, cache_dir=None):
+  return Extractor.from_file(fname, jobs, cache, cache_dir).extract(line_id,
+      indented, numbered)
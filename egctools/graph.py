@@ -0,0 +1,402 @@
+#
+# Reference graph of the records of a EGC file
+#
+# Each node of the graph is identified by a record type and a record ID.
+# For each node, the IDs of the referenced nodes ('refs') and of the
+# referencing nodes ('ref_by') are stored, separately for each record type
+# of the other node.
+#
+# The adjacency lists are insertion-ordered sets (dicts with None values),
+# so that edges are unique and can be removed in constant time.
+#
+# Two implementations with the same interface are available:
+# - DictGraph: nested dicts, keyed by record IDs
+# - CompactGraph: record IDs are mapped to dense integers (separately
+#   for each record type) and the adjacency lists are stored in arrays
+#   (compressed sparse row format), with an overflow area for the
+#   adjacency lists which are modified after the graph was constructed
+#
+from array import array
+from collections import defaultdict
+
+class DictGraph:
+  """
+  Reference graph stored as nested dicts.
+
+  graph[record_type][record_id]['refs' or 'ref_by'][other_type] is the
+  ordered set (dict with None values) of IDs of the records of type
+  other_type referenced by (or referencing) the node.
+  """
+
+  def __init__(self):
+    self._nodes = defaultdict(\
+        lambda: defaultdict(lambda: {
+          'ref_by': defaultdict(dict),
+          'refs': defaultdict(dict)}))
+
+  def __getitem__(self, rt):
+    return self._nodes[rt]
+
+  def __contains__(self, rt):
+    return rt in self._nodes
+
+  def finalize(self):
+    pass
+
+  def has_node(self, rt, record_id):
+    return rt in self._nodes and record_id in self._nodes[rt]
+
+  def nodes(self):
+    """
+    Iterate over the nodes, as (record type, record ID) tuples
+    (the graph must not be modified while iterating).
+    """
+    for rt, nodes in self._nodes.items():
+      for record_id in nodes:
+        yield rt, record_id
+
+  def connect(self, rt1, id1, rt2, id2):
+    self._nodes[rt1][id1]['refs'][rt2][id2] = None
+    self._nodes[rt2][id2]['ref_by'][rt1][id1] = None
+
+  def has_edge(self, rt1, id1, rt2, id2):
+    return self.has_node(rt1, id1) and \
+        id2 in self._nodes[rt1][id1]['refs'][rt2]
+
+  def refs(self, rt, record_id, ref_rt):
+    return self._nodes[rt][record_id]['refs'][ref_rt].keys()
+
+  def ref_by(self, rt, record_id, ref_by_rt):
+    return self._nodes[rt][record_id]['ref_by'][ref_by_rt].keys()
+
+  def ref_by_types(self, rt, record_id):
+    return list(self._nodes[rt][record_id]['ref_by'].keys())
+
+  def is_ref_by(self, rt, record_id):
+    if self.has_node(rt, record_id):
+      for ids in self._nodes[rt][record_id]['ref_by'].values():
+        if ids:
+          return True
+    return False
+
+  def _remove_reverse_refs(self, rt, record_id):
+    for rt2, id2s in self._nodes[rt][record_id]['refs'].items():
+      for id2 in id2s:
+        self._nodes[rt2][id2]['ref_by'][rt].pop(record_id, None)
+
+  def remove_node(self, rt, record_id):
+    """
+    Remove a node and the edges from and to it.
+    """
+    self._remove_reverse_refs(rt, record_id)
+    for rt2, id2s in self._nodes[rt][record_id]['ref_by'].items():
+      for id2 in id2s:
+        self._nodes[rt2][id2]['refs'][rt].pop(record_id, None)
+    del self._nodes[rt][record_id]
+
+  def clear_refs(self, rt, record_id):
+    """
+    Remove the edges from a node to the nodes it references.
+    """
+    self._remove_reverse_refs(rt, record_id)
+    self._nodes[rt][record_id]['refs'] = defaultdict(dict)
+
+  def rename_node(self, rt, old_id, new_id):
+    """
+    Change the ID of a node; the references to the node in the
+    adjacency lists of other nodes are not changed (see replace_in_refs
+    and replace_in_ref_by). If a node with the new ID exists (e.g. the
+    node of a referenced, but not existing, record), the adjacency lists
+    of the two nodes are merged.
+    """
+    node = self._nodes[rt].pop(old_id)
+    if new_id in self._nodes[rt]:
+      existing = self._nodes[rt][new_id]
+      for direction in ['refs', 'ref_by']:
+        for rt2, ids in node[direction].items():
+          existing[direction][rt2].update(ids)
+    else:
+      self._nodes[rt][new_id] = node
+
+  def replace_in_refs(self, rt, record_id, ref_rt, old_id, new_id):
+    ids = self._nodes[rt][record_id]['refs'][ref_rt]
+    del ids[old_id]
+    ids[new_id] = None
+
+  def replace_in_ref_by(self, rt, record_id, ref_by_rt, old_id, new_id):
+    ids = self._nodes[rt][record_id]['ref_by'][ref_by_rt]
+    del ids[old_id]
+    ids[new_id] = None
+
+  def to_data(self):
+    return {rt: {record_id: {'refs': dict(node['refs']),
+                             'ref_by': dict(node['ref_by'])} \
+                 for record_id, node in nodes.items()} \
+            for rt, nodes in self._nodes.items()}
+
+  @classmethod
+  def from_data(cls, data):
+    graph = cls()
+    for rt, nodes in data.items():
+      for record_id, node in nodes.items():
+        graph._nodes[rt][record_id]['refs'].update(node['refs'])
+        graph._nodes[rt][record_id]['ref_by'].update(node['ref_by'])
+    return graph
+
+REFS = 0
+REF_BY = 1
+
+class CompactGraph:
+  """
+  Reference graph stored in arrays of integers.
+
+  The IDs of the nodes of each record type are mapped to dense integers.
+  The adjacency lists are stored separately for each key
+  (direction, record_type, other_type), where direction is REFS or REF_BY.
+
+  While the graph is constructed (connect() calls before any other method
+  is called), the edges are appended to buffer arrays. When the graph is
+  finalized, the buffers are converted to the compressed sparse row (CSR)
+  format: an array of targets, sorted by source node, and an array
+  of offsets of the targets of each source node. The adjacency lists
+  of nodes modified after the graph was finalized (or containing
+  duplicated edges) are stored as ordered sets in a overflow dict.
+  """
+
+  def __init__(self):
+    self._ids = defaultdict(dict)
+    self._names = defaultdict(list)
+    self._keys = defaultdict(list)
+    self._buffers = {}
+    self._csr = {}
+    self._overflow = defaultdict(dict)
+    self._finalized = False
+
+  def _add_key(self, key):
+    direction, rt, rt2 = key
+    if rt2 not in self._keys[(direction, rt)]:
+      self._keys[(direction, rt)].append(rt2)
+
+  def _node(self, rt, record_id):
+    ids = self._ids[rt]
+    i = ids.get(record_id)
+    if i is None:
+      i = len(self._names[rt])
+      ids[record_id] = i
+      self._names[rt].append(record_id)
+    return i
+
+  def finalize(self):
+    """
+    Convert the buffered edges to the CSR format.
+    """
+    for key, (sources, targets) in self._buffers.items():
+      n = len(self._names[key[1]])
+      offsets = array('i', bytes(4 * (n + 1)))
+      for s in sources:
+        offsets[s + 1] += 1
+      for i in range(n):
+        offsets[i + 1] += offsets[i]
+      sorted_targets = array('i', bytes(4 * len(targets)))
+      pos = array('i', offsets)
+      for s, t in zip(sources, targets):
+        sorted_targets[pos[s]] = t
+        pos[s] += 1
+      # duplicated edges are removed by moving the node to the overflow
+      overflow = self._overflow[key]
+      for node in range(n):
+        start, end = offsets[node], offsets[node + 1]
+        if end - start > 1:
+          segment = sorted_targets[start:end]
+          if len(set(segment)) < len(segment):
+            overflow[node] = dict.fromkeys(segment)
+      self._csr[key] = (offsets, sorted_targets)
+    self._buffers = {}
+    self._finalized = True
+
+  def _targets(self, key, node):
+    if not self._finalized:
+      self.finalize()
+    overflow = self._overflow.get(key)
+    if overflow is not None and node in overflow:
+      return overflow[node]
+    csr = self._csr.get(key)
+    if csr is None or node >= len(csr[0]) - 1:
+      return ()
+    offsets, targets = csr
+    return targets[offsets[node]:offsets[node + 1]]
+
+  def _mutable_targets(self, key, node):
+    targets = self._targets(key, node)
+    overflow = self._overflow[key]
+    if node not in overflow:
+      targets = dict.fromkeys(targets)
+      overflow[node] = targets
+    return targets
+
+  def has_node(self, rt, record_id):
+    return rt in self._ids and record_id in self._ids[rt]
+
+  def nodes(self):
+    """
+    Iterate over the nodes, as (record type, record ID) tuples
+    (the graph must not be modified while iterating).
+    """
+    for rt, ids in self._ids.items():
+      for record_id in ids:
+        yield rt, record_id
+
+  def connect(self, rt1, id1, rt2, id2):
+    i1 = self._node(rt1, id1)
+    i2 = self._node(rt2, id2)
+    if self._finalized:
+      self._add_key((REFS, rt1, rt2))
+      self._add_key((REF_BY, rt2, rt1))
+      self._mutable_targets((REFS, rt1, rt2), i1)[i2] = None
+      self._mutable_targets((REF_BY, rt2, rt1), i2)[i1] = None
+    else:
+      for key, s, t in [((REFS, rt1, rt2), i1, i2),
+                        ((REF_BY, rt2, rt1), i2, i1)]:
+        buf = self._buffers.get(key)
+        if buf is None:
+          self._add_key(key)
+          buf = (array('i'), array('i'))
+          self._buffers[key] = buf
+        buf[0].append(s)
+        buf[1].append(t)
+
+  def has_edge(self, rt1, id1, rt2, id2):
+    i1 = self._ids[rt1].get(id1)
+    i2 = self._ids[rt2].get(id2)
+    if i1 is None or i2 is None:
+      return False
+    return i2 in self._targets((REFS, rt1, rt2), i1)
+
+  def _ids_list(self, direction, rt, record_id, rt2):
+    i = self._ids[rt].get(record_id)
+    if i is None:
+      return []
+    return list(map(self._names[rt2].__getitem__,
+                    self._targets((direction, rt, rt2), i)))
+
+  def refs(self, rt, record_id, ref_rt):
+    return self._ids_list(REFS, rt, record_id, ref_rt)
+
+  def ref_by(self, rt, record_id, ref_by_rt):
+    return self._ids_list(REF_BY, rt, record_id, ref_by_rt)
+
+  def ref_by_types(self, rt, record_id):
+    i = self._ids[rt].get(record_id)
+    if i is None:
+      return []
+    return [rt2 for rt2 in self._keys[(REF_BY, rt)] \
+            if self._targets((REF_BY, rt, rt2), i)]
+
+  def is_ref_by(self, rt, record_id):
+    return len(self.ref_by_types(rt, record_id)) > 0
+
+  def _clear(self, direction, rt, i):
+    reverse = REF_BY if direction == REFS else REFS
+    for rt2 in self._keys[(direction, rt)]:
+      targets = self._targets((direction, rt, rt2), i)
+      for t in targets:
+        self._mutable_targets((reverse, rt2, rt), t).pop(i, None)
+      if targets:
+        self._overflow[(direction, rt, rt2)][i] = {}
+
+  def remove_node(self, rt, record_id):
+    """
+    Remove a node and the edges from and to it.
+    """
+    i = self._ids[rt].pop(record_id, None)
+    if i is None:
+      return
+    self._clear(REFS, rt, i)
+    self._clear(REF_BY, rt, i)
+    self._names[rt][i] = None
+
+  def clear_refs(self, rt, record_id):
+    """
+    Remove the edges from a node to the nodes it references.
+    """
+    i = self._ids[rt].get(record_id)
+    if i is not None:
+      self._clear(REFS, rt, i)
+
+  def rename_node(self, rt, old_id, new_id):
+    """
+    Change the ID of a node. As the adjacency lists contain integers,
+    the references to the node in other nodes do not need to be changed.
+
+    If a node with the new ID exists, the node is merged into it: its
+    edges are moved to the existing node (also in the adjacency lists
+    of the connected nodes) and its integer is not used anymore.
+    """
+    i = self._ids[rt].pop(old_id, None)
+    if i is None:
+      return
+    j = self._ids[rt].get(new_id)
+    if j is None:
+      self._ids[rt][new_id] = i
+      self._names[rt][i] = new_id
+      return
+    for direction, reverse in [(REFS, REF_BY), (REF_BY, REFS)]:
+      for rt2 in self._keys[(direction, rt)]:
+        targets = list(self._targets((direction, rt, rt2), i))
+        if not targets:
+          continue
+        self._overflow[(direction, rt, rt2)][i] = {}
+        merged = self._mutable_targets((direction, rt, rt2), j)
+        for t in targets:
+          if rt2 == rt and t == i:
+            t = j
+          merged[t] = None
+          reverse_targets = self._mutable_targets((reverse, rt2, rt), t)
+          reverse_targets.pop(i, None)
+          reverse_targets[j] = None
+    self._names[rt][i] = None
+
+  def _replace(self, direction, rt, record_id, rt2, old_id, new_id):
+    # the node old_id may already have been renamed to new_id,
+    # or be renamed to new_id later: in both cases its integer is kept
+    old = self._ids[rt2].get(old_id)
+    new = self._ids[rt2].get(new_id)
+    if old is None:
+      old = new
+    if new is None:
+      new = old
+    targets = self._mutable_targets((direction, rt, rt2),
+                                    self._ids[rt][record_id])
+    del targets[old]
+    targets[new] = None
+
+  def replace_in_refs(self, rt, record_id, ref_rt, old_id, new_id):
+    self._replace(REFS, rt, record_id, ref_rt, old_id, new_id)
+
+  def replace_in_ref_by(self, rt, record_id, ref_by_rt, old_id, new_id):
+    self._replace(REF_BY, rt, record_id, ref_by_rt, old_id, new_id)
+
+  def to_data(self):
+    self.finalize()
+    return {'names': dict(self._names), 'keys': dict(self._keys),
+            'csr': self._csr, 'overflow': dict(self._overflow)}
+
+  @classmethod
+  def from_data(cls, data):
+    graph = cls()
+    for rt, names in data['names'].items():
+      graph._names[rt] = names
+      graph._ids[rt] = {name: i for i, name in enumerate(names) \
+                        if name is not None}
+    graph._keys.update(data['keys'])
+    graph._csr = data['csr']
+    graph._overflow.update(data['overflow'])
+    graph._finalized = True
+    return graph
+
+GRAPH_BACKENDS = {'dict': DictGraph, 'compact': CompactGraph}
+
+def create(backend='dict'):
+  if backend not in GRAPH_BACKENDS:
+    raise ValueError('Unknown graph backend: {}'.format(backend))
+  return GRAPH_BACKENDS[backend]()
@@ -1,18 +1,116 @@
 #
 # Auto-generation of unique IDs for the records
 #
+# The unused IDs are found using the ID allocation index of the EGCData
+# object (see IDAllocationIndex), thus generating an ID takes constant
+# (amortized) time, independently of the number of IDs with the same base.
+# Generated IDs can be reserved (reserve=True), so that they are not
+# generated again before the records are created; this allows generating
+# the IDs for many records first and creating them afterwards, e.g. in
+# a batch.
+#
 import re
+from collections import defaultdict
+
+# IDs ending with a number (without leading zeros): prefix and number;
+# the prefix of the IDs generated with a number always ends with
+# a non-digit character (record type or underscore)
+_NUMBERED_ID_RE = re.compile(r"^(.*[^0-9])([1-9][0-9]*)$")
+
+class IDAllocationIndex:
+  """
+  Index of the used IDs which end with a number, by prefix, for finding
+  the first unused number for a prefix.
+
+  For each prefix and start number, the index keeps a lower bound of the
+  first unused number, which is lowered when an ID is removed, thus
+  finding the first unused number takes amortized constant time.
+
+  Reserved IDs are considered used, until they are released.
+  """
+
+  def __init__(self, record_ids=()):
+    self._used = defaultdict(set)
+    self._first_free = defaultdict(dict)
+    self._reserved = set()
+    for record_id in record_ids:
+      self.add(record_id)
+
+  @staticmethod
+  def _split(record_id):
+    m = _NUMBERED_ID_RE.match(record_id)
+    if m is None:
+      return None, None
+    return m.group(1), int(m.group(2))
+
+  def add(self, record_id):
+    """
+    Register an used ID (e.g. of a created record).
+    """
+    self._reserved.discard(record_id)
+    prefix, n = self._split(record_id)
+    if prefix is not None:
+      self._used[prefix].add(n)
+
+  def remove(self, record_id):
+    """
+    Register that an ID is not used anymore (e.g. of a deleted record).
+    """
+    prefix, n = self._split(record_id)
+    if prefix is None or prefix not in self._used:
+      return
+    self._used[prefix].discard(n)
+    first_free = self._first_free.get(prefix)
+    if first_free:
+      for start, f in first_free.items():
+        if start <= n < f:
+          first_free[start] = n
+
+  def reserve(self, record_id):
+    self._reserved.add(record_id)
+    prefix, n = self._split(record_id)
+    if prefix is not None:
+      self._used[prefix].add(n)
+
+  def release(self, record_id):
+    """
+    Release a reserved ID, which was not used.
+    """
+    if record_id in self._reserved:
+      self._reserved.remove(record_id)
+      self.remove(record_id)
+
+  def is_reserved(self, record_id):
+    return record_id in self._reserved
+
+  def first_free(self, prefix, start=1, old_id=None):
+    """
+    First ID consisting of prefix and a number (not smaller than start),
+    which is not used, or is old_id.
+    """
+    used = self._used.get(prefix, ())
+    n = max(start, self._first_free[prefix].get(start, start))
+    while n in used:
+      n += 1
+    self._first_free[prefix][start] = n
+    if old_id is not None:
+      old_prefix, old_n = self._split(old_id)
+      if old_prefix == prefix and start <= old_n < n:
+        return old_id
+    return f'{prefix}{n}'
 
 def _id_ok(egc_data, new_id, old_id):
-  return new_id == old_id or not egc_data.id_exists(new_id)
+  return new_id == old_id or \
+      not (egc_data.id_exists(new_id) or
+           egc_data.id_allocation_index().is_reserved(new_id))
+
+def _allocated(egc_data, new_id, old_id, reserve):
+  if reserve and new_id != old_id:
+    egc_data.id_allocation_index().reserve(new_id)
+  return new_id
 
 def _add_sfx(egc_data, new_id, old_id):
-  sfx = 2
-  while True:
-    sfx_id = f'{new_id}_{sfx}'
-    if _id_ok(egc_data, sfx_id, old_id):
-      return sfx_id
-    sfx += 1
+  return egc_data.id_allocation_index().first_free(f'{new_id}_', 2, old_id)
 
 AttributeModePfx = {
         "count": "c",
@@ -77,32 +175,32 @@ UnitTypePfx = {
         None: "x",
       }
 
-def _new_id(egc_data, new_id, old_id):
-  if _id_ok(egc_data, new_id, old_id):
-    return new_id
-  else:
-    return _add_sfx(egc_data, new_id, old_id)
+def _new_id(egc_data, new_id, old_id, reserve=False):
+  if not _id_ok(egc_data, new_id, old_id):
+    new_id = _add_sfx(egc_data, new_id, old_id)
+  return _allocated(egc_data, new_id, old_id, reserve)
 
 def _sanitize(s, repl):
   return re.sub(r"[^a-zA-Z0-9_]", repl, s)
 
-def generate_A_id(egc_data, unit_id, mode, old_id=None):
+def generate_A_id(egc_data, unit_id, mode, old_id=None, reserve=False):
   if unit_id.startswith('U'):
     unit_id = unit_id[1:]
   m = AttributeModePfx.get(mode,
       AttributeModePfx[None]+_sanitize(mode[0:2], ""))
-  return _new_id(egc_data, f'A{m}_{unit_id}', old_id)
+  return _new_id(egc_data, f'A{m}_{unit_id}', old_id, reserve)
 
-def generate_G_id(egc_data, name, gtype, old_id=None):
+def generate_G_id(egc_data, name, gtype, old_id=None, reserve=False):
   name = "_".join([_sanitize(n, "")[:5] for n in name.split(" ")])
   if gtype.startswith("habitat_"):
     pfx = GroupTypePfx["habitat_*"]
   else:
     pfx = GroupTypePfx.get(gtype, GroupTypePfx[None]+gtype[0])
-  return _new_id(egc_data, f'G{pfx}_{name}', old_id)
+  return _new_id(egc_data, f'G{pfx}_{name}', old_id, reserve)
 
 def generate_U_id(egc_data, utype,
-                     symbol, definition, description, old_id=None):
+                     symbol, definition, description, old_id=None,
+                     reserve=False):
   pfx = UnitTypePfx.get(utype, UnitTypePfx[None]+_sanitize(utype[0:2], ""))
   if symbol != ".":
     namesrc = [symbol]
@@ -118,13 +216,23 @@ def generate_U_id(egc_data, utype,
   else:
     name = "_".join([n[:5] for n in namesrc if n])
 
-  return _new_id(egc_data, f'U{pfx}_{name}', old_id)
+  return _new_id(egc_data, f'U{pfx}_{name}', old_id, reserve)
+
+def generate_numbased_id(egc_data, record_type, old_id=None, reserve=False):
+  new_id = egc_data.id_allocation_index().first_free(record_type, 1, old_id)
+  return _allocated(egc_data, new_id, old_id, reserve)
 
-def generate_numbased_id(egc_data, record_type, old_id=None):
-  i = 1
-  while True:
-    new_id = f'{record_type}{i}'
-    if _id_ok(egc_data, new_id, old_id):
-      return new_id
-    i += 1
+def generate_numbased_ids(egc_data, record_type, n):
+  """
+  Generate and reserve n IDs, e.g. for the records of a batch.
+  """
+  return [generate_numbased_id(egc_data, record_type, reserve=True) \
+          for i in range(n)]
 
+def release_ids(egc_data, record_ids):
+  """
+  Release reserved IDs, which were not used.
+  """
+  index = egc_data.id_allocation_index()
+  for record_id in record_ids:
+    index.release(record_id)
@@ -1,63 +1,56 @@
-import textformats
+#
+# Index of the lines of a EGC file and of the references between them
+#
+# The index is computed from an EGCData object (see EGCData.from_file,
+# which is called in lazy mode, thus the lines are only decoded if their
+# references cannot be scanned). create() returns the lines and a dictionary
+# lines_idx[record_type][record_id], with the keys 'line' (line number, None
+# for referenced records which do not exist), 'refs' and 'ref_by' (record
+# type => list of IDs of the referenced/referencing records).
+#
+# The D records are indexed by their document ID (prefix:item); the
+# M records are not indexed, but the line numbers of the M records
+# referencing an U record are listed in lines_idx['U'][unit_id]['ref_by']['M'].
+#
 from collections import defaultdict
-import importlib.resources
-from .parser import unparsed_and_parsed_lines
-from .references import get_G_to_G, get_U_to_U, get_A_to_U, get_VC_to_ST, \
-                        get_VC_to_A, get_VC_to_G
+from .egcdata import EGCData
+from .references import REFS_BY_RECORD_TYPE
 
-_data = importlib.resources.files("egctools").joinpath("data")
-_egcspec = _data.joinpath("egc-spec")
-_specfile = _egcspec.joinpath("egc.tf.yaml")
-SPEC = textformats.Specification(str(_specfile))
+# types of the records referenced by each record type
+# (the V/C records reference S or T records)
+_REF_TYPES = {rt: [ref_rt for ref_rt, get_ids in refs] + \
+                  (['S', 'T'] if rt in ['V', 'C'] else [])
+              for rt, refs in REFS_BY_RECORD_TYPE.items()}
+
+def _document_id(record_id):
+  return ":".join(EGCData.parse_composed_id(record_id))
+
+def _key(rt, record_id):
+  return _document_id(record_id) if rt == 'D' else record_id
 
 def _connect(lines_idx, rt1, id1, rt2, id2):
   lines_idx[rt1][id1]['refs'][rt2].append(id2)
   lines_idx[rt2][id2]['ref_by'][rt1].append(id1)
 
-def create(fname):
-  lines = []
+def create(fname, jobs=1, cache=False, cache_dir=None):
+  egc = EGCData.from_file(fname, jobs=jobs, cache=cache, cache_dir=cache_dir,
+                          lazy=True)
+  lines = list(egc.lines)
   lines_idx = defaultdict(\
                 lambda: defaultdict(\
                   lambda: {'line': None,
                            'ref_by': defaultdict(list),
                            'refs': defaultdict(list)}))
-  i = 0
-  for uline, line in unparsed_and_parsed_lines(fname):
-    lines.append(uline)
-    rt = line['record_type']
-    if 'id' in line:
-      line_id = line['id']
-      lines_idx[rt][line_id]['line'] = i
-    if 'document_id' in line:
-      document_id_dt = SPEC["external_resource::external_resource_link"]
-      document_id = document_id_dt.encode(line['document_id'])
-    if rt == 'D':
-      lines_idx["D"][document_id]['line'] = i
-    elif rt == 'S' or rt == 'T':
-      _connect(lines_idx, rt, line_id, 'D', document_id)
-    elif rt == 'G':
-      for parent_id in get_G_to_G(line):
-        _connect(lines_idx, 'G', line_id, 'G', parent_id)
-    elif rt == 'U':
-      for parent_id in get_U_to_U(line):
-        _connect(lines_idx, 'U', line_id, 'U', parent_id)
-    elif rt == 'A':
-      for unit_id in get_A_to_U(line):
-        _connect(lines_idx, 'A', line_id, 'U', unit_id)
-    elif rt == 'M':
-      lines_idx['U'][line['unit_id']]['ref_by']['M'].append(i)
-    elif rt == 'V' or rt == 'C':
-      for source_id in get_VC_to_ST(line):
-        lines_idx['S_or_T'][source_id]['ref_by'][rt].append(line_id)
-      for attribute_id in get_VC_to_A(line):
-        _connect(lines_idx, rt, line_id, 'A', attribute_id)
-      for group_id in get_VC_to_G(line):
-        _connect(lines_idx, rt, line_id, 'G', group_id)
-    i += 1
-  for source_id in lines_idx['S_or_T'].keys():
-    for rt2 in lines_idx['S_or_T'][source_id]['ref_by']:
-      for line_id in lines_idx['S_or_T'][source_id]['ref_by'][rt2]:
-        rt = 'S' if source_id in lines_idx['S'] else 'T'
-        _connect(lines_idx, rt2, line_id, rt, source_id)
-  del lines_idx['S_or_T']
+  rnum2rt = {i: rt for rt, rnums in egc.rt2rnums.items() for i in rnums}
+  for record_id, i in sorted(egc.id2rnum.items(), key=lambda item: item[1]):
+    rt = rnum2rt[i]
+    if rt == 'M':
+      for unit_id in egc._refs_ids('M', record_id, 'U'):
+        lines_idx['U'][unit_id]['ref_by']['M'].append(i)
+      continue
+    line_id = _key(rt, record_id)
+    lines_idx[rt][line_id]['line'] = i
+    for rt2 in _REF_TYPES[rt]:
+      for ref_id in egc._refs_ids(rt, record_id, rt2):
+        _connect(lines_idx, rt, line_id, rt2, _key(rt2, ref_id))
   return lines, lines_idx
@@ -0,0 +1,142 @@
+#
+# Storage of the lines of a EGC file in a memory-mapped file
+#
+# Instead of a list of strings, only the byte offset and the length of
+# each line are stored (in two arrays of integers, indexed by record number);
+# the line strings are created from the memory-mapped file when they are
+# accessed. The lines which are edited (set, appended or deleted) are kept
+# in an overlay dict, until the file is written again and remapped.
+#
+import os
+import mmap
+from array import array
+from itertools import accumulate, repeat
+from operator import add
+
+# size of the blocks of the file which are split into lines at once
+# while the line offsets are computed
+BLOCK_SIZE = 1 << 24
+
+def _line_spans(data, block_size=BLOCK_SIZE):
+  """
+  Byte offset and length (without line terminator) of each line.
+
+  The data is split in blocks ending at a newline, which are split into
+  lines at once; thus only the lines of one block are in memory at a time.
+  """
+  starts = array('q')
+  lengths = array('q')
+  pos = 0
+  size = len(data)
+  while pos < size:
+    end = min(pos + block_size, size)
+    if end < size:
+      newline = data.rfind(b"\n", pos, end)
+      if newline < 0:
+        newline = data.find(b"\n", end)
+      end = size if newline < 0 else newline + 1
+    block = data[pos:end]
+    lines = block.split(b"\n")
+    if block.endswith(b"\n"):
+      lines.pop()
+    block_lengths = array('q', map(len, lines))
+    starts.extend(accumulate(map(add, block_lengths, repeat(1)), initial=pos))
+    starts.pop()
+    if b"\r" in block:
+      lengths.extend(len(line.rstrip(b"\r")) for line in lines)
+    else:
+      lengths.extend(block_lengths)
+    pos = end
+  return starts, lengths
+
+class MappedLines:
+  """
+  List-like container of the lines of a EGC file, by record number,
+  reading them from the memory-mapped file.
+
+  Deleted records have no line (None); the length of their line is
+  stored as -1.
+  """
+
+  def __init__(self, file_path):
+    self.file_path = file_path
+    self._overlay = {}
+    self._starts, self._lengths = self._map()
+
+  def _map(self):
+    self._file = open(self.file_path, 'rb')
+    if os.fstat(self._file.fileno()).st_size == 0:
+      # empty files cannot be mapped
+      self._data = b""
+    else:
+      self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+    return _line_spans(self._data)
+
+  def remap(self, file_path=None):
+    """
+    Map the file again (or another file, if file_path is given), after the
+    lines which are not None were written to it, in the order of the record
+    numbers.
+    """
+    live = [self._overlay[i] is not None if i in self._overlay \
+            else self._lengths[i] >= 0 for i in range(len(self))]
+    self.close()
+    if file_path is not None:
+      self.file_path = file_path
+    starts, lengths = self._map()
+    self._starts = array('q', [0]) * len(live)
+    self._lengths = array('q', [-1]) * len(live)
+    i = 0
+    for record_num, is_live in enumerate(live):
+      if is_live:
+        self._starts[record_num] = starts[i]
+        self._lengths[record_num] = lengths[i]
+        i += 1
+    self._overlay = {}
+
+  def close(self):
+    if isinstance(self._data, mmap.mmap):
+      self._data.close()
+    self._file.close()
+
+  def __len__(self):
+    return len(self._lengths)
+
+  def __getitem__(self, record_num):
+    if record_num < 0:
+      record_num += len(self)
+    if record_num in self._overlay:
+      return self._overlay[record_num]
+    length = self._lengths[record_num]
+    if length < 0:
+      return None
+    start = self._starts[record_num]
+    return self._data[start:start + length].decode()
+
+  def __setitem__(self, record_num, line):
+    if record_num < 0:
+      record_num += len(self)
+    if record_num >= len(self):
+      raise IndexError("line index out of range")
+    self._overlay[record_num] = line
+
+  def __delitem__(self, index):
+    # only the truncation of the end of the list is supported
+    # (used for rolling back the records appended by a batch)
+    if not isinstance(index, slice) or index.stop is not None or \
+        index.step is not None:
+      raise TypeError("only the deletion of a final slice is supported")
+    n = index.indices(len(self))[0]
+    for record_num in range(n, len(self)):
+      self._overlay.pop(record_num, None)
+    del self._starts[n:]
+    del self._lengths[n:]
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield self[i]
+
+  def append(self, line):
+    self._starts.append(0)
+    self._lengths.append(-1)
+    self._overlay[len(self) - 1] = line
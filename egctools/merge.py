@@ -0,0 +1,160 @@
+#
+# Merging of EGC files
+#
+# The lines of the input files are output in their order, skipping the lines
+# of records whose ID was already seen (in the same or in a previous file):
+# the first record with a given ID wins. The record IDs are the same as
+# computed by EGCData.record_id (i.e. composed IDs for D and M records),
+# but they are extracted from the lines by splitting only the first columns,
+# without decoding the lines. Lines without a record ID (e.g. empty lines)
+# are always output, as they cannot be duplicates of other records.
+#
+# The input files can be scanned in parallel: the files are split in
+# line-aligned chunks, for which worker processes compute the record IDs
+# (and, for the conflicts report, the hashes) of the lines. The main
+# process then reads the chunks in the input order and writes the
+# lines which are kept.
+#
+import io
+import hashlib
+from .parser import _chunks, _n_jobs, CHUNKS_PER_JOB, ENCODING
+from . import profiling
+
+# number of lines written to the output at once
+WRITE_BATCH_SIZE = 10000
+
+def line_record_id(line):
+  """
+  Record ID of a EGC line (see EGCData.record_id); None if the line
+  has no record ID (e.g. an empty line or a D line without document ID).
+  """
+  fields = line.rstrip("\n").split("\t", 4)
+  rt = fields[0]
+  if rt == "D" and len(fields) >= 2:
+    prefix, sep, item = fields[1].partition(":")
+    if sep:
+      return "-".join(["D", prefix, item])
+  elif rt == "M" and len(fields) >= 4:
+    return "-".join(["M"] + fields[1:4])
+  elif len(fields) >= 2 and len(rt) == 1:
+    return fields[1]
+  return None
+
+def line_hash(line):
+  """
+  Hash of the content of a line, for comparing lines of different files.
+  """
+  return hashlib.blake2b(line.rstrip("\n").encode(), digest_size=8).digest()
+
+def _chunk_lines(fname, start, end):
+  with open(fname, "rb") as f:
+    f.seek(start)
+    data = f.read(end - start)
+  return io.StringIO(data.decode(ENCODING), newline=None)
+
+def _scan_chunk(fname, start, end, hashes):
+  record_ids = []
+  line_hashes = [] if hashes else None
+  for line in _chunk_lines(fname, start, end):
+    record_ids.append(line_record_id(line))
+    if hashes:
+      line_hashes.append(line_hash(line))
+  return record_ids, line_hashes
+
+class _Merger:
+  """
+  State of a merge: the seen record IDs (with the hash and position of the
+  first line with that ID, if conflicts are reported) and the conflicts.
+  """
+
+  def __init__(self, out, conflicts):
+    self.out = out
+    if conflicts:
+      self.seen = {}
+      self.conflicts = []
+    else:
+      self.seen = set()
+      self.conflicts = None
+
+  def _is_new(self, record_id, line, h, fname, lineno):
+    if record_id is None:
+      return True
+    if self.conflicts is None:
+      if record_id in self.seen:
+        return False
+      self.seen.add(record_id)
+      return True
+    first = self.seen.get(record_id)
+    if first is None:
+      self.seen[record_id] = (h if h is not None else line_hash(line),
+                              fname, lineno)
+      return True
+    if h is None:
+      h = line_hash(line)
+    if h != first[0]:
+      self.conflicts.append((record_id, fname, lineno, first[1], first[2]))
+    return False
+
+  def add(self, fname, lines, first_lineno, record_ids=None, hashes=None):
+    """
+    Write the lines whose record ID was not seen yet; the record IDs
+    (and hashes) of the lines are computed, if not given.
+    Returns the number of lines.
+    """
+    kept = []
+    n_lines = 0
+    for line in lines:
+      i = n_lines
+      record_id = line_record_id(line) if record_ids is None \
+                  else record_ids[i]
+      if self._is_new(record_id, line, None if hashes is None else hashes[i],
+                      fname, first_lineno + i):
+        kept.append(line if line.endswith("\n") else line + "\n")
+        if len(kept) >= WRITE_BATCH_SIZE:
+          self.out.writelines(kept)
+          kept = []
+      n_lines += 1
+    self.out.writelines(kept)
+    return n_lines
+
+def _parallel_merge(merger, fnames, jobs):
+  from concurrent.futures import ProcessPoolExecutor
+  tasks = [(file_num, fname, start, end) \
+           for file_num, fname in enumerate(fnames) \
+           for start, end in _chunks(fname, jobs * CHUNKS_PER_JOB)]
+  hashes = merger.conflicts is not None
+  next_lineno = [1] * len(fnames)
+  with ProcessPoolExecutor(max_workers=jobs) as executor:
+    results = executor.map(_scan_chunk, [t[1] for t in tasks],
+                           [t[2] for t in tasks], [t[3] for t in tasks],
+                           [hashes] * len(tasks))
+    for (file_num, fname, start, end), (record_ids, line_hashes) in \
+        zip(tasks, results):
+      next_lineno[file_num] += merger.add(fname,
+          _chunk_lines(fname, start, end), next_lineno[file_num],
+          record_ids, line_hashes)
+  return sum(next_lineno) - len(fnames)
+
+def merge(fnames, out, jobs=1, conflicts=False):
+  """
+  Write the lines of the EGC files to out (a text file), skipping the records
+  whose ID was already seen (the lines without record ID are not skipped).
+
+  If jobs is larger than 1 (or None or 0, which mean: one per CPU), the files
+  are scanned by a pool of worker processes.
+
+  If conflicts is True, a list of the skipped records whose line differs
+  from the line of the first record with the same ID is returned,
+  as tuples (record_id, filename, line_number, first_filename,
+  first_line_number); otherwise None is returned.
+  """
+  merger = _Merger(out, conflicts)
+  jobs = _n_jobs(jobs)
+  with profiling.timer("merge.merge") as t:
+    if jobs > 1 and len(fnames) > 0:
+      t.n_records = _parallel_merge(merger, fnames, jobs)
+    else:
+      for fname in fnames:
+        with open(fname, encoding=ENCODING) as f:
+          t.n_records += merger.add(fname, f, 1)
+  return merger.conflicts
@@ -1,22 +1,106 @@
-import textformats
-import importlib.resources
-_data = importlib.resources.files("egctools").joinpath("data")
-_egcspec = _data.joinpath("egc-spec")
-_specfile = _egcspec.joinpath("egc.tf.yaml")
-SPEC = textformats.Specification(str(_specfile))
+import io
+import os
+from . import profiling
+_SPEC = None
+
+def spec():
+  """
+  The textformats specification of the EGC format.
+
+  It is loaded on first use and shared by all modules of the package.
+  """
+  global _SPEC
+  if _SPEC is None:
+    import importlib.resources
+    import textformats
+    _data = importlib.resources.files("egctools").joinpath("data")
+    _egcspec = _data.joinpath("egc-spec")
+    _specfile = _egcspec.joinpath("egc.tf.yaml")
+    _SPEC = textformats.Specification(str(_specfile))
+  return _SPEC
+
+def __getattr__(name):
+  if name == "SPEC":
+    return spec()
+  raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# encoding of the EGC files (the same for the sequential and the parallel
+# reading, independently of the locale)
+ENCODING = "utf-8"
+
+# number of chunks per worker process, so that workers which are done
+# early can take over some of the work of the slower ones
+CHUNKS_PER_JOB = 4
 
 def parsed_line(s):
-  elements = SPEC["line"].decode(s.rstrip("\n"))
+  elements = spec()["line"].decode(s.rstrip("\n"))
   return elements
 
 def encode_line(data):
-  return SPEC["line"].encode(data)
+  return spec()["line"].encode(data)
+
+def _n_jobs(jobs):
+  """
+  Number of processes for the given jobs argument (None or 0: one per CPU).
+  """
+  if not jobs:
+    return os.cpu_count() or 1
+  return max(int(jobs), 1)
+
+def _chunks(fname, n_chunks):
+  """
+  Split a file into (start, end) byte ranges, each starting at the
+  beginning of a line and ending after a newline (or at the end of file).
+  """
+  size = os.path.getsize(fname)
+  bounds = [0]
+  with open(fname, "rb") as f:
+    for i in range(1, n_chunks):
+      pos = size * i // n_chunks
+      if pos <= bounds[-1]:
+        continue
+      f.seek(pos - 1)
+      f.readline()
+      pos = f.tell()
+      if pos >= size:
+        break
+      if pos > bounds[-1]:
+        bounds.append(pos)
+  bounds.append(size)
+  return list(zip(bounds[:-1], bounds[1:]))
+
+def _decode_chunk(fname, start, end):
+  with open(fname, "rb") as f:
+    f.seek(start)
+    data = f.read(end - start)
+  return [(line.rstrip("\n"), parsed_line(line)) \
+      for line in io.StringIO(data.decode(ENCODING), newline=None)]
+
+def _parallel_unparsed_and_parsed_lines(fname, jobs):
+  from concurrent.futures import ProcessPoolExecutor
+  chunks = _chunks(fname, jobs * CHUNKS_PER_JOB)
+  with ProcessPoolExecutor(max_workers=jobs) as executor:
+    for results in executor.map(_decode_chunk, [fname] * len(chunks),
+                                *zip(*chunks)):
+      yield from results
 
-def parsed_lines(fname):
-  for line in open(fname):
-    yield parsed_line(line)
+def parsed_lines(fname, jobs=1):
+  for line, parsed in unparsed_and_parsed_lines(fname, jobs):
+    yield parsed
 
-def unparsed_and_parsed_lines(fname):
-  for line in open(fname):
-    yield (line.rstrip("\n"), parsed_line(line))
+def unparsed_and_parsed_lines(fname, jobs=1):
+  """
+  Iterate over the lines of a EGC file, yielding tuples
+  (<line without newline>, <decoded line>).
 
+  If jobs is larger than 1 (or None or 0, which mean: one per CPU),
+  the file is split in line-aligned chunks, which are decoded by a pool
+  of worker processes; the lines are yielded in the original order.
+  """
+  jobs = _n_jobs(jobs)
+  if jobs > 1 and os.path.getsize(fname) > 0:
+    decoded = _parallel_unparsed_and_parsed_lines(fname, jobs)
+  else:
+    decoded = ((line.rstrip("\n"), parsed_line(line)) \
+               for line in open(fname, encoding=ENCODING))
+  return profiling.timed("parser.decode", decoded)
@@ -1,25 +1,60 @@
 # Methods related to the PGTO which is available as submodule under data
+#
+# Loading the ontology with pronto and traversing it is slow, thus the
+# information about the group type terms is compiled into a lookup table,
+# which is stored as JSON file and used as long as the ontology file does not
+# change (the sha256 of the ontology file is stored in the table). The table
+# is searched at the following locations:
+# - in the package data directory (pgto_group_types.json), where it can be
+#   created using compile_group_types_table() before packaging
+# - in the egctools cache directory (EGCTOOLS_CACHE_DIR environment variable,
+#   otherwise $XDG_CACHE_HOME/egctools or ~/.cache/egctools), where it is
+#   written automatically, after rebuilding it from the ontology
 
-import importlib
-import pronto
+import os
+import json
+import functools
 
-_data = importlib.resources.files("egctools").joinpath("data")
-_pgto_dir = _data.joinpath("pgto")
-_pgto_file = _pgto_dir.joinpath("group_type.obo")
-PGTO = pronto.Ontology(_pgto_file)
+GROUP_TYPES_TABLE_VERSION = 1
+GROUP_TYPES_TABLE_FILENAME = "pgto_group_types.json"
 
-def group_types_info(root_id='GR0000'):
-  """
-  A list of tuples with information about the terms in 'group_type'
-  namespace of the PGTO ontology.
+ROOT_ID = 'GR0000'
+CATEGORY_ROOTS = {
+  'taxonomy': 'GT0000',
+  'habitat': 'GH0000',
+  'phenotype': 'GP0000',
+  'location': 'GL0000',
+  'derived': 'GX0000',
+}
 
-  Return value:
-    For each term, it returns a tuple (<EGC_label>, <ID>, <name>).
-    Thereby <EGC_label> is the "resource" (i.e. value) associated to the
-    "EGC_label" property of the term.
+_PGTO = None
+
+def _data_path(*parts):
+  import importlib.resources
+  return importlib.resources.files("egctools").joinpath("data", *parts)
+
+def _ontology_file():
+  return _data_path("pgto", "group_type.obo")
+
+def ontology():
+  """
+  The PGTO ontology, as pronto.Ontology (loaded on first use).
   """
+  global _PGTO
+  if _PGTO is None:
+    import pronto
+    _PGTO = pronto.Ontology(_ontology_file())
+  return _PGTO
+
+def __getattr__(name):
+  if name == "PGTO":
+    return ontology()
+  raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _ontology_group_types_info(root_id):
+  import pronto
   result = []
-  root = PGTO.get(root_id)
+  root = ontology().get(root_id)
   for term in root.subclasses(with_self=False):
     if isinstance(term, pronto.Term):
       if term.namespace == 'group_type':
@@ -28,6 +63,112 @@ def group_types_info(root_id='GR0000'):
         result.append((egc_lbl, term.id, term.name))
   return result
 
+def _build_group_types_table(obo_sha256):
+  """
+  Compile the lookup table from the ontology.
+
+  The table contains the EGC label, name and category of each term
+  and, for the root and each category root, the list of IDs of
+  the terms under it, in the order of the ontology traversal.
+  """
+  terms = {}
+  subclasses = {}
+  for root_id in [ROOT_ID] + list(CATEGORY_ROOTS.values()):
+    subclasses[root_id] = []
+    for egc_lbl, term_id, term_name in _ontology_group_types_info(root_id):
+      terms[term_id] = {'label': egc_lbl, 'name': term_name,
+                        'category': None}
+      subclasses[root_id].append(term_id)
+  for category, root_id in CATEGORY_ROOTS.items():
+    for term_id in subclasses[root_id]:
+      terms[term_id]['category'] = category
+  return {'version': GROUP_TYPES_TABLE_VERSION, 'obo_sha256': obo_sha256,
+          'terms': terms, 'subclasses': subclasses}
+
+def _cache_dir():
+  from .cache import user_cache_dir
+  return user_cache_dir()
+
+def _read_group_types_table(path, obo_sha256):
+  try:
+    with open(path) as f:
+      table = json.load(f)
+  except (OSError, ValueError):
+    return None
+  if table.get('version') != GROUP_TYPES_TABLE_VERSION:
+    return None
+  if obo_sha256 is not None and table.get('obo_sha256') != obo_sha256:
+    return None
+  return table
+
+def compile_group_types_table(path=None):
+  """
+  Rebuild the lookup table from the ontology and write it to the given path
+  (default: the egctools cache directory). Returns the table.
+  """
+  from .cache import file_sha256
+  table = _build_group_types_table(file_sha256(_ontology_file()))
+  if path is None:
+    path = os.path.join(_cache_dir(), GROUP_TYPES_TABLE_FILENAME)
+  tmp_path = f"{path}.{os.getpid()}.tmp"
+  try:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(tmp_path, "w") as f:
+      json.dump(table, f)
+    os.replace(tmp_path, path)
+  except OSError:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+  _group_types_table.cache_clear()
+  _group_types_info.cache_clear()
+  _group_type_categories.cache_clear()
+  return table
+
+@functools.lru_cache(maxsize=None)
+def _group_types_table():
+  """
+  The lookup table, from the first valid JSON file found, or rebuilt
+  from the ontology if none is found (or the ontology changed).
+
+  If the ontology file is not available, the tables are used
+  without checking if they are up-to-date.
+  """
+  from .cache import file_sha256
+  obo_file = _ontology_file()
+  obo_sha256 = file_sha256(obo_file) if os.path.exists(obo_file) else None
+  for path in [str(_data_path(GROUP_TYPES_TABLE_FILENAME)),
+               os.path.join(_cache_dir(), GROUP_TYPES_TABLE_FILENAME)]:
+    table = _read_group_types_table(path, obo_sha256)
+    if table is not None:
+      return table
+  return compile_group_types_table()
+
+@functools.lru_cache(maxsize=None)
+def _group_types_info(root_id):
+  table = _group_types_table()
+  if root_id not in table['subclasses']:
+    return tuple(_ontology_group_types_info(root_id))
+  return tuple((table['terms'][term_id]['label'], term_id,
+                table['terms'][term_id]['name']) \
+               for term_id in table['subclasses'][root_id])
+
+def group_types_info(root_id=ROOT_ID):
+  """
+  A list of tuples with information about the terms in 'group_type'
+  namespace of the PGTO ontology.
+
+  Return value:
+    For each term, it returns a tuple (<EGC_label>, <ID>, <name>).
+    Thereby <EGC_label> is the "resource" (i.e. value) associated to the
+    "EGC_label" property of the term.
+  """
+  return list(_group_types_info(root_id))
+
+@functools.lru_cache(maxsize=None)
+def _group_type_choices():
+  return tuple((egc_lbl, f"{term_id} ({term_name})") \
+      for egc_lbl, term_id, term_name in _group_types_info(ROOT_ID))
+
 def group_type_choices():
   """
   A list of tuples for use in choice fields of web interfaces
@@ -39,26 +180,39 @@ def group_type_choices():
       property of the term.
     - <string>: term name, preceded by the term ID in parentheses.
   """
-  return [(egc_lbl, f"{term_id} ({term_name})") \
-      for egc_lbl, term_id, term_name in group_types_info()]
+  return list(_group_type_choices())
 
-def group_types(root_id='GR0000'):
+def group_types(root_id=ROOT_ID):
   """
   A list of EGC labels of the terms in namespace 'group_type' of the PGTO.
   """
-  return [egc_lbl for egc_lbl, term_id, term_name in group_types_info(root_id)]
+  return [egc_lbl for egc_lbl, term_id, term_name \
+          in _group_types_info(root_id)]
+
+@functools.lru_cache(maxsize=None)
+def _group_type_categories():
+  table = _group_types_table()
+  return {term['label']: term['category'] \
+          for term in table['terms'].values() if term['category']}
+
+def group_type_categories():
+  """
+  A dict with the category (taxonomy, habitat, phenotype, location or
+  derived) of each EGC label of the terms in namespace 'group_type'.
+  """
+  return dict(_group_type_categories())
 
 def habitat_group_types():
-  return group_types('GH0000')
+  return group_types(CATEGORY_ROOTS['habitat'])
 
 def phenotype_group_types():
-  return group_types('GP0000')
+  return group_types(CATEGORY_ROOTS['phenotype'])
 
 def taxonomy_group_types():
-  return group_types('GT0000')
+  return group_types(CATEGORY_ROOTS['taxonomy'])
 
 def location_group_types():
-  return group_types('GL0000')
+  return group_types(CATEGORY_ROOTS['location'])
 
 def derived_group_types():
-  return group_types('GX0000')
+  return group_types(CATEGORY_ROOTS['derived'])
@@ -0,0 +1,284 @@
+#
+# Profiling of the processing stages
+#
+# The stages of the processing (decoding of the lines, cache access,
+# construction of the index and reference graph of EGCData, extraction,
+# collection of the stats, rendering of the templates, ...) are measured
+# by named timers, when profiling is enabled; by default it is not, and the
+# timers do nothing. For each stage, the number of calls, the total time
+# and the number of processed records are recorded; if memory profiling is
+# enabled, also the peak of the memory allocated (as traced by tracemalloc)
+# while the stage was running. Named counters can be incremented, too.
+#
+# Stages can be nested (e.g. the decoding of the lines is part of the
+# loading of a file), thus their times are not additive. The work of
+# worker processes (jobs > 1) is not profiled: the time of the stages
+# running in the main process includes the time waiting for the workers.
+#
+# Usage:
+#
+#   profiling.enable(memory=True)
+#   with profiling.timer("stage.name") as t:
+#     ...
+#     t.n_records += n
+#   for item in profiling.timed("stage.name", iterable):
+#     ...
+#   profiling.report()
+#
+# or, as done by the scripts (option --profile):
+#
+#   with profiling.profile():
+#     ...
+#
+import sys
+import time
+import tracemalloc
+import contextlib
+
+_enabled = False
+_memory = False
+_stages = {}
+_counters = {}
+_running = []
+
+class Stage:
+  """
+  Measurements of a stage: number of calls, total time (seconds), number
+  of processed records, peak of the traced memory (bytes, None if not
+  measured); depth is the number of stages running when the stage
+  was first started.
+  """
+  __slots__ = ("name", "depth", "calls", "seconds", "n_records",
+               "peak_memory")
+
+  def __init__(self, name, depth):
+    self.name = name
+    self.depth = depth
+    self.calls = 0
+    self.seconds = 0.0
+    self.n_records = 0
+    self.peak_memory = None
+
+  @property
+  def records_per_second(self):
+    if not self.n_records or not self.seconds:
+      return None
+    return self.n_records / self.seconds
+
+  def as_dict(self):
+    return {'name': self.name, 'depth': self.depth, 'calls': self.calls,
+            'seconds': self.seconds, 'n_records': self.n_records,
+            'records_per_second': self.records_per_second,
+            'peak_memory': self.peak_memory}
+
+def _stage(name):
+  stage = _stages.get(name)
+  if stage is None:
+    stage = Stage(name, len(_running))
+    _stages[name] = stage
+  return stage
+
+def _update_peaks():
+  # the peak since the last reset is accounted to all running timers,
+  # then it is reset, so that the peak of each timer can be measured
+  peak = tracemalloc.get_traced_memory()[1]
+  for t in _running:
+    if peak > t.peak:
+      t.peak = peak
+  tracemalloc.reset_peak()
+
+class _Timer:
+  __slots__ = ("stage", "n_records", "start", "peak")
+
+  def __init__(self, stage, n_records):
+    self.stage = stage
+    self.n_records = n_records
+    self.peak = 0
+
+  def __enter__(self):
+    if _memory:
+      _update_peaks()
+    _running.append(self)
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc):
+    seconds = time.perf_counter() - self.start
+    stage = self.stage
+    if _memory and tracemalloc.is_tracing():
+      _update_peaks()
+      if stage.peak_memory is None or self.peak > stage.peak_memory:
+        stage.peak_memory = self.peak
+    _running.remove(self)
+    stage.calls += 1
+    stage.seconds += seconds
+    stage.n_records += self.n_records
+
+class _NullTimer:
+  # returned by timer() if profiling is disabled; the number of records
+  # set by the caller is ignored
+
+  __slots__ = ()
+
+  n_records = property(lambda self: 0, lambda self, value: None)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    pass
+
+_NULL_TIMER = _NullTimer()
+
+def is_enabled():
+  return _enabled
+
+def enable(memory=False):
+  """
+  Enable the timers and counters; if memory is True, the peak memory
+  of the stages is measured, using tracemalloc (which is started, if it
+  is not running yet, and slows down the processing considerably).
+  """
+  global _enabled, _memory
+  _enabled = True
+  _memory = memory
+  if memory and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+def disable():
+  """
+  Disable the timers and counters (the measurements are kept).
+  """
+  global _enabled, _memory
+  if _memory and tracemalloc.is_tracing():
+    tracemalloc.stop()
+  _enabled = False
+  _memory = False
+
+def reset():
+  """
+  Forget the measurements.
+  """
+  _stages.clear()
+  _counters.clear()
+
+def timer(name, n_records=0):
+  """
+  Context manager measuring a stage; the number of processed records
+  can be given or set/incremented using the n_records attribute
+  of the returned object.
+  """
+  if not _enabled:
+    return _NULL_TIMER
+  return _Timer(_stage(name), n_records)
+
+def _timed(stage, iterable):
+  perf_counter = time.perf_counter
+  seconds = 0.0
+  n_records = 0
+  iterator = iter(iterable)
+  try:
+    while True:
+      start = perf_counter()
+      try:
+        item = next(iterator)
+      except StopIteration:
+        seconds += perf_counter() - start
+        return
+      seconds += perf_counter() - start
+      n_records += 1
+      yield item
+  finally:
+    stage.calls += 1
+    stage.seconds += seconds
+    stage.n_records += n_records
+
+def timed(name, iterable):
+  """
+  Measure the time spent producing the items of an iterable (each item
+  is counted as a record); the time spent by the consumer of the items
+  is not included. Returns the iterable itself, if profiling is disabled.
+  """
+  if not _enabled:
+    return iterable
+  return _timed(_stage(name), iterable)
+
+def add(name, seconds, n_records=0, calls=1):
+  """
+  Add a measurement to a stage, e.g. for stages which are too short
+  for a timer, whose times are summed by the caller.
+  """
+  if _enabled:
+    stage = _stage(name)
+    stage.calls += calls
+    stage.seconds += seconds
+    stage.n_records += n_records
+
+def count(name, n=1):
+  """
+  Increment a counter.
+  """
+  if _enabled:
+    _counters[name] = _counters.get(name, 0) + n
+
+def stages():
+  """
+  The measured stages (Stage objects), in the order they were first started.
+  """
+  return list(_stages.values())
+
+def counters():
+  return dict(_counters)
+
+def results():
+  """
+  The measurements, as a dict with keys 'stages' (list of dicts, see
+  Stage.as_dict) and 'counters' (dict).
+  """
+  return {'stages': [stage.as_dict() for stage in _stages.values()],
+          'counters': counters()}
+
+def _format(value, fmt):
+  return "-" if value is None else format(value, fmt)
+
+def report(out=None):
+  """
+  Print a table of the measurements (by default to the standard error);
+  the names of the stages are indented by their nesting depth.
+  """
+  if out is None:
+    out = sys.stderr
+  width = max([len("stage")] + [2 * s.depth + len(s.name) \
+                                for s in _stages.values()])
+  out.write(f"{'stage':<{width}}  {'calls':>8}  {'seconds':>10}  "+\
+            f"{'records':>10}  {'records/s':>12}  {'peak MiB':>9}\n")
+  for s in _stages.values():
+    name = "  " * s.depth + s.name
+    peak = None if s.peak_memory is None else s.peak_memory / (1 << 20)
+    out.write(f"{name:<{width}}  {s.calls:>8}  {s.seconds:>10.4f}  "+\
+              f"{s.n_records:>10}  "+\
+              f"{_format(s.records_per_second, '.1f'):>12}  "+\
+              f"{_format(peak, '.1f'):>9}\n")
+  if _counters:
+    width = max(len("counter"), max(len(name) for name in _counters))
+    out.write(f"\n{'counter':<{width}}  {'value':>10}\n")
+    for name, value in _counters.items():
+      out.write(f"{name:<{width}}  {value:>10}\n")
+
+@contextlib.contextmanager
+def profile(enabled=True, memory=True, out=None):
+  """
+  Enable profiling in a block and report the measurements at its end
+  (also if it is left by an exception, e.g. by sys.exit), see report;
+  if enabled is False, nothing is done.
+  """
+  if not enabled:
+    yield
+    return
+  reset()
+  enable(memory)
+  try:
+    yield
+  finally:
+    disable()
+    report(out)
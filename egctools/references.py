@@ -1,41 +1,113 @@
-import textformats
+#
+# Extraction and update of the references of the records to other records
+#
+# The get_*_to_* functions return the IDs of the records of a type referenced
+# by a record; REFS_BY_RECORD_TYPE lists the functions to use for each
+# record type. The update_*_in_* functions change a referenced ID.
+#
 import re
-import importlib.resources
-_data = importlib.resources.files("egctools").joinpath("data")
-_egcspec = _data.joinpath("egc-spec")
-_specfile = _egcspec.joinpath("egc.tf.yaml")
-SPEC = textformats.Specification(str(_specfile))
+
+# IDs in the definition of a combined or inverted group,
+# or of an enumerating unit
+_ID_RE = re.compile(r"[a-zA-Z0-9_]+")
+_DERIVED_RE = re.compile(r'derived:([a-zA-Z0-9_]+):')
+_HOMOLOG_RE = re.compile(r'homolog:([a-zA-Z0-9_]+)')
+
+# types of groups, whose definition consists of other groups
+EXPANDED_G_TYPES = ('combined', 'inverted')
+
+def G_ids_in_definition(definition):
+  return _ID_RE.findall(definition)
 
 def get_G_to_G(line):
   parent_groups = []
-  if line['type'] == 'combined' or line['type'] == 'inverted':
-    parent_groups.extend(re.findall(r"[a-zA-Z0-9_]+", line["definition"]))
-  m = re.match(r'^derived:([a-zA-Z0-9_]+):.*', line['definition'])
+  if line['type'] in EXPANDED_G_TYPES:
+    parent_groups.extend(G_ids_in_definition(line["definition"]))
+  m = _DERIVED_RE.match(line['definition'])
   if m:
     parent_groups.append(m.group(1))
   return parent_groups
 
+class GroupLeafTypes:
+  """
+  Types of the leaf groups of the groups, i.e. the groups reached by
+  expanding the definitions of combined and inverted groups (recursively).
+
+  The groups are given as a mapping of group IDs to records (or dicts
+  with the type and definition of the groups); the types are computed on
+  first access and memoized, thus each group is expanded only once.
+  If the content of the mapping changes, clear() must be called.
+  """
+
+  def __init__(self, groups):
+    self._groups = groups
+    self._types = {}
+
+  def clear(self):
+    self._types = {}
+
+  def of_group(self, group_id):
+    """
+    Set of the leaf types of a group (its own type, if it is not
+    a combined or inverted group).
+
+    Raises a KeyError if a group does not exist and a ValueError
+    if the definitions of the groups contain a cycle.
+    """
+    types = self._types
+    expanding = set()
+    stack = [group_id]
+    while stack:
+      g = stack[-1]
+      if g in types:
+        stack.pop()
+        continue
+      group = self._groups[g]
+      if group['type'] not in EXPANDED_G_TYPES:
+        types[g] = frozenset([group['type']])
+        stack.pop()
+        continue
+      children = G_ids_in_definition(group['definition'])
+      pending = [c for c in children if c not in types]
+      if pending and g not in expanding:
+        expanding.add(g)
+        for c in pending:
+          if c in expanding:
+            raise ValueError('Cycle in the definitions of the groups: '+\
+                             '{} is contained in {}'.format(c, g))
+          stack.append(c)
+        continue
+      types[g] = frozenset().union(*[types[c] for c in children])
+      expanding.discard(g)
+      stack.pop()
+    return types[group_id]
+
+  def of_definition(self, definition):
+    """
+    Set of the leaf types of the groups in a definition.
+    """
+    return frozenset().union(*[self.of_group(g) \
+                               for g in G_ids_in_definition(definition)])
+
 def update_G_in_G(line, old_id, new_id):
   line['definition'] = re.sub(r"\b%s\b" % old_id, new_id, line['definition'])
   return line
 
 def get_U_to_U(line):
   parent_units = []
-  if line['type']['base_type'].endswith('_homologs'):
-    m = re.match(r'^homolog:([a-zA-Z0-9_]+)', line['definition'])
+  utype = line['type']
+  if utype['base_type'].endswith('_homologs'):
+    m = _HOMOLOG_RE.match(line['definition'])
     if m:
       parent_units.append(m.group(1))
-  elif line['type']['base_type'] == 'arrangement' \
-      and line['type']['enumerating']:
-    parts = line['definition'].split(',')
-    for part in parts:
-      m = re.match(r'^([a-zA-Z0-9_]+)$', part)
-      if m:
-        parent_units.append(m.group(1))
-  elif line['type']['enumerating']:
-    parent_units = re.findall(r"[a-zA-Z0-9_]+", line["definition"])
+  elif utype['base_type'] == 'arrangement' and utype['enumerating']:
+    for part in line['definition'].split(','):
+      if _ID_RE.fullmatch(part):
+        parent_units.append(part)
+  elif utype['enumerating']:
+    parent_units = _ID_RE.findall(line["definition"])
   elif line['definition'].startswith('derived:'):
-    m = re.match(r'^derived:([a-zA-Z0-9_]+):.*', line['definition'])
+    m = _DERIVED_RE.match(line['definition'])
     if m:
       parent_units.append(m.group(1))
   return parent_units
@@ -107,8 +179,10 @@ def update_G_in_VC(line, old_id, new_id):
   return line
 
 def get_ST_to_D(line):
-  document_id_dt = SPEC["external_resource::external_resource_link"]
-  return [document_id_dt.encode(line['document_id'])]
+  # same as EGCData.compute_docid
+  document_id = line['document_id']
+  return ['-'.join(['D', document_id['resource_prefix'],
+                    document_id['item']])]
 
 def get_M_to_U(line):
   return [line['unit_id']]
@@ -117,3 +191,163 @@ def update_U_in_M(line, old_id, new_id):
   line['unit_id'] = new_id
   return line
 
+# (referenced record type, function returning the referenced IDs) for each
+# record type; the references of V/C records to S/T records (get_VC_to_ST)
+# are not included, as the type of the referenced records is not known
+REFS_BY_RECORD_TYPE = {
+  'D': (),
+  'S': (('D', get_ST_to_D),),
+  'T': (('D', get_ST_to_D),),
+  'G': (('G', get_G_to_G),),
+  'U': (('U', get_U_to_U),),
+  'A': (('U', get_A_to_U),),
+  'M': (('U', get_M_to_U),),
+  'V': (('A', get_VC_to_A), ('G', get_VC_to_G)),
+  'C': (('A', get_VC_to_A), ('G', get_VC_to_G)),
+}
+
+def get_refs(line):
+  """
+  List of (record type, ID) of the records referenced by a record
+  (without the references of V/C records to S/T records).
+  """
+  return [(ref_type, ref_id) \
+          for ref_type, get_ids in REFS_BY_RECORD_TYPE[line['record_type']] \
+          for ref_id in get_ids(line)]
+
+#
+# Scanning of the references in the undecoded lines
+#
+# For indexing a file without decoding its lines (EGCData lazy mode), the ID
+# and the references of a record are taken from the tab-separated columns
+# of its line, if the columns containing them are plain IDs (or words, for
+# the group types and attribute modes). Otherwise (e.g. multiple sources or
+# attributes, relative count modes, units with a definition) the line
+# must be decoded.
+#
+# The scanned value of a column is only the decoded value if the column
+# does not use any of the further syntax of the EGC format (quoting,
+# escapes, comments); thus the lines containing any quote, backslash or
+# hash character (in any column) are always decoded.
+#
+
+# characters which are never part of a scanned line
+_NOT_PLAIN = r"\t\"'\\#"
+
+# patterns of the columns which can be scanned; a document ID is
+# prefix:item, split at the first colon (as in merge.line_record_id)
+_SCAN_PATTERNS = {
+  'id': r"[a-zA-Z0-9_]+",
+  'word': r"[a-z_]+",
+  'document_id': r"(?P<resource_prefix>[^:\s{0}]+):(?P<item>[^\s{0}]+)".\
+                 format(_NOT_PLAIN),
+  'plain': r"[^{}]*".format(_NOT_PLAIN),
+}
+
+# fields of the first columns of the lines of each record type, in the
+# order of the EGC specification, with the pattern of their content
+# (None: field not needed for the references); the further columns
+# must be plain
+_SCAN_COLUMNS = {
+  'D': [('document_id', 'document_id')],
+  'S': [('id', 'id'), ('document_id', 'document_id')],
+  'T': [('id', 'id'), ('document_id', 'document_id')],
+  'G': [('id', 'id'), (None, 'plain'), ('type', 'word'),
+        ('definition', 'plain')],
+  'U': [('id', 'id'), (None, 'plain'), (None, 'plain'), (None, 'plain'),
+        ('definition', 'plain')],
+  'A': [('id', 'id'), ('unit_id', 'id'), ('mode', 'word')],
+  'M': [('unit_id', 'id'), ('resource_id', 'id'), ('model_id', 'id')],
+  'V': [('id', 'id'), ('source', 'id'), ('attribute', 'id'),
+        ('group', 'id')],
+  'C': [('id', 'id'), ('source', 'id'), ('attribute', 'id'),
+        ('group1', 'id'), ('group2', 'id')],
+}
+
+def _scan_regex(rt, columns):
+  regex = re.escape(rt)
+  for field, pattern in columns:
+    pattern = _SCAN_PATTERNS[pattern]
+    if field is not None and field != 'document_id':
+      pattern = "(?P<{}>{})".format(field, pattern)
+    regex += "\t" + pattern
+  return re.compile(regex + r"(?:\t{})*\Z".format(_SCAN_PATTERNS['plain']))
+
+_SCAN_RE = {rt: _scan_regex(rt, columns) \
+            for rt, columns in _SCAN_COLUMNS.items()}
+
+def scan_line(line):
+  """
+  Scan an undecoded line for the references of its record.
+
+  Returns a tuple (record, refs), where record is a dict with the record
+  type and the scanned fields (enough for computing the record ID and the
+  references of V/C records to S/T records, see get_VC_to_ST) and refs is
+  as returned by get_refs; or None, if the line must be decoded for this.
+  """
+  rt = line[:1]
+  regex = _SCAN_RE.get(rt)
+  if regex is None:
+    return None
+  m = regex.match(line.rstrip("\n"))
+  if m is None:
+    return None
+  record = m.groupdict()
+  record['record_type'] = rt
+  if rt in ['V', 'C']:
+    for key in ['group', 'group1', 'group2']:
+      if key in record:
+        record[key] = {'id': record[key]}
+  elif 'item' in record:
+    record['document_id'] = {'resource_prefix': record.pop('resource_prefix'),
+                             'item': record.pop('item')}
+  elif rt == 'U':
+    # the references of an unit depend on its type, which is not scanned;
+    # an unit without definition has no references
+    if record['definition'] != '.':
+      return None
+    return record, []
+  return record, get_refs(record)
+
+#
+# Update of multiple references at once, given a dict {old_id: new_id}
+#
+
+def ids_regex(ids):
+  """
+  Compiled regular expression matching any of the given IDs as a word.
+  """
+  ids = sorted(ids, key=len, reverse=True)
+  return re.compile(r"\b(?:%s)\b" % "|".join(re.escape(i) for i in ids))
+
+def update_ids_in_definition(line, regex, mapping):
+  line['definition'] = regex.sub(lambda m: mapping[m.group(0)],
+                                 line['definition'])
+  return line
+
+def update_ids_in_A(line, mapping):
+  line['unit_id'] = mapping.get(line['unit_id'], line['unit_id'])
+  if isinstance(line['mode'], dict) and 'reference' in line['mode']:
+    line['mode']['reference'] = mapping.get(line['mode']['reference'],
+                                            line['mode']['reference'])
+  return line
+
+def update_ids_in_VC(line, mapping):
+  if isinstance(line['source'], list):
+    line['source'] = [mapping.get(x, x) for x in line['source']]
+  else:
+    line['source'] = mapping.get(line['source'], line['source'])
+  if isinstance(line['attribute'], dict):
+    for key in ['id1', 'id2']:
+      line['attribute'][key] = mapping.get(line['attribute'][key],
+                                           line['attribute'][key])
+  else:
+    line['attribute'] = mapping.get(line['attribute'], line['attribute'])
+  for key in ['group', 'group1', 'group2']:
+    if key in line:
+      line[key]['id'] = mapping.get(line[key]['id'], line[key]['id'])
+  return line
+
+def update_ids_in_M(line, mapping):
+  line['unit_id'] = mapping.get(line['unit_id'], line['unit_id'])
+  return line
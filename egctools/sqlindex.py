@@ -0,0 +1,550 @@
+#
+# On-disk SQLite index of EGC files
+#
+# The index database (by default the EGC filename with the suffix
+# '.egcindex') contains the following tables:
+# - meta: description of the EGC file from which the index was computed
+#   (size, modification time and sha256 of the content, as for the cache)
+# - records: for each record number: record type, byte offset and length
+#   of the line in the EGC file; the lines of created or updated records
+#   are stored in the 'line' column instead
+# - ids: record ID -> record number
+# - edges: the reference graph, one row for each edge (rt1, id1) -> (rt2, id2);
+#   the rowid is used for keeping the insertion order
+#
+# IndexedEGCData is an EGCData whose lines, index and reference graph are
+# stored in the database: opening a file does not read it, records are read
+# (by seeking to their offset) and decoded when they are accessed.
+#
+# The edits are done in a database transaction, which is only committed when
+# the EGC file is written (save()/compact()), so that the committed index
+# always describes the content of the file. In journal mode, save() only
+# writes the journal; the journal is replayed on the index when the file
+# is opened again.
+#
+import os
+import shutil
+import sqlite3
+import contextlib
+from collections.abc import MutableMapping
+from .parser import unparsed_and_parsed_lines
+from .egcdata import EGCData, _LazyRecords
+from . import cache as egccache
+from . import profiling
+
+INDEX_SUFFIX = ".egcindex"
+INDEX_VERSION = 1
+
+# number of rows inserted at once while the index is constructed
+BUFFER_SIZE = 10000
+
+_SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value);
+CREATE TABLE records (rnum INTEGER PRIMARY KEY, record_type TEXT,
+                      offset INTEGER, length INTEGER, line TEXT);
+CREATE INDEX records_by_type ON records (record_type, rnum);
+CREATE TABLE ids (id TEXT PRIMARY KEY, rnum INTEGER NOT NULL) WITHOUT ROWID;
+CREATE TABLE edges (rt1 TEXT, id1 TEXT, rt2 TEXT, id2 TEXT,
+                    UNIQUE (rt1, id1, rt2, id2));
+CREATE INDEX edges_by_target ON edges (rt2, id2, rt1);
+"""
+
+def index_path(file_path, db_path=None):
+  """
+  Path of the index database of a EGC file.
+  """
+  return db_path if db_path is not None else file_path + INDEX_SUFFIX
+
+def _file_header(file_path, sha256=None):
+  st = os.stat(file_path)
+  if sha256 is None:
+    sha256 = egccache.file_sha256(file_path)
+  return {'version': INDEX_VERSION, 'size': st.st_size,
+          'mtime_ns': st.st_mtime_ns, 'sha256': sha256}
+
+def _line_spans(file_path):
+  """
+  Byte offset and length (without line terminator) of each line of a file.
+  """
+  offset = 0
+  with open(file_path, 'rb') as f:
+    for line in f:
+      yield offset, len(line.rstrip(b"\r\n"))
+      offset += len(line)
+
+class _Database:
+  """
+  Connection to the index database.
+
+  A transaction is started by the first write and lasts until commit()
+  or rollback() is called.
+  """
+
+  def __init__(self, db_path):
+    self.conn = sqlite3.connect(db_path, isolation_level=None)
+    self.conn.execute("PRAGMA journal_mode=WAL")
+
+  def read(self, sql, params=()):
+    return self.conn.execute(sql, params)
+
+  def read_value(self, sql, params=()):
+    row = self.conn.execute(sql, params).fetchone()
+    return None if row is None else row[0]
+
+  def write(self, sql, params=()):
+    if not self.conn.in_transaction:
+      self.conn.execute("BEGIN")
+    return self.conn.execute(sql, params)
+
+  def write_many(self, sql, rows):
+    if not self.conn.in_transaction:
+      self.conn.execute("BEGIN")
+    return self.conn.executemany(sql, rows)
+
+  def commit(self):
+    if self.conn.in_transaction:
+      self.conn.execute("COMMIT")
+
+  def rollback(self):
+    if self.conn.in_transaction:
+      self.conn.execute("ROLLBACK")
+
+  def close(self):
+    self.rollback()
+    self.conn.close()
+
+class _Lines:
+  """
+  List-like access to the lines of the records, by record number.
+
+  Unchanged lines are read from the EGC file; deleted records have
+  no line (None).
+  """
+
+  def __init__(self, db, file_path):
+    self._db = db
+    self._file_path = file_path
+    self._file = open(file_path, 'rb')
+    self.reset()
+
+  def reset(self):
+    n = self._db.read_value("SELECT max(rnum) FROM records")
+    self._n = 0 if n is None else n + 1
+
+  def reopen(self):
+    self._file.close()
+    self._file = open(self._file_path, 'rb')
+
+  def close(self):
+    self._file.close()
+
+  def _line(self, offset, length, line):
+    if line is None and offset is not None:
+      self._file.seek(offset)
+      line = self._file.read(length).decode()
+    return line
+
+  def __len__(self):
+    return self._n
+
+  def __getitem__(self, record_num):
+    if record_num < 0:
+      record_num += self._n
+    row = self._db.read("SELECT offset, length, line FROM records "+\
+                        "WHERE rnum = ?", (record_num,)).fetchone()
+    if row is None:
+      return None
+    return self._line(*row)
+
+  def __setitem__(self, record_num, line):
+    if record_num < 0:
+      record_num += self._n
+    self._db.write("UPDATE records SET offset = NULL, length = NULL, "+\
+                   "line = ? WHERE rnum = ?", (line, record_num))
+
+  def __iter__(self):
+    rows = self._db.read("SELECT rnum, offset, length, line FROM records "+\
+                         "ORDER BY rnum").fetchall()
+    record_num = 0
+    for rnum, offset, length, line in rows:
+      while record_num < rnum:
+        yield None
+        record_num += 1
+      yield self._line(offset, length, line)
+      record_num += 1
+
+  def append(self, line):
+    self._db.write("INSERT INTO records (rnum, line) VALUES (?, ?)",
+                   (self._n, line))
+    self._n += 1
+
+class _RecordIDs(MutableMapping):
+  """
+  Dict-like mapping of record IDs to record numbers.
+  """
+
+  def __init__(self, db):
+    self._db = db
+
+  def __getitem__(self, record_id):
+    record_num = self._db.read_value("SELECT rnum FROM ids WHERE id = ?",
+                                     (record_id,))
+    if record_num is None:
+      raise KeyError(record_id)
+    return record_num
+
+  def __contains__(self, record_id):
+    return self._db.read_value("SELECT 1 FROM ids WHERE id = ?",
+                               (record_id,)) is not None
+
+  def __setitem__(self, record_id, record_num):
+    self._db.write("INSERT OR REPLACE INTO ids (id, rnum) VALUES (?, ?)",
+                   (record_id, record_num))
+
+  def __delitem__(self, record_id):
+    if self._db.write("DELETE FROM ids WHERE id = ?",
+                      (record_id,)).rowcount == 0:
+      raise KeyError(record_id)
+
+  def __iter__(self):
+    for (record_id,) in self._db.read("SELECT id FROM ids ORDER BY rnum"):
+      yield record_id
+
+  def __len__(self):
+    return self._db.read_value("SELECT count(*) FROM ids")
+
+class _RecordNums(MutableMapping):
+  """
+  Dict-like set of the record numbers of a record type (the values are None).
+  """
+
+  def __init__(self, db, record_type):
+    self._db = db
+    self._rt = record_type
+
+  def __getitem__(self, record_num):
+    if record_num not in self:
+      raise KeyError(record_num)
+    return None
+
+  def __contains__(self, record_num):
+    return self._db.read_value("SELECT 1 FROM records "+\
+        "WHERE rnum = ? AND record_type = ?", (record_num, self._rt)) \
+        is not None
+
+  def __setitem__(self, record_num, value):
+    self._db.write("UPDATE records SET record_type = ? WHERE rnum = ?",
+                   (self._rt, record_num))
+
+  def __delitem__(self, record_num):
+    if self._db.write("UPDATE records SET record_type = NULL "+\
+        "WHERE rnum = ? AND record_type = ?",
+        (record_num, self._rt)).rowcount == 0:
+      raise KeyError(record_num)
+
+  def __iter__(self):
+    for (record_num,) in self._db.read("SELECT rnum FROM records "+\
+        "WHERE record_type = ? ORDER BY rnum", (self._rt,)).fetchall():
+      yield record_num
+
+  def __len__(self):
+    return self._db.read_value("SELECT count(*) FROM records "+\
+                               "WHERE record_type = ?", (self._rt,))
+
+class _RecordNumsByType:
+  """
+  Dict-like access to the record numbers of each record type.
+  """
+
+  def __init__(self, db):
+    self._db = db
+
+  def __getitem__(self, record_type):
+    return _RecordNums(self._db, record_type)
+
+class SQLiteGraph:
+  """
+  Reference graph stored in the edges table of the index database.
+
+  It has the same interface as the graphs of egctools.graph. As each edge
+  is stored only once, renaming a node also changes the adjacency lists of
+  the connected nodes (replace_in_refs/replace_in_ref_by do nothing
+  in this case). Edges added by connect() are buffered and inserted at once,
+  before the graph is accessed.
+  """
+
+  def __init__(self, db):
+    self._db = db
+    self._buffer = []
+
+  def finalize(self):
+    if self._buffer:
+      self._db.write_many("INSERT OR IGNORE INTO edges VALUES (?, ?, ?, ?)",
+                          self._buffer)
+      self._buffer = []
+
+  def has_node(self, rt, record_id):
+    self.finalize()
+    return self._db.read_value("SELECT EXISTS (SELECT 1 FROM edges "+\
+        "WHERE rt1 = ? AND id1 = ?) OR EXISTS (SELECT 1 FROM edges "+\
+        "WHERE rt2 = ? AND id2 = ?)", (rt, record_id, rt, record_id)) == 1
+
+  def nodes(self):
+    """
+    Iterate over the nodes (the records with edges), as
+    (record type, record ID) tuples.
+    """
+    self.finalize()
+    yield from self._db.read("SELECT rt1, id1 FROM edges UNION "+\
+                             "SELECT rt2, id2 FROM edges").fetchall()
+
+  def connect(self, rt1, id1, rt2, id2):
+    self._buffer.append((rt1, id1, rt2, id2))
+    if len(self._buffer) >= BUFFER_SIZE:
+      self.finalize()
+
+  def has_edge(self, rt1, id1, rt2, id2):
+    self.finalize()
+    return self._db.read_value("SELECT 1 FROM edges WHERE rt1 = ? AND "+\
+        "id1 = ? AND rt2 = ? AND id2 = ?", (rt1, id1, rt2, id2)) is not None
+
+  def refs(self, rt, record_id, ref_rt):
+    self.finalize()
+    return [row[0] for row in self._db.read("SELECT id2 FROM edges "+\
+        "WHERE rt1 = ? AND id1 = ? AND rt2 = ? ORDER BY rowid",
+        (rt, record_id, ref_rt))]
+
+  def ref_by(self, rt, record_id, ref_by_rt):
+    self.finalize()
+    return [row[0] for row in self._db.read("SELECT id1 FROM edges "+\
+        "WHERE rt2 = ? AND id2 = ? AND rt1 = ? ORDER BY rowid",
+        (rt, record_id, ref_by_rt))]
+
+  def ref_by_types(self, rt, record_id):
+    self.finalize()
+    return [row[0] for row in self._db.read("SELECT rt1 FROM edges "+\
+        "WHERE rt2 = ? AND id2 = ? GROUP BY rt1 ORDER BY min(rowid)",
+        (rt, record_id))]
+
+  def is_ref_by(self, rt, record_id):
+    self.finalize()
+    return self._db.read_value("SELECT 1 FROM edges "+\
+        "WHERE rt2 = ? AND id2 = ?", (rt, record_id)) is not None
+
+  def remove_node(self, rt, record_id):
+    self.finalize()
+    self._db.write("DELETE FROM edges WHERE rt1 = ? AND id1 = ?",
+                   (rt, record_id))
+    self._db.write("DELETE FROM edges WHERE rt2 = ? AND id2 = ?",
+                   (rt, record_id))
+
+  def clear_refs(self, rt, record_id):
+    self.finalize()
+    self._db.write("DELETE FROM edges WHERE rt1 = ? AND id1 = ?",
+                   (rt, record_id))
+
+  def rename_node(self, rt, old_id, new_id):
+    self.finalize()
+    self._db.write("UPDATE OR REPLACE edges SET id1 = ? "+\
+        "WHERE rt1 = ? AND id1 = ?", (new_id, rt, old_id))
+    self._db.write("UPDATE OR REPLACE edges SET id2 = ? "+\
+        "WHERE rt2 = ? AND id2 = ?", (new_id, rt, old_id))
+
+  def replace_in_refs(self, rt, record_id, ref_rt, old_id, new_id):
+    self.finalize()
+    self._db.write("UPDATE OR REPLACE edges SET id2 = ? WHERE rt1 = ? "+\
+        "AND id1 = ? AND rt2 = ? AND id2 = ?",
+        (new_id, rt, record_id, ref_rt, old_id))
+
+  def replace_in_ref_by(self, rt, record_id, ref_by_rt, old_id, new_id):
+    self.finalize()
+    self._db.write("UPDATE OR REPLACE edges SET id1 = ? WHERE rt2 = ? "+\
+        "AND id2 = ? AND rt1 = ? AND id1 = ?",
+        (new_id, rt, record_id, ref_by_rt, old_id))
+
+  def n_edges(self):
+    self.finalize()
+    return self._db.read_value("SELECT count(*) FROM edges")
+
+class IndexedEGCData(EGCData):
+    """
+    EGCData whose lines, index and reference graph are stored in an
+    SQLite database (see the module description).
+
+    An instance is usually created using
+    IndexedEGCData.from_file(filename), which creates the index database,
+    if it does not exist or does not describe the current content of the
+    file. The interface is the same as for EGCData (except for from_file()),
+    but the records are only read from the file when they are accessed.
+    Unsaved edits are lost when the object is closed (close()).
+    """
+
+    def __init__(self, file_path, db_path=None, lru_size=EGCData.LRU_SIZE):
+        super().__init__(file_path)
+        self.db_path = index_path(file_path, db_path)
+        self.graph_backend = "sqlite"
+        self._lru_size = lru_size
+        self._db = _Database(self.db_path)
+        if not self._has_schema():
+          self._db.conn.executescript(_SCHEMA)
+        self.id2rnum = _RecordIDs(self._db)
+        self._rt2rnums = _RecordNumsByType(self._db)
+        self.graph = SQLiteGraph(self._db)
+        self.lines = _Lines(self._db, file_path)
+        self.records = _LazyRecords(self.lines, lru_size)
+
+    def _has_schema(self):
+      return self._db.read_value("SELECT 1 FROM sqlite_master "+\
+          "WHERE type = 'table' AND name = 'meta'") is not None
+
+    def _stored_header(self):
+      return dict(self._db.read("SELECT key, value FROM meta"))
+
+    def _store_header(self, header):
+      self._db.write_many("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                          header.items())
+
+    def is_up_to_date(self):
+      """
+      Check if the committed index describes the current content of the file.
+      """
+      header = self._stored_header()
+      if header.get('version') != INDEX_VERSION:
+        return False
+      st = os.stat(self.file_path)
+      if header['size'] != st.st_size:
+        return False
+      if header['mtime_ns'] == st.st_mtime_ns:
+        return True
+      return header['sha256'] == egccache.file_sha256(self.file_path)
+
+    def _clear_index(self):
+      for table in ["meta", "records", "ids", "edges"]:
+        self._db.write(f"DELETE FROM {table}")
+
+    def build_index(self, jobs=1):
+      """
+      Construct the index of the file, replacing the content of the database.
+      """
+      self._db.rollback()
+      self._clear_index()
+      self._id_index = None
+      records_rows = []
+      ids_rows = []
+      def flush():
+        self._db.write_many("INSERT INTO records (rnum, record_type, "+\
+            "offset, length) VALUES (?, ?, ?, ?)", records_rows)
+        self._db.write_many("INSERT OR REPLACE INTO ids VALUES (?, ?)",
+                            ids_rows)
+        records_rows.clear()
+        ids_rows.clear()
+      graph_add_record = self._graph_add_record_profiled \
+          if profiling.is_enabled() else self._graph_add_record
+      with profiling.timer("sqlindex.build") as t:
+        decoded = unparsed_and_parsed_lines(self.file_path, jobs)
+        for record_num, ((offset, length), (unparsed, record)) in \
+            enumerate(zip(_line_spans(self.file_path), decoded)):
+          record_id = self.record_id(record)
+          records_rows.append((record_num, record['record_type'],
+                               offset, length))
+          ids_rows.append((record_id, record_num))
+          graph_add_record(record_id, record)
+          if len(records_rows) >= BUFFER_SIZE:
+            flush()
+          t.n_records += 1
+        flush()
+        self._finalize_graph()
+        self._store_header(_file_header(self.file_path))
+        with profiling.timer("sqlindex.commit"):
+          self._db.commit()
+      self._reset()
+
+    def _reset(self):
+      self.lines.reset()
+      self.records = _LazyRecords(self.lines, self._lru_size)
+
+    @classmethod
+    def from_file(cls, file_path, db_path=None, backup=False, jobs=1,
+                  lru_size=EGCData.LRU_SIZE, journal=False, rebuild=False):
+        if not os.path.exists(file_path):
+          raise FileNotFoundError('File not found: {}'.format(file_path))
+        if backup:
+          backup_file_path = EGCData._get_backup_file_path(file_path)
+          if not os.path.exists(backup_file_path):
+            shutil.copyfile(file_path, backup_file_path)
+        egc_data = cls(file_path, db_path, lru_size)
+        if rebuild or not egc_data.is_up_to_date():
+          egc_data.build_index(jobs)
+        egc_data._replay_journal()
+        egc_data.journal = journal
+        return egc_data
+
+    def close(self):
+      """
+      Close the database and the file; unsaved edits are discarded.
+      """
+      self._db.close()
+      self.lines.close()
+
+    def find_all_ids(self, record_type):
+      return [row[0] for row in self._db.read("SELECT ids.id FROM ids "+\
+          "JOIN records ON ids.rnum = records.rnum "+\
+          "WHERE records.record_type = ? ORDER BY ids.rnum", (record_type,))]
+
+    def compact(self, backup=False):
+      super().compact(backup)
+      # the lines are now in the file: store their new offsets
+      self.lines.reopen()
+      self._db.write("DELETE FROM records "+\
+                     "WHERE offset IS NULL AND line IS NULL")
+      rows = self._db.read("SELECT rnum FROM records ORDER BY rnum").\
+          fetchall()
+      self._db.write_many("UPDATE records SET offset = ?, length = ?, "+\
+          "line = NULL WHERE rnum = ?",
+          ((offset, length, record_num) for (offset, length), (record_num,) \
+              in zip(_line_spans(self.file_path), rows)))
+      self._store_header(_file_header(self.file_path, self._file_sha256))
+      self.graph.finalize()
+      self._db.commit()
+      self._reset()
+
+    @contextlib.contextmanager
+    def batch(self):
+      if self._batch is not None:
+        yield self
+        return
+      self.graph.finalize()
+      self._db.write("SAVEPOINT egcbatch")
+      with super().batch():
+        yield self
+      self._db.write("RELEASE egcbatch")
+
+    def _rollback_batch(self):
+      self.graph._buffer = []
+      self._db.write("ROLLBACK TO egcbatch")
+      self._db.write("RELEASE egcbatch")
+      del self._journal_pending[self._batch['n_journal_pending']:]
+      self._batch = None
+      self._VC_to_S_or_T.clear()
+      self._id_index = None
+      self._reset()
+      self._reset_observers()
+
+def build(file_path, db_path=None, jobs=1, force=False):
+  """
+  Create the index database of a EGC file, if it does not exist or
+  does not describe the current content of the file (or if force is True).
+
+  Returns the number of indexed records and of edges of the reference graph,
+  or None if the index was already up to date.
+  """
+  if not os.path.exists(file_path):
+    raise FileNotFoundError('File not found: {}'.format(file_path))
+  egc_data = IndexedEGCData(file_path, db_path)
+  try:
+    if not force and egc_data.is_up_to_date():
+      return None
+    egc_data.build_index(jobs)
+    return len(egc_data.id2rnum), egc_data.graph.n_edges()
+  finally:
+    egc_data.close()
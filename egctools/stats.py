@@ -1,12 +1,12 @@
 from collections import defaultdict, Counter
-import re
 import sys
-import importlib.resources
-from .parser import parsed_lines
-from jinja2 import Environment, FileSystemLoader
-_data = importlib.resources.files("egctools").joinpath("data")
+from .cache import iter_records
+from .parser import parsed_lines, _n_jobs
+from .references import GroupLeafTypes
 STATS_REPORT_TEMPLATE = "stats_report.j2"
 from . import pgto
+from . import templates
+from . import profiling
 from .egcdata import EGCData
 
 # G stats
@@ -20,22 +20,44 @@ def _init_G_stats(stats):
   stats['n_G_by_children_type'] = defaultdict(lambda: defaultdict(Counter))
   stats['n_G_by_children_category'] = defaultdict(Counter)
 
-G_categories = {
-  'taxonomy': pgto.taxonomy_group_types(),
-  'habitat': pgto.habitat_group_types(),
-  'phenotype': pgto.phenotype_group_types(),
-  'location': pgto.location_group_types(),
-  'derived': pgto.derived_group_types(),
-}
-G_type2category = {}
-for category, types in G_categories.items():
-  for type in types:
-    G_type2category[type] = category
+_G_categories = None
+_G_type2category = None
+
+def _init_G_categories():
+  global _G_categories, _G_type2category
+  _G_categories = {
+    'taxonomy': pgto.taxonomy_group_types(),
+    'habitat': pgto.habitat_group_types(),
+    'phenotype': pgto.phenotype_group_types(),
+    'location': pgto.location_group_types(),
+    'derived': pgto.derived_group_types(),
+  }
+  _G_type2category = pgto.group_type_categories()
+
+def _get_G_categories():
+  if _G_categories is None:
+    _init_G_categories()
+  return _G_categories
+
+def _get_G_type2category():
+  if _G_type2category is None:
+    _init_G_categories()
+  return _G_type2category
+
+# G_categories (group types of each category of the PGTO)
+# and G_type2category (category of each group type) are computed
+# on first access, as they require loading the PGTO
+def __getattr__(name):
+  if name == "G_categories":
+    return _get_G_categories()
+  elif name == "G_type2category":
+    return _get_G_type2category()
+  raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def _collect_G_stats(stats, line, lines):
   type = line['type']
   stats['n_G_by_type'][type] += 1
-  category = G_type2category[type]
+  category = _get_G_type2category()[type]
   stats['n_G_by_category'][category] += 1
   stats['n_G_by_category_and_type'][category][type] += 1
   if category not in ['taxonomy', 'derived']:
@@ -44,35 +66,29 @@ def _collect_G_stats(stats, line, lines):
   if category != "derived":
     pfx = line["definition"].split(":")[0]
     stats['n_G_defprefix_by_type'][type][pfx] += 1
+
+def _defer_G_stats(line):
+  if _get_G_type2category()[line['type']] == "derived":
+    return {'type': line['type'], 'definition': line['definition']}
+  return None
+
+def _resolve_G_stats(stats, line, lines):
+  type = line['type']
+  child_types = lines.G_leaf_types.of_definition(line["definition"])
+  child_categories = set(_get_G_type2category()[t] for t in child_types)
+  if len(child_categories) == 1:
+    klass = "{}_category".format(list(child_categories)[0])
   else:
-    child_groups = re.findall(r"[a-zA-Z0-9_]+", line["definition"])
-    child_types = {g: lines["G"][g]["type"] for g in child_groups}
-    while "inverted" in child_types.values() or \
-          "combined" in child_types.values():
-      to_delete = []
-      for g in child_types:
-        if child_types[g] in ["inverted", "combined"]:
-          child_groups.extend(re.findall(r"[a-zA-Z0-9_]+",
-                                         lines["G"][g]["definition"]))
-          to_delete.append(g)
-      child_groups = [g for g in child_groups if g not in to_delete]
-      child_types = {g: lines["G"][g]["type"] for g in child_groups}
-
-    child_types = set(child_types.values())
-    child_categories = set(G_type2category[t] for t in child_types)
-    if len(child_categories) == 1:
-      klass = "{}_category".format(list(child_categories)[0])
+    has_tax = "taxonomy" in child_categories
+    child_categories.discard("taxonomy")
+    cats = "_".join(sorted(child_categories))
+    if has_tax:
+      klass = f"taxonomy_and:{cats}"
     else:
-      has_tax = "taxonomy" in child_categories
-      child_categories.discard("taxonomy")
-      cats = "_".join(sorted(child_categories))
-      if has_tax:
-        klass = f"taxonomy_and:{cats}"
-      else:
-        klass = f"no_taxonomy:{cats}"
-    key = ",".join(sorted(child_types))
-    stats['n_G_by_children_category'][type][klass] += 1
-    stats['n_G_by_children_type'][type][klass][key] += 1
+      klass = f"no_taxonomy:{cats}"
+  key = ",".join(sorted(child_types))
+  stats['n_G_by_children_category'][type][klass] += 1
+  stats['n_G_by_children_type'][type][klass][key] += 1
 
 # A stats
 
@@ -83,19 +99,27 @@ def _init_A_stats(stats):
   stats['n_A_by_U'] = Counter()
   stats['n_n_A_by_U'] = Counter()
 
-def _collect_A_stats(stats, line, lines):
+def _A_mode_key(line):
   if isinstance(line["mode"], str):
-    mkey = line["mode"]
+    return line["mode"]
   else:
-    mkey = line["mode"]['mode']
+    return line["mode"]['mode']
+
+def _collect_A_stats(stats, line, lines):
+  stats['n_A_by_mode'][_A_mode_key(line)]+= 1
+  stats['n_A_by_U'][line['unit_id']] += 1
+
+def _defer_A_stats(line):
+  return {'mode': line['mode'], 'unit_id': line['unit_id']}
+
+def _resolve_A_stats(stats, line, lines):
+  mkey = _A_mode_key(line)
   unit = lines['U'][line["unit_id"]]
   t = unit["type"]
-  stats['n_A_by_mode'][mkey]+= 1
   tlbl = t['base_type']
   if t['multi']:
     tlbl = "+" + tlbl
   stats['n_A_mode_by_U_kind_and_type'][t['kind']][tlbl][mkey] += 1
-  stats['n_A_by_U'][line['unit_id']] += 1
 
 def _postprocess_A_stats(stats):
   stats['n_n_A_by_U'] = Counter()
@@ -231,36 +255,410 @@ def _init_stats():
       getattr(sys.modules[__name__], f"_init_{rt}_stats")(stats)
   return stats
 
-def _lines_with_id(fname):
-  lines = defaultdict(dict)
-  for line in parsed_lines(fname):
-    if 'id' in line:
+# fields of the records, which are needed for resolving
+# the deferred stats of the records referencing them
+_REFERENCED_FIELDS = {'G': ['type', 'definition'], 'U': ['type']}
+
+class _ReferencedFields(defaultdict):
+  """
+  Referenced fields of the records, by record type and ID,
+  and the (memoized) leaf types of the groups.
+  """
+
+  def __init__(self):
+    super().__init__(dict)
+    self.G_leaf_types = GroupLeafTypes(self['G'])
+
+def _collect(parsed, stats, skip_ids = None, skip_lines = None):
+  module = sys.modules[__name__]
+  lines = _ReferencedFields()
+  deferred = []
+  with profiling.timer("stats.collect") as t:
+    for line_num, line in enumerate(parsed):
+      t.n_records += 1
       rt = line['record_type']
-      lines[rt][line['id']] = line
-  return lines
+      if rt in _REFERENCED_FIELDS:
+        lines[rt][line['id']] = \
+            {k: line[k] for k in _REFERENCED_FIELDS[rt]}
+      if skip_lines is not None and line_num in skip_lines:
+        continue
+      if skip_ids is not None:
+        line_id = EGCData.record_id(line)
+        if line_id in skip_ids:
+          continue
+        else:
+          skip_ids.add(line_id)
+      _collect_common_stats(stats, line, lines)
+      if hasattr(module, f"_collect_{rt}_stats"):
+        getattr(module, f"_collect_{rt}_stats")(stats, line, lines)
+      if hasattr(module, f"_defer_{rt}_stats"):
+        deferred_line = getattr(module, f"_defer_{rt}_stats")(line)
+        if deferred_line is not None:
+          deferred.append((rt, deferred_line))
+  with profiling.timer("stats.resolve", len(deferred)):
+    for rt, line in deferred:
+      getattr(module, f"_resolve_{rt}_stats")(stats, line, lines)
+  _postprocess(stats)
+  return stats
 
-def collect(fname, stats = None, skip_ids = None):
-  lines = _lines_with_id(fname)
+def _postprocess(stats):
+  module = sys.modules[__name__]
+  with profiling.timer("stats.postprocess"):
+    for rt in list(stats['by_record_type'].keys()):
+      if hasattr(module, f"_postprocess_{rt}_stats"):
+        getattr(module, f"_postprocess_{rt}_stats")(stats)
+
+def _parsed(fname, jobs, cache, cache_dir):
+  # the cached records (e.g. stored by EGCData.from_file) are read one chunk
+  # at a time; the cache is not written, as the stats do not compute the
+  # other keys (e.g. the index) used by EGCData
+  if cache:
+    records = iter_records(fname, cache_dir)
+    if records is not None:
+      return records
+  return parsed_lines(fname, jobs)
+
+def collect(fname, stats = None, skip_ids = None, jobs = 1,
+            cache = False, cache_dir = None):
+  """
+  Collect the stats of a EGC file.
+
+  The file is scanned only once; the stats which depend on other records
+  (the types of the groups contained in derived groups, the unit types
+  of the attributes) are deferred and resolved after the scan.
+  """
   if stats is None:
     stats = _init_stats()
-  for line in parsed_lines(fname):
-    line_id = EGCData.record_id(line)
-    if skip_ids is not None:
-      if line_id in skip_ids:
-        continue
+  return _collect(_parsed(fname, jobs, cache, cache_dir), stats, skip_ids)
+
+# Partial stats
+#
+# The stats of different files can be collected separately (e.g. in different
+# processes) and merged afterwards: the counters and integers are summed,
+# the sets are united and the lists concatenated. The postprocessing
+# step is repeated after merging (the values computed by it from the merged
+# stats are replaced, the per-file counts of the V/C stats are summed).
+#
+# As the nested defaultdicts of the stats cannot be pickled, the partial
+# stats are converted to plain dicts (_to_plain) before being transferred.
+
+def _to_plain(stats):
+  if isinstance(stats, Counter):
+    return Counter({k: _to_plain(v) for k, v in stats.items()})
+  elif isinstance(stats, dict):
+    return {k: _to_plain(v) for k, v in stats.items()}
+  return stats
+
+def _merge_into(stats, partial):
+  """
+  Add the partial stats to stats (in place).
+  """
+  for key, value in partial.items():
+    if isinstance(value, dict):
+      if key not in stats and not isinstance(stats, defaultdict):
+        stats[key] = Counter() if isinstance(value, Counter) else {}
+      _merge_into(stats[key], value)
+    elif isinstance(value, set):
+      stats[key] = stats[key] | value if key in stats else set(value)
+    elif isinstance(value, list):
+      stats[key] = stats[key] + value if key in stats else list(value)
+    else:
+      stats[key] = stats[key] + value if key in stats else value
+  return stats
+
+def _collect_partial(fname, skip_lines, cache, cache_dir):
+  stats = _collect(_parsed(fname, 1, cache, cache_dir), _init_stats(),
+                   skip_lines = skip_lines)
+  return _to_plain(stats)
+
+def _record_ids(fname, cache, cache_dir):
+  # the same IDs as used by _collect for skip_ids
+  return [EGCData.record_id(record) \
+          for record in _parsed(fname, 1, cache, cache_dir)]
+
+def _resolve_skip_lines(fnames, executor, cache, cache_dir):
+  """
+  Numbers of the records of each file, whose ID was already seen (in the same
+  file or in a previous file, in the given order).
+  """
+  seen = set()
+  skip_lines = []
+  for record_ids in executor.map(_record_ids, fnames,
+                                 [cache] * len(fnames),
+                                 [cache_dir] * len(fnames)):
+    file_skip_lines = set()
+    for line_num, record_id in enumerate(record_ids):
+      if record_id in seen:
+        file_skip_lines.add(line_num)
       else:
-        skip_ids.add(line_id)
-    _collect_common_stats(stats, line, lines)
-    rt = line['record_type']
-    if hasattr(sys.modules[__name__], f"_collect_{rt}_stats"):
-      getattr(sys.modules[__name__], f"_collect_{rt}_stats")(stats, line, lines)
-  for rt in stats['by_record_type'].keys():
-    if hasattr(sys.modules[__name__], f"_postprocess_{rt}_stats"):
-      getattr(sys.modules[__name__], f"_postprocess_{rt}_stats")(stats)
+        seen.add(record_id)
+    skip_lines.append(file_skip_lines)
+  return skip_lines
+
+def collect_files(fnames, skip_double = False, jobs = 1,
+                  cache = False, cache_dir = None):
+  """
+  Collect the combined stats of multiple EGC files.
+
+  If skip_double is True, the records with an already seen ID (in the same
+  or in a previous file) are ignored.
+
+  If jobs is larger than 1 (or None or 0, which mean: one per CPU) and multiple
+  files are given, the stats of each file are collected by a pool of worker
+  processes and merged; with skip_double, the records to ignore are determined
+  before that, from the IDs of the records of all files, so that the result is
+  the same as for a sequential collection. Otherwise, the files are collected
+  sequentially, using the jobs for parsing each file.
+  """
+  n_jobs = _n_jobs(jobs)
+  if n_jobs == 1 or len(fnames) < 2:
+    stats = None
+    skip_ids = set() if skip_double else None
+    for fname in fnames:
+      stats = collect(fname, stats, skip_ids, jobs, cache, cache_dir)
+    return stats if stats is not None else _init_stats()
+  from concurrent.futures import ProcessPoolExecutor
+  stats = _init_stats()
+  with ProcessPoolExecutor(max_workers=min(n_jobs, len(fnames))) as executor:
+    if skip_double:
+      skip_lines = _resolve_skip_lines(fnames, executor, cache, cache_dir)
+    else:
+      skip_lines = [None] * len(fnames)
+    for partial in executor.map(_collect_partial, fnames, skip_lines,
+                                [cache] * len(fnames),
+                                [cache_dir] * len(fnames)):
+      _merge_into(stats, partial)
+  _postprocess(stats)
   return stats
 
-def report(s):
-  env = Environment(loader=FileSystemLoader(str(_data)))
-  template = env.get_template(STATS_REPORT_TEMPLATE)
-  return template.render(s, G_categories = G_categories)
+# Live stats
+#
+# A StatsObserver keeps the stats of a EGCData object up to date while it is
+# edited. The contribution of a record to the stats is computed by the same
+# functions used by collect (including the resolution of the deferred stats,
+# if the referenced records exist) and added to or subtracted from the stats.
+#
+# Before a record is changed, the contributions of the record and of the
+# records whose stats depend on it (the A records referencing an U record,
+# the derived G records containing a G record, directly or through other
+# groups) are subtracted; after the edit, they are added again, computed
+# from the new records. The values computed by the postprocessing are
+# maintained incrementally: the sets of IDs (e.g. A_in_V) are kept as
+# multisets, counting the records containing each ID.
+
+class _RecordsByType:
+  """
+  Access to the records of a EGCData object by record type and ID,
+  as for the referenced fields in _collect.
+  """
+
+  def __init__(self, egc_data):
+    self._egc_data = egc_data
+    self.G_leaf_types = GroupLeafTypes(_RecordsByID(egc_data))
+
+  def __getitem__(self, record_type):
+    return _RecordsByID(self._egc_data)
+
+class _RecordsByID:
+
+  def __init__(self, egc_data):
+    self._egc_data = egc_data
+
+  def __getitem__(self, record_id):
+    return self._egc_data.find(record_id)
+
+_ID_SETS = {'U_with_M': 'n_U_with_M', 'A_in_V': 'n_A_in_V',
+            'G_in_V': 'n_G_in_V', 'A_in_C': 'n_A_in_C', 'G_in_C': 'n_G_in_C'}
+
+def _record_stats(record, lines):
+  """
+  Stats of a single record.
+  """
+  module = sys.modules[__name__]
+  rt = record['record_type']
+  stats = {}
+  _init_common_stats(stats)
+  if hasattr(module, f"_init_{rt}_stats"):
+    getattr(module, f"_init_{rt}_stats")(stats)
+  _collect_common_stats(stats, record, lines)
+  if hasattr(module, f"_collect_{rt}_stats"):
+    getattr(module, f"_collect_{rt}_stats")(stats, record, lines)
+  if hasattr(module, f"_defer_{rt}_stats") and \
+      getattr(module, f"_defer_{rt}_stats")(record) is not None:
+    try:
+      getattr(module, f"_resolve_{rt}_stats")(stats, record, lines)
+    except (KeyError, ValueError):
+      # a referenced record does not exist (yet),
+      # or the group definitions contain a cycle
+      pass
+  return stats
 
+def _add_signed(stats, delta, sign):
+  """
+  Add (sign 1) or subtract (sign -1) the counts of delta to/from stats;
+  the entries of stats which become empty are removed.
+  """
+  for key, value in delta.items():
+    if isinstance(value, dict):
+      if not value:
+        continue
+      if key not in stats and not isinstance(stats, defaultdict):
+        stats[key] = Counter() if isinstance(value, Counter) else {}
+      _add_signed(stats[key], value, sign)
+      if not stats[key]:
+        del stats[key]
+    elif isinstance(value, list):
+      if sign > 0:
+        stats.setdefault(key, []).extend(value)
+      else:
+        for item in value:
+          stats[key].remove(item)
+        if not stats[key]:
+          del stats[key]
+    elif value:
+      count = stats.get(key, 0) + sign * value
+      if count:
+        stats[key] = count
+      else:
+        stats.pop(key, None)
+
+class StatsObserver:
+  """
+  Stats of a EGCData object (the same as computed by collect from its file),
+  which are updated when the records are edited.
+
+  Usage:
+    observer = StatsObserver(egc_data)
+    egc_data.add_observer(observer)
+    ...edit egc_data...
+    print(report(observer.stats))
+  """
+
+  def __init__(self, egc_data):
+    self.reset(egc_data)
+
+  def reset(self, egc_data):
+    """
+    Compute the stats from all records.
+    """
+    self.stats = _init_stats()
+    self._id_sets = {key: Counter() for key in _ID_SETS}
+    self._detached = set()
+    self._n_records = len(egc_data.records)
+    self._lines = _RecordsByType(egc_data)
+    self._G_changed = False
+    for record in egc_data.records:
+      if record is not None:
+        self._apply(record, 1)
+
+  def _apply(self, record, sign):
+    stats = self.stats
+    delta = _record_stats(record, self._lines)
+    for key, value in delta.items():
+      if key in _ID_SETS:
+        self._apply_id_set(key, value, sign)
+      elif key == 'n_A_by_U':
+        self._apply_n_A_by_U(value, sign)
+      elif key == 'n_n_A_by_U':
+        continue
+      elif isinstance(value, (dict, list)):
+        _add_signed(stats[key], value, sign)
+      else:
+        stats[key] += sign * value
+    for n in [1, 2]:
+      stats['n_C_by_n_A'].setdefault(n, 0)
+    if stats['by_record_type'].get('A'):
+      stats['n_n_A_by_U'][0] = stats['by_record_type'].get('U', 0) - \
+                               len(stats['n_A_by_U'])
+    else:
+      stats['n_n_A_by_U'].pop(0, None)
+
+  def _apply_id_set(self, key, ids, sign):
+    counts = self._id_sets[key]
+    for record_id in ids:
+      counts[record_id] += sign
+      if counts[record_id] == 0:
+        del counts[record_id]
+        if key == 'U_with_M':
+          self.stats[key].discard(record_id)
+      elif key == 'U_with_M':
+        self.stats[key].add(record_id)
+    self.stats[_ID_SETS[key]] = len(counts)
+
+  def _apply_n_A_by_U(self, n_A_by_U, sign):
+    stats = self.stats
+    for unit_id, n in n_A_by_U.items():
+      old = stats['n_A_by_U'].get(unit_id, 0)
+      new = old + sign * n
+      for count, change in [(old, -1), (new, 1)]:
+        if count:
+          stats['n_n_A_by_U'][count] += change
+          if not stats['n_n_A_by_U'][count]:
+            del stats['n_n_A_by_U'][count]
+      if new:
+        stats['n_A_by_U'][unit_id] = new
+      else:
+        stats['n_A_by_U'].pop(unit_id, None)
+
+  def _dependents(self, egc_data, record_type, record_id):
+    """
+    IDs of the records whose stats depend on the given record.
+    """
+    graph = egc_data.graph
+    if record_type == 'U':
+      if graph.has_node('U', record_id):
+        yield from list(graph.ref_by('U', record_id, 'A'))
+    elif record_type == 'G':
+      seen = {record_id}
+      to_visit = [record_id]
+      while to_visit:
+        group_id = to_visit.pop()
+        if not graph.has_node('G', group_id):
+          continue
+        for parent_id in list(graph.ref_by('G', group_id, 'G')):
+          if parent_id not in seen:
+            seen.add(parent_id)
+            to_visit.append(parent_id)
+            yield parent_id
+
+  def _detach(self, egc_data, record_id):
+    record_num = egc_data.id2rnum.get(record_id)
+    if record_num is None or record_num >= self._n_records or \
+        record_num in self._detached:
+      return
+    record = egc_data.records[record_num]
+    if record is not None:
+      self._apply(record, -1)
+      self._detached.add(record_num)
+
+  def before_change(self, egc_data, record_type, record_id):
+    self._n_records = min(self._n_records, len(egc_data.records))
+    self._detach(egc_data, record_id)
+    for dependent_id in self._dependents(egc_data, record_type, record_id):
+      self._detach(egc_data, dependent_id)
+    if record_type == 'G':
+      # the memoized leaf types are computed again after the changes
+      self._G_changed = True
+      self._lines.G_leaf_types.clear()
+
+  def after_changes(self, egc_data):
+    n_records = len(egc_data.records)
+    self._n_records = min(self._n_records, n_records)
+    if self._G_changed:
+      self._lines.G_leaf_types.clear()
+      self._G_changed = False
+    for record_num in sorted(self._detached) + \
+        list(range(self._n_records, n_records)):
+      record = egc_data.records[record_num]
+      if record is not None:
+        self._apply(record, 1)
+    self._detached = set()
+    self._n_records = n_records
+
+def report(s, out=None):
+  """
+  Render the stats report; if out (a text file) is given, the report
+  is written to it (see templates.render).
+  """
+  params = dict(s, G_categories = _get_G_categories())
+  return templates.render(STATS_REPORT_TEMPLATE, params, out)
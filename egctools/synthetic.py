@@ -0,0 +1,220 @@
+#
+# Generation of synthetic EGC data, e.g. for benchmarks
+#
+# The records are generated as decoded records (as returned by the parser)
+# and encoded using the EGC specification, so that the generated files are
+# read back to the same records. The generation is deterministic: the same
+# parameters and seed always give the same file.
+#
+# Structure of the generated data:
+# - S/T records reference random D records
+# - G records: leaf groups (taxonomic, strain, biome) and derived groups
+#   (combined groups of fanout other groups, inverted groups); derived groups
+#   only contain groups generated before them, up to a nesting depth of
+#   G_depth derived groups
+# - U records: specific genes, homologs of other units and enumerating
+#   sets of fanout other units, up to a nesting depth of U_depth
+# - A records reference U records (some relative counts also
+#   a reference unit), M records reference U records
+# - V/C records reference S/T, A and G records (some V records
+#   up to fanout sources)
+#
+import random
+from .parser import encode_line
+
+# default fraction of the records of each type
+PROPORTIONS = {'D': 0.04, 'S': 0.08, 'T': 0.04, 'G': 0.12, 'U': 0.12,
+               'A': 0.12, 'M': 0.04, 'V': 0.36, 'C': 0.08}
+
+# order of the records in the file
+RECORD_TYPES = ['D', 'S', 'T', 'G', 'U', 'A', 'M', 'V', 'C']
+
+LEAF_G_TYPES = [('taxonomic', 'NCBI'), ('strain', 'NCBI'), ('biome', 'ENVO')]
+
+def record_counts(n_records, proportions=PROPORTIONS):
+  """
+  Number of records of each type, for a total of (about) n_records.
+  """
+  total = sum(proportions.values())
+  return {rt: max(int(n_records * proportions.get(rt, 0) / total), 1) \
+          for rt in RECORD_TYPES}
+
+class _Generator:
+
+  def __init__(self, counts, seed, G_depth, U_depth, derived, fanout):
+    self.rng = random.Random(seed)
+    self.counts = counts
+    self.G_depth = G_depth
+    self.U_depth = U_depth
+    self.derived = derived
+    self.fanout = fanout
+
+  def _pick(self, prefix, rt):
+    return f"{prefix}{self.rng.randrange(self.counts[rt])}"
+
+  def _members(self, depths, max_depth, n):
+    """
+    Up to n random members for a derived group or set, among the previous
+    ones (depths), whose nesting depth is lower than max_depth (the first
+    two are leaves, thus there is at least one).
+    Returns the members and the depth of the new group or set.
+    """
+    members = []
+    for attempt in range(10 * n):
+      i = self.rng.randrange(len(depths))
+      if depths[i] < max_depth and i not in members:
+        members.append(i)
+        if len(members) == n:
+          break
+    if not members:
+      members.append(0)
+    return members, max(depths[i] for i in members) + 1
+
+  def D(self, i):
+    return {'record_type': 'D',
+            'document_id': {'resource_prefix': 'PMID', 'item': str(i + 1)}}
+
+  def _source(self, rt, i):
+    item = str(self.rng.randrange(self.counts['D']) + 1)
+    return {'record_type': rt, 'id': f"{rt}{i}",
+            'document_id': {'resource_prefix': 'PMID', 'item': item},
+            'text': f"synthetic {rt} {i}"}
+
+  def S(self, i):
+    return self._source('S', i)
+
+  def T(self, i):
+    return self._source('T', i)
+
+  def G(self, i, depths):
+    rng = self.rng
+    if i >= 2 and self.G_depth > 0 and rng.random() < self.derived:
+      if rng.random() < 0.25:
+        members, depth = self._members(depths, self.G_depth, 1)
+        gtype, definition = 'inverted', f"G{members[0]}"
+      else:
+        members, depth = self._members(depths, self.G_depth,
+                                       rng.randint(2, self.fanout))
+        gtype = 'combined'
+        definition = " & ".join(f"G{m}" for m in members)
+      depths.append(depth)
+    else:
+      gtype, prefix = LEAF_G_TYPES[rng.randrange(len(LEAF_G_TYPES))]
+      definition = f"{prefix}:{i + 1}"
+      depths.append(0)
+    return {'record_type': 'G', 'id': f"G{i}", 'name': f"group {i}",
+            'type': gtype, 'definition': definition}
+
+  def U(self, i, depths):
+    rng = self.rng
+    utype = {'kind': 'gene', 'base_type': 'specific_gene', 'multi': False,
+             'enumerating': False}
+    definition = "."
+    depth = 0
+    choice = rng.random()
+    if i >= 2 and self.U_depth > 0 and choice < self.derived:
+      members, depth = self._members(depths, self.U_depth,
+                                     rng.randint(2, self.fanout))
+      utype = {'kind': 'set', 'base_type': 'gene_cluster', 'multi': True,
+               'enumerating': True}
+      definition = ",".join(f"U{m}" for m in members)
+    elif i >= 1 and choice < self.derived * 1.5:
+      utype = {'kind': 'gene', 'base_type': 'gene_homologs', 'multi': False,
+               'enumerating': False}
+      definition = f"homolog:U{rng.randrange(i)}"
+    depths.append(depth)
+    return {'record_type': 'U', 'id': f"U{i}", 'type': utype,
+            'symbol': f"u{i}", 'description': f"unit {i}",
+            'definition': definition}
+
+  def A(self, i):
+    rng = self.rng
+    if rng.random() < 0.1:
+      mode = {'mode': 'relative_count', 'reference': self._pick("U", 'U')}
+    else:
+      mode = rng.choice(['count', 'presence'])
+    return {'record_type': 'A', 'id': f"A{i}",
+            'unit_id': self._pick("U", 'U'), 'mode': mode}
+
+  def M(self, i):
+    # the model IDs are unique, thus also the record IDs
+    return {'record_type': 'M', 'unit_id': self._pick("U", 'U'),
+            'resource_id': 'Pfam', 'model_id': f"PF{i:05d}"}
+
+  def _ST(self):
+    if self.counts['T'] and self.rng.random() < 0.3:
+      return self._pick("T", 'T')
+    return self._pick("S", 'S')
+
+  def V(self, i):
+    rng = self.rng
+    if rng.random() < 0.1:
+      source = [self._ST() for j in range(rng.randint(2, self.fanout))]
+    else:
+      source = self._ST()
+    return {'record_type': 'V', 'id': f"V{i}", 'source': source,
+            'attribute': self._pick("A", 'A'),
+            'group': {'id': self._pick("G", 'G')},
+            'operator': rng.choice(['>', '=']),
+            'reference': str(rng.randrange(3))}
+
+  def C(self, i):
+    rng = self.rng
+    if rng.random() < 0.2:
+      attribute = {'id1': self._pick("A", 'A'), 'id2': self._pick("A", 'A')}
+    else:
+      attribute = self._pick("A", 'A')
+    return {'record_type': 'C', 'id': f"C{i}", 'source': self._ST(),
+            'attribute': attribute, 'group1': {'id': self._pick("G", 'G')},
+            'group2': {'id': self._pick("G", 'G')}, 'operator': '>'}
+
+def records(n_records=10000, counts=None, seed=0, G_depth=3, U_depth=2,
+            derived=0.3, fanout=3):
+  """
+  Generate synthetic records (decoded, as dicts).
+
+  The number of records of each type is given by counts (dict, the missing
+  types are not generated) or computed from n_records (see record_counts).
+  G_depth and U_depth are the maximal nesting depth of derived groups and
+  of enumerating sets of units, derived the fraction of G/U records which
+  are derived groups/homologs or sets and fanout the maximal number of
+  members of combined groups and sets and of sources of V records.
+  """
+  if counts is None:
+    counts = record_counts(n_records)
+  counts = {rt: counts.get(rt, 0) for rt in RECORD_TYPES}
+  for rt, refs in [('S', 'D'), ('T', 'D'), ('A', 'U'), ('M', 'U'),
+                   ('V', 'S'), ('V', 'A'), ('V', 'G'), ('C', 'A'),
+                   ('C', 'G'), ('C', 'S')]:
+    if counts[rt] and not counts[refs]:
+      raise ValueError(f"{rt} records require {refs} records")
+  generator = _Generator(counts, seed, G_depth, U_depth, derived,
+                         max(fanout, 2))
+  depths = {'G': [], 'U': []}
+  for rt in RECORD_TYPES:
+    make = getattr(generator, rt)
+    for i in range(counts[rt]):
+      if rt in depths:
+        yield make(i, depths[rt])
+      else:
+        yield make(i)
+
+def lines(*args, **kwargs):
+  """
+  Generate the lines of a synthetic EGC file (see records for the
+  parameters).
+  """
+  for record in records(*args, **kwargs):
+    yield encode_line(record)
+
+def write(fname, *args, **kwargs):
+  """
+  Write a synthetic EGC file (see records for the parameters).
+  Returns the number of lines.
+  """
+  n = 0
+  with open(fname, "w") as f:
+    for line in lines(*args, **kwargs):
+      f.write(line + "\n")
+      n += 1
+  return n
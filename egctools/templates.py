@@ -0,0 +1,91 @@
+#
+# Rendering of the Jinja2 templates of the package data directory
+#
+# The Jinja2 environment is created on first use and kept for the lifetime
+# of the process, thus each template is loaded and compiled only once
+# (the templates are part of the package, thus they are not checked
+# for changes). Optionally, the compiled templates are also stored in a
+# bytecode cache directory, so that they are not compiled again by other
+# processes, e.g. by later runs of the scripts.
+#
+import os
+import re
+from . import profiling
+
+# cache directory of the compiled templates, under the egctools cache
+# directory, unless a directory is given to enable_bytecode_cache()
+BYTECODE_CACHE_SUBDIR = "templates"
+
+_environment = None
+
+# from https://stackoverflow.com/questions/16259923/
+#       how-can-i-escape-latex-special-characters-inside-django-templates
+_TEX_CONV = {
+  '&': r'\&',
+  '%': r'\%',
+  '$': r'\$',
+  '#': r'\#',
+  '_': r'\_',
+  '{': r'\{',
+  '}': r'\}',
+  '~': r'\textasciitilde{}',
+  '^': r'\^{}',
+  '\\': r'\textbackslash{}',
+  '<': r'\textless{}',
+  '>': r'\textgreater{}',
+}
+_TEX_ESCAPE_RE = re.compile('|'.join(re.escape(str(key)) for
+  key in sorted(_TEX_CONV.keys(), key = lambda item: - len(item))))
+
+def tex_escape(text):
+  """
+  Escape the LaTeX special characters (template filter texesc).
+  """
+  return _TEX_ESCAPE_RE.sub(lambda match: _TEX_CONV[match.group()], text)
+
+def environment():
+  """
+  The Jinja2 environment for the templates of the package data directory.
+  """
+  global _environment
+  if _environment is None:
+    import importlib.resources
+    from jinja2 import Environment, FileSystemLoader
+    _data = importlib.resources.files("egctools").joinpath("data")
+    _environment = Environment(loader=FileSystemLoader(str(_data)),
+                               auto_reload=False)
+    _environment.filters["texesc"] = tex_escape
+  return _environment
+
+def enable_bytecode_cache(cache_dir=None):
+  """
+  Store the compiled templates in a cache directory (default: under the
+  egctools cache directory, see egctools.pgto), where they are found
+  by later processes.
+  """
+  from jinja2 import FileSystemBytecodeCache
+  from .pgto import _cache_dir
+  if cache_dir is None:
+    cache_dir = os.path.join(_cache_dir(), BYTECODE_CACHE_SUBDIR)
+  os.makedirs(cache_dir, exist_ok=True)
+  env = environment()
+  env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+  # templates compiled before are not stored in the new cache
+  env.cache.clear()
+
+def get_template(name):
+  return environment().get_template(name)
+
+def render(name, params, out=None):
+  """
+  Render a template with the given parameters (dict).
+
+  If out (a text file) is given, the output is written to it while
+  it is generated and None is returned, otherwise it is returned
+  as string.
+  """
+  with profiling.timer("templates.render"):
+    template = get_template(name)
+    if out is None:
+      return template.render(params)
+    out.writelines(template.generate(params))
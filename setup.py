@@ -35,14 +35,15 @@ setup(name='egctools',
         'Programming Language :: Python :: 3 :: Only',
         'Topic :: Software Development :: Libraries',
       ],
-      packages=find_packages(),
+      packages=find_packages(exclude=['tests']),
       install_requires=['textformats', 'fardes', 'tabrec', 'pronto'],
       zip_safe=False,
       include_package_data=True,
       scripts=['bin/egctools-stats',
                'bin/egctools-table',
                'bin/egctools-merge',
-               'bin/egctools-extract'],
+               'bin/egctools-extract',
+               'bin/egctools-index'],
       package_data={"": ["data/egc-spec/egc.tf.yaml",
                          "data/egc-spec/egc_tags.tf.yaml",
                          "data/egc-spec/egc_tags.yaml",
@@ -52,5 +53,6 @@ setup(name='egctools',
                          "data/egc-spec/expectation_rules.tf.yaml",
                          "data/egc-spec/genome_contents.tf.yaml",
                          "data/egc-spec/textual_sources.tf.yaml",
-                         "data/stats_report.j2"]},
+                         "data/stats_report.j2",
+                         "data/pgto_group_types.json"]},
     )
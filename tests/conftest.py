@@ -0,0 +1,28 @@
+import pytest
+from egctools import synthetic
+
+# number of records of the synthetic test files
+N_RECORDS = 1500
+
+@pytest.fixture(scope="session")
+def egc_file(tmp_path_factory):
+  """
+  Synthetic EGC file, shared by the tests, which must not modify it.
+  """
+  fname = str(tmp_path_factory.mktemp("data") / "synthetic.egc")
+  synthetic.write(fname, N_RECORDS, seed=1)
+  return fname
+
+@pytest.fixture
+def egc_copy(tmp_path, egc_file):
+  """
+  Copy of the synthetic EGC file, which can be modified.
+  """
+  fname = tmp_path / "copy.egc"
+  with open(egc_file, "rb") as src:
+    fname.write_bytes(src.read())
+  return str(fname)
+
+@pytest.fixture
+def cache_dir(tmp_path):
+  return str(tmp_path / "cache")
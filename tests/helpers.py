@@ -0,0 +1,53 @@
+#
+# Helpers for comparing the state of EGCData objects and graphs
+#
+import copy
+
+RECORD_TYPES = "DSTGUAMVC"
+
+def graph_nodes(graph):
+  """
+  Sorted list of (record type, record ID) of the nodes of a graph.
+  """
+  return sorted(graph.nodes())
+
+def graph_edges(graph, nodes):
+  """
+  Sets of the edges (rt1, id1, rt2, id2) found in the refs and in the
+  ref_by lists of the given nodes.
+  """
+  refs = set()
+  ref_by = set()
+  for rt, i in nodes:
+    for rt2 in RECORD_TYPES:
+      for j in list(graph.refs(rt, i, rt2)):
+        refs.add((rt, i, rt2, j))
+      for j in list(graph.ref_by(rt, i, rt2)):
+        ref_by.add((rt2, j, rt, i))
+  return refs, ref_by
+
+def egc_dump(egc):
+  """
+  Content of a EGCData object: for each record (by type, in the order
+  of the file), its ID, line, decoded record and references.
+  """
+  out = []
+  for rt in RECORD_TYPES:
+    for record_id in egc.find_all_ids(rt):
+      out.append((record_id, egc.line(record_id), egc.find(record_id),
+                  egc.is_ref_by(record_id)))
+      for rt2 in RECORD_TYPES:
+        out.append((rt2, sorted(egc._refs_ids(rt, record_id, rt2)),
+                    sorted(egc._ref_by_ids(rt, record_id, rt2))))
+  return copy.deepcopy(out)
+
+def egc_state(egc):
+  """
+  Internal state of a EGCData object: index, record numbers by type,
+  edges of the graph and lines.
+  """
+  nodes = [(rt, record_id) for rt in RECORD_TYPES \
+           for record_id in egc.find_all_ids(rt)]
+  return (dict(egc.id2rnum),
+          {rt: list(v) for rt, v in egc.rt2rnums.items() if v},
+          graph_edges(egc.graph, nodes), list(egc.lines))
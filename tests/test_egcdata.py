@@ -0,0 +1,240 @@
+import os
+import copy
+import random
+import pytest
+from egctools import cache, synthetic
+from egctools.parser import parsed_lines, encode_line
+from egctools.egcdata import EGCData
+from egctools.linestore import MappedLines
+from .helpers import egc_dump, egc_state
+
+BACKENDS = ["dict", "compact"]
+
+@pytest.fixture(scope="module")
+def reference(egc_file):
+  return EGCData.from_file(egc_file, cache=False)
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("lazy", [False, True])
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_load_equivalence(egc_file, reference, backend, lazy, jobs):
+  egc = EGCData.from_file(egc_file, cache=False, lazy=lazy, jobs=jobs,
+                          graph_backend=backend)
+  assert egc_state(egc) == egc_state(reference)
+  assert egc_dump(egc) == egc_dump(reference)
+
+def test_rt2rnums(reference):
+  n_records = 0
+  for rt, rnums in reference.rt2rnums.items():
+    assert isinstance(rnums, list)
+    assert rnums == list(reference.rnums_of(rt))
+    assert rnums == sorted(rnums)
+    n_records += len(rnums)
+  assert n_records == len(reference.id2rnum)
+  assert reference.rt2rnums['X'] == []
+
+def _full_syntax_records():
+  # text with characters which can require quoting or escaping,
+  # multiple sources and attributes, relative count modes
+  for record in synthetic.records(600, seed=2):
+    rt = record['record_type']
+    if rt in ['S', 'T']:
+      record['text'] = 'text with "quotes", \\ and # hash'
+    elif rt == 'G':
+      record['name'] = "group's name #1"
+    elif rt == 'U':
+      record['description'] = 'unit "{}"'.format(record['id'])
+    yield record
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_lazy_full_syntax(tmp_path, backend):
+  fname = str(tmp_path / "full_syntax.egc")
+  with open(fname, "w") as f:
+    for record in _full_syntax_records():
+      f.write(encode_line(record) + "\n")
+  eager = EGCData.from_file(fname, cache=False, graph_backend=backend)
+  lazy = EGCData.from_file(fname, cache=False, lazy=True,
+                           graph_backend=backend)
+  assert lazy.id2rnum == eager.id2rnum
+  assert egc_state(lazy) == egc_state(eager)
+  assert egc_dump(lazy) == egc_dump(eager)
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_mmap_lines(egc_file, reference, backend):
+  egc = EGCData.from_file(egc_file, cache=False, mmap_lines=True,
+                          graph_backend=backend)
+  assert isinstance(egc.lines, MappedLines)
+  assert egc_dump(egc) == egc_dump(reference)
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("lazy", [False, True])
+def test_cache_round_trip(egc_file, reference, cache_dir, backend, lazy):
+  for i in range(2):
+    egc = EGCData.from_file(egc_file, cache=True, cache_dir=cache_dir,
+                            lazy=lazy, graph_backend=backend)
+    assert os.path.exists(cache.cache_path(egc_file, cache_dir))
+    assert egc_state(egc) == egc_state(reference)
+    assert egc_dump(egc) == egc_dump(reference)
+
+def test_cache_iter_records(egc_file, cache_dir):
+  assert cache.iter_records(egc_file, cache_dir) is None
+  EGCData.from_file(egc_file, cache=True, cache_dir=cache_dir)
+  assert list(cache.iter_records(egc_file, cache_dir)) == \
+      list(parsed_lines(egc_file))
+
+def test_stale_cache(egc_copy, cache_dir):
+  EGCData.from_file(egc_copy, cache=True, cache_dir=cache_dir)
+  synthetic.write(egc_copy, 500, seed=7)
+  egc = EGCData.from_file(egc_copy, cache=True, cache_dir=cache_dir)
+  assert egc_dump(egc) == egc_dump(EGCData.from_file(egc_copy, cache=False))
+
+def test_cache_is_opt_in(egc_copy, cache_dir, monkeypatch):
+  monkeypatch.setenv("EGCTOOLS_CACHE_DIR", cache_dir)
+  EGCData.from_file(egc_copy)
+  assert not os.path.exists(cache_dir)
+  EGCData.from_file(egc_copy, cache=True)
+  assert os.listdir(cache_dir) == [os.path.basename(cache.cache_path(egc_copy))]
+  assert os.path.dirname(cache.cache_path(egc_copy)) != \
+      os.path.dirname(os.path.abspath(egc_copy))
+
+def test_store_unpicklable(egc_copy, cache_dir):
+  cache.store(egc_copy, {'lines': [lambda: None]}, cache_dir)
+  assert os.listdir(cache_dir) == []
+
+def _edit(egc):
+  u = copy.deepcopy(egc.find("U1"))
+  u["id"] = "U1_renamed"
+  egc.update("U1", u)
+  a = copy.deepcopy(egc.find("A1"))
+  a["id"] = "A_new"
+  egc.create(a)
+  egc.delete("V1")
+  egc.rename_many({"G0": "G0_renamed", "S1": "S1_renamed"})
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_journal_replay_and_compact(egc_copy, backend):
+  egc = EGCData.from_file(egc_copy, cache=False, journal=True,
+                          graph_backend=backend)
+  _edit(egc)
+  egc.save()
+  assert os.path.exists(EGCData.journal_path(egc_copy))
+  replayed = EGCData.from_file(egc_copy, cache=False, graph_backend=backend)
+  assert egc_dump(replayed) == egc_dump(egc)
+  replayed.compact()
+  assert not os.path.exists(EGCData.journal_path(egc_copy))
+  assert replayed._file_sha256 == cache.file_sha256(egc_copy)
+  reloaded = EGCData.from_file(egc_copy, cache=False, graph_backend=backend)
+  assert egc_dump(reloaded) == egc_dump(egc)
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("lazy", [False, True])
+def test_batch_as_sequential(egc_file, backend, lazy):
+  sequential = EGCData.from_file(egc_file, cache=False, lazy=lazy,
+                                 graph_backend=backend)
+  _edit(sequential)
+  batched = EGCData.from_file(egc_file, cache=False, lazy=lazy,
+                              graph_backend=backend)
+  with batched.batch():
+    _edit(batched)
+  assert egc_dump(batched) == egc_dump(sequential)
+
+class _Rollback(Exception):
+  pass
+
+def _random_edits(egc, rng, trial):
+  for k in range(rng.randint(1, 8)):
+    op = rng.random()
+    record_id = rng.choice(list(egc.id2rnum))
+    record = egc.find(record_id)
+    renamable = record['record_type'] not in 'DM'
+    if op < 0.25 and renamable:
+      created = copy.deepcopy(record)
+      created['id'] = f"N{trial}_{k}"
+      egc.create(created)
+    elif op < 0.5:
+      egc.delete(record_id)
+    elif op < 0.75 and renamable:
+      if record_id + "_r" not in egc.id2rnum:
+        egc.rename_many({record_id: record_id + "_r"})
+    elif renamable:
+      updated = copy.deepcopy(record)
+      updated['id'] = record_id + "_u"
+      if updated['id'] not in egc.id2rnum:
+        egc.update(record_id, updated)
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("lazy", [False, True])
+def test_batch_rollback(egc_file, reference, backend, lazy):
+  egc = EGCData.from_file(egc_file, cache=False, lazy=lazy,
+                          graph_backend=backend)
+  expected = egc_state(reference)
+  rng = random.Random(3)
+  for trial in range(15):
+    try:
+      with egc.batch():
+        _random_edits(egc, rng, trial)
+        raise _Rollback()
+    except (_Rollback, ValueError):
+      pass
+    assert egc_state(egc) == expected
+
+def test_failed_create_many_is_rolled_back(egc_file, reference):
+  egc = EGCData.from_file(egc_file, cache=False)
+  a = copy.deepcopy(egc.find("A1"))
+  a["id"] = "A_twice"
+  with pytest.raises(ValueError):
+    egc.create_many([a, copy.deepcopy(a)])
+  assert egc_state(egc) == egc_state(reference)
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("lazy", [False, True])
+def test_rename_many_as_updates(egc_file, backend, lazy):
+  mapping = {"U0": "U0_r", "U2": "U2_r", "G1": "G1_r", "A0": "A0_r",
+             "S0": "S0_r", "T0": "T0_r", "D-PMID-1": "D-PMID-100000"}
+  renamed = EGCData.from_file(egc_file, cache=False, lazy=lazy,
+                              graph_backend=backend)
+  renamed.rename_many(mapping)
+  updated = EGCData.from_file(egc_file, cache=False, lazy=lazy,
+                              graph_backend=backend)
+  for old_id, new_id in mapping.items():
+    record = copy.deepcopy(updated.find(old_id))
+    if record['record_type'] == 'D':
+      prefix, item = EGCData.parse_composed_id(new_id)
+      record['document_id'] = {'resource_prefix': prefix, 'item': item}
+    else:
+      record['id'] = new_id
+    updated.update(old_id, record)
+  assert egc_dump(renamed) == egc_dump(updated)
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_rename_to_referenced_missing_record(egc_file, backend):
+  # the node of a referenced, but not existing, record is merged
+  egc = EGCData.from_file(egc_file, cache=False, graph_backend=backend)
+  a = copy.deepcopy(egc.find("A1"))
+  a["id"] = "A_dangling"
+  a["unit_id"] = "U_missing"
+  egc.create(a)
+  referencing = sorted(egc._ref_by_ids('U', "U1", 'A')) + ["A_dangling"]
+  u = copy.deepcopy(egc.find("U1"))
+  u["id"] = "U_missing"
+  egc.update("U1", u)
+  assert sorted(egc._ref_by_ids('U', "U_missing", 'A')) == sorted(referencing)
+  for record_id in referencing:
+    assert "U_missing" in egc._refs_ids('A', record_id, 'U')
+  assert not egc.graph.has_node('U', "U1")
+
+def test_rename_many_swap(egc_copy):
+  egc = EGCData.from_file(egc_copy, cache=False)
+  g0, g1 = egc.find("G0"), egc.find("G1")
+  egc.rename_many({"G0": "G1", "G1": "G0"})
+  assert egc.find("G1")["name"] == g0["name"]
+  assert egc.find("G0")["name"] == g1["name"]
+  egc.compact()
+  assert egc_dump(EGCData.from_file(egc_copy, cache=False)) == egc_dump(egc)
+
+def test_rename_many_errors(egc_file, reference):
+  egc = EGCData.from_file(egc_file, cache=False)
+  for mapping in [{"G0": "G1"}, {"not_existing": "X"}]:
+    with pytest.raises(ValueError):
+      egc.rename_many(mapping)
+  assert egc_state(egc) == egc_state(reference)
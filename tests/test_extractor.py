@@ -0,0 +1,45 @@
+import pytest
+from egctools.egcdata import EGCData
+from egctools.extractor import Extractor
+
+@pytest.fixture(scope="module")
+def egc(egc_file):
+  return EGCData.from_file(egc_file, cache=False)
+
+def _line_ids(egc, lines):
+  line2id = {egc.line(record_id): record_id for record_id in egc.id2rnum}
+  return [line2id[line] for line in lines]
+
+def test_lazy_as_eager(egc_file, egc):
+  lazy = Extractor.from_file(egc_file, cache=False)
+  eager = Extractor(egc)
+  for record_id in ["D-PMID-1", "PMID:2", "S1", "T1", "G5", "U7", "A3",
+                    "V2", "C1"]:
+    assert lazy.extract(record_id, True, True) == \
+        eager.extract(record_id, True, True)
+
+def test_group_extraction(egc):
+  # the groups referenced by the V/C records referencing the group
+  # are also extracted (see extraction_plan.txt)
+  for group_id in egc.find_all_ids('G'):
+    if egc._ref_by_ids('G', group_id, 'C'):
+      break
+  extracted = set(_line_ids(egc, Extractor(egc).extract(group_id)))
+  for record_id in egc._ref_by_ids('G', group_id, 'C'):
+    assert record_id in extracted
+    assert set(egc._refs_ids('C', record_id, 'G')) <= extracted
+
+def test_skip_and_limits(egc):
+  extractor = Extractor(egc)
+  lines = extractor.extract("U1")
+  assert len(set(lines)) == len(lines)
+  assert extractor.extract("U1", max_records=2) == lines[:2]
+  assert extractor.extract("U1", max_depth=0) == lines[:1]
+  skip = set()
+  assert extractor.extract("U1", skip=skip) == lines
+  assert extractor.extract("U1", skip=skip) == []
+  assert "U1" in skip
+
+def test_unknown_id(egc):
+  with pytest.raises(ValueError):
+    Extractor(egc).extract("not_existing")
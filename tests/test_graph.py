@@ -0,0 +1,111 @@
+import random
+import pytest
+from egctools.graph import DictGraph, CompactGraph, create
+from .helpers import graph_nodes
+
+RT = "ABC"
+
+def _assert_same(graphs, ids):
+  dict_graph, compact_graph = graphs
+  nodes = graph_nodes(dict_graph)
+  assert graph_nodes(compact_graph) == nodes
+  for rt in RT:
+    for i in ids[rt]:
+      assert dict_graph.has_node(rt, i) == ((rt, i) in nodes)
+      assert compact_graph.has_node(rt, i) == ((rt, i) in nodes)
+  for rt, i in nodes:
+    assert dict_graph.is_ref_by(rt, i) == compact_graph.is_ref_by(rt, i)
+    for rt2 in RT:
+      assert list(dict_graph.refs(rt, i, rt2)) == \
+          list(compact_graph.refs(rt, i, rt2))
+      assert list(dict_graph.ref_by(rt, i, rt2)) == \
+          list(compact_graph.ref_by(rt, i, rt2))
+
+def _rename(graph, rt, old, new):
+  # as done by EGCData, when the ID of a record is changed
+  graph.clear_refs(rt, old)
+  for rt2 in graph.ref_by_types(rt, old):
+    for id2 in list(graph.ref_by(rt, old, rt2)):
+      if old in graph.refs(rt2, id2, rt):
+        graph.replace_in_refs(rt2, id2, rt, old, new)
+  graph.rename_node(rt, old, new)
+
+@pytest.mark.parametrize("seed", range(100))
+def test_compact_graph_as_dict_graph(seed):
+  rng = random.Random(seed)
+  graphs = [DictGraph(), CompactGraph()]
+  ids = {rt: [f"{rt}{i}" for i in range(8)] for rt in RT}
+  def node():
+    rt = rng.choice(RT)
+    return rt, rng.choice(ids[rt])
+  for n in range(rng.randrange(30)):
+    a, b = node(), node()
+    for g in graphs:
+      g.connect(*a, *b)
+  if rng.random() < 0.5:
+    for g in graphs:
+      g.finalize()
+  for n in range(30):
+    op = rng.random()
+    rt, i = node()
+    if op < 0.4:
+      b = node()
+      for g in graphs:
+        g.connect(rt, i, *b)
+    elif not graphs[0].has_node(rt, i):
+      continue
+    elif op < 0.6:
+      for g in graphs:
+        g.remove_node(rt, i)
+    elif op < 0.8:
+      for g in graphs:
+        g.clear_refs(rt, i)
+    else:
+      # the new ID can be the one of an existing node
+      new = rng.choice(ids[rt]) if op < 0.9 else i + "x"
+      if new == i:
+        continue
+      if new not in ids[rt]:
+        ids[rt].append(new)
+      for g in graphs:
+        _rename(g, rt, i, new)
+    _assert_same(graphs, ids)
+
+@pytest.mark.parametrize("backend", ["dict", "compact"])
+@pytest.mark.parametrize("finalize", [False, True])
+def test_rename_to_existing_node(backend, finalize):
+  graph = create(backend)
+  graph.connect("A", "a1", "U", "u1")
+  graph.connect("A", "a2", "U", "u2")
+  graph.connect("U", "u1", "U", "u0")
+  if finalize:
+    graph.finalize()
+  _rename(graph, "U", "u1", "u2")
+  assert not graph.has_node("U", "u1")
+  assert list(graph.refs("A", "a1", "U")) == ["u2"]
+  assert list(graph.refs("A", "a2", "U")) == ["u2"]
+  assert sorted(graph.ref_by("U", "u2", "A")) == ["a1", "a2"]
+  assert list(graph.ref_by("U", "u0", "U")) == []
+
+def test_compact_graph_to_data():
+  rng = random.Random(0)
+  graph = CompactGraph()
+  ids = {rt: [f"{rt}{i}" for i in range(20)] for rt in RT}
+  for n in range(100):
+    graph.connect(rng.choice(RT), rng.choice(ids["A"]),
+                  rng.choice(RT), rng.choice(ids["B"]))
+  graph.remove_node("A", "A1")
+  graph.connect("C", "C1", "A", "A2")
+  restored = CompactGraph.from_data(graph.to_data())
+  assert graph_nodes(restored) == graph_nodes(graph)
+  for rt in RT:
+    for i in ids["A"] + ids["B"] + ids["C"]:
+      assert restored.has_node(rt, i) == graph.has_node(rt, i)
+      for rt2 in RT:
+        assert list(restored.refs(rt, i, rt2)) == list(graph.refs(rt, i, rt2))
+        assert list(restored.ref_by(rt, i, rt2)) == \
+            list(graph.ref_by(rt, i, rt2))
+
+def test_unknown_backend():
+  with pytest.raises(ValueError):
+    create("unknown")
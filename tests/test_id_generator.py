@@ -0,0 +1,88 @@
+import copy
+import random
+from egctools.egcdata import EGCData
+from egctools.id_generator import IDAllocationIndex, generate_numbased_id, \
+    generate_numbased_ids, generate_A_id, release_ids
+
+def test_first_free():
+  index = IDAllocationIndex(["V1", "V2", "V4", "V05", "A_1", "X"])
+  assert index.first_free("V") == "V3"
+  index.add("V3")
+  assert index.first_free("V") == "V5"
+  index.remove("V2")
+  assert index.first_free("V") == "V2"
+  assert index.first_free("V", 3) == "V5"
+  assert index.first_free("A_", 2) == "A_2"
+  assert index.first_free("W") == "W1"
+
+def test_first_free_old_id():
+  index = IDAllocationIndex(["V1", "V2", "V3"])
+  assert index.first_free("V", old_id="V2") == "V2"
+  assert index.first_free("V", old_id="W2") == "V4"
+
+def test_reserve_and_release():
+  index = IDAllocationIndex(["V1"])
+  index.reserve("V2")
+  assert index.is_reserved("V2")
+  assert index.first_free("V") == "V3"
+  index.release("V2")
+  assert not index.is_reserved("V2")
+  assert index.first_free("V") == "V2"
+  index.reserve("V2")
+  index.add("V2")
+  assert not index.is_reserved("V2")
+  index.release("V2")
+  assert index.first_free("V") == "V3"
+
+def _is_free(egc, record_id, old_id):
+  return record_id == old_id or \
+      not (egc.id_exists(record_id) or
+           egc.id_allocation_index().is_reserved(record_id))
+
+def _first_numbased(egc, prefix, old_id):
+  i = 1
+  while not _is_free(egc, f"{prefix}{i}", old_id):
+    i += 1
+  return f"{prefix}{i}"
+
+def _first_with_suffix(egc, base, old_id):
+  if _is_free(egc, base, old_id):
+    return base
+  i = 2
+  while not _is_free(egc, f"{base}_{i}", old_id):
+    i += 1
+  return f"{base}_{i}"
+
+def test_generated_ids_as_linear_search(egc_file):
+  egc = EGCData.from_file(egc_file, cache=False)
+  v = egc.find("V1")
+  a = egc.find("A1")
+  def create(record, record_id):
+    record = copy.deepcopy(record)
+    record['id'] = record_id
+    egc.create(record)
+  rng = random.Random(1)
+  for step in range(300):
+    old_id = rng.choice(list(egc.id2rnum)) if rng.random() < 0.3 else None
+    assert generate_numbased_id(egc, "V", old_id) == \
+        _first_numbased(egc, "V", old_id)
+    assert generate_A_id(egc, a['unit_id'], "count", old_id) == \
+        _first_with_suffix(egc, f"Ac_{a['unit_id'][1:]}", old_id)
+    op = rng.random()
+    if op < 0.4:
+      create(v, generate_numbased_id(egc, "V"))
+      create(a, generate_A_id(egc, a['unit_id'], "count"))
+    elif op < 0.7:
+      egc.delete(rng.choice([i for i in egc.id2rnum if i.startswith("V")]))
+    elif op < 0.9:
+      reserved = generate_numbased_ids(egc, "V", 3)
+      assert len(set(reserved)) == 3
+      release_ids(egc, reserved[1:])
+      create(v, reserved[0])
+    else:
+      try:
+        with egc.batch():
+          egc.delete([i for i in egc.id2rnum if i.startswith("V")][0])
+          raise RuntimeError()
+      except RuntimeError:
+        pass
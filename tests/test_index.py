@@ -0,0 +1,33 @@
+from egctools import index
+from egctools.parser import unparsed_and_parsed_lines
+from egctools.references import get_refs
+
+def _key(rt, record):
+  if rt == 'D':
+    return "{resource_prefix}:{item}".format(**record['document_id'])
+  return record['id']
+
+def test_create(egc_file):
+  lines, lines_idx = index.create(egc_file)
+  n_lines = 0
+  for i, (line, record) in enumerate(unparsed_and_parsed_lines(egc_file)):
+    assert lines[i] == line
+    rt = record['record_type']
+    if rt == 'M':
+      assert i in lines_idx['U'][record['unit_id']]['ref_by']['M']
+      continue
+    line_id = _key(rt, record)
+    assert lines_idx[rt][line_id]['line'] == i
+    for ref_rt, ref_id in get_refs(record):
+      if ref_rt == 'D':
+        ref_id = ":".join(ref_id.split("-", 2)[1:])
+      assert ref_id in lines_idx[rt][line_id]['refs'][ref_rt]
+      assert line_id in lines_idx[ref_rt][ref_id]['ref_by'][rt]
+    n_lines += 1
+  assert len(lines) == n_lines + sum(len(entry['ref_by']['M']) \
+      for entry in lines_idx['U'].values())
+
+def test_create_cached(egc_file, cache_dir):
+  expected = index.create(egc_file)
+  for i in range(2):
+    assert index.create(egc_file, cache=True, cache_dir=cache_dir) == expected
@@ -0,0 +1,46 @@
+import pytest
+from egctools.linestore import MappedLines, _line_spans
+
+def _write(tmp_path, content):
+  fname = tmp_path / "lines.egc"
+  fname.write_bytes(content)
+  return str(fname)
+
+@pytest.mark.parametrize("content", [b"", b"a\n", b"a\nbb\n\nccc",
+                                     b"a\r\nb\r\n", "é\nx\n".encode()])
+@pytest.mark.parametrize("block_size", [1, 3, 1 << 20])
+def test_line_spans(content, block_size):
+  starts, lengths = _line_spans(content, block_size)
+  lines = [content[s:s + n].decode() for s, n in zip(starts, lengths)]
+  assert lines == content.decode().splitlines()
+
+def test_edit(tmp_path):
+  lines = MappedLines(_write(tmp_path, b"a\nb\nc\n"))
+  lines[1] = "B"
+  lines.append("d")
+  lines[0] = None
+  assert list(lines) == [None, "B", "c", "d"]
+  del lines[3:]
+  assert list(lines) == [None, "B", "c"]
+  lines.close()
+
+def test_remap(tmp_path):
+  fname = _write(tmp_path, b"a\nb\nc\n")
+  lines = MappedLines(fname)
+  lines[0] = None
+  lines[2] = "C"
+  lines.append("d")
+  expected = list(lines)
+  with open(fname, "w") as f:
+    for line in expected:
+      if line is not None:
+        f.write(line + "\n")
+  lines.remap()
+  assert list(lines) == expected
+  assert lines._overlay == {}
+  other = str(tmp_path / "other.egc")
+  with open(other, "w") as f:
+    f.write("x\ny\nz\n")
+  lines.remap(other)
+  assert list(lines) == [None, "x", "y", "z"]
+  lines.close()
@@ -0,0 +1,53 @@
+import io
+import pytest
+from egctools import synthetic
+from egctools.merge import merge, line_record_id
+from egctools.parser import unparsed_and_parsed_lines
+from egctools.egcdata import EGCData
+
+@pytest.fixture(scope="module")
+def egc_files(tmp_path_factory):
+  path = tmp_path_factory.mktemp("merge")
+  fnames = []
+  for seed, n_records in enumerate([600, 300]):
+    fname = str(path / f"{seed}.egc")
+    synthetic.write(fname, n_records, seed=seed)
+    fnames.append(fname)
+  return fnames
+
+def test_line_record_id(egc_files):
+  for line, record in unparsed_and_parsed_lines(egc_files[0]):
+    assert line_record_id(line) == EGCData.record_id(record)
+
+def test_line_without_record_id():
+  for line in ["", "\n", "X", "D\tno_document_id"]:
+    assert line_record_id(line) is None
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_merge(egc_files, jobs):
+  out = io.StringIO()
+  conflicts = merge(egc_files, out, jobs, conflicts=True)
+  expected = []
+  seen = set()
+  for fname in egc_files:
+    with open(fname) as f:
+      for line in f:
+        record_id = line_record_id(line)
+        if record_id not in seen:
+          seen.add(record_id)
+          expected.append(line)
+  assert out.getvalue() == "".join(expected)
+  assert len(conflicts) > 0
+  for record_id, fname, lineno, first_fname, first_lineno in conflicts:
+    assert fname == egc_files[1]
+    assert first_fname == egc_files[0]
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_merge_lines_without_record_id(tmp_path, egc_files, jobs):
+  fname = tmp_path / "empty_lines.egc"
+  with open(egc_files[1]) as f:
+    lines = f.readlines()
+  fname.write_text("".join(lines[:10] + ["\n"] + lines[:10] + ["\n"]))
+  out = io.StringIO()
+  merge([str(fname)], out, jobs)
+  assert out.getvalue() == "".join(lines[:10] + ["\n", "\n"])
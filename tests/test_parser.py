@@ -0,0 +1,44 @@
+from egctools import synthetic
+from egctools.parser import parsed_line, encode_line, parsed_lines, \
+    unparsed_and_parsed_lines
+from egctools.references import scan_line, get_refs, get_VC_to_ST
+from egctools.egcdata import EGCData
+
+def test_synthetic_round_trip():
+  for record in synthetic.records(500, seed=2):
+    assert parsed_line(encode_line(record)) == record
+
+def test_synthetic_deterministic(tmp_path):
+  fnames = [str(tmp_path / f"{i}.egc") for i in range(2)]
+  for fname in fnames:
+    synthetic.write(fname, 300, seed=5)
+  with open(fnames[0]) as f1, open(fnames[1]) as f2:
+    assert f1.read() == f2.read()
+
+def test_parallel_parse_order(egc_file):
+  sequential = list(unparsed_and_parsed_lines(egc_file, 1))
+  with open(egc_file) as f:
+    assert [line for line, record in sequential] == f.read().splitlines()
+  for jobs in [2, 3, 0]:
+    assert list(unparsed_and_parsed_lines(egc_file, jobs)) == sequential
+    assert list(parsed_lines(egc_file, jobs)) == \
+        [record for line, record in sequential]
+
+def test_parallel_parse_empty_file(tmp_path):
+  fname = tmp_path / "empty.egc"
+  fname.write_text("")
+  assert list(parsed_lines(str(fname), 3)) == []
+
+def test_scan_line_as_decoded(egc_file):
+  n_scanned = 0
+  for line, record in unparsed_and_parsed_lines(egc_file):
+    scanned = scan_line(line)
+    if scanned is None:
+      continue
+    n_scanned += 1
+    partial, refs = scanned
+    assert EGCData.record_id(partial) == EGCData.record_id(record)
+    assert refs == get_refs(record)
+    if record['record_type'] in ['V', 'C']:
+      assert get_VC_to_ST(partial) == get_VC_to_ST(record)
+  assert n_scanned > 0
@@ -0,0 +1,24 @@
+from egctools import synthetic
+from egctools.parser import encode_line, parsed_line
+from egctools.references import scan_line, get_refs
+
+def test_scan_line():
+  for line in synthetic.lines(600, seed=3):
+    scanned = scan_line(line)
+    if scanned is not None:
+      record, refs = scanned
+      decoded = parsed_line(line)
+      assert refs == get_refs(decoded)
+      for key, value in record.items():
+        assert decoded[key] == value
+
+def test_scan_line_full_syntax():
+  # the lines using quoting, escapes or comments are decoded
+  line = "V\tV1\tS1\tA1\tG1"
+  assert scan_line(line) is not None
+  for not_plain in ['\t"G1"', "\t'G1'", "\tG\\1", "\t# comment", "#"]:
+    assert scan_line(line + not_plain) is None
+  assert scan_line('G\tG1\tname\tcombined\t"G2 & G3"') is None
+  assert scan_line('G\tG1\t"name\\twith tab"\tcombined\tG2 & G3') is None
+  assert scan_line('S\tS1\tPMID:"1"\ttext') is None
+  assert scan_line("# comment") is None
@@ -0,0 +1,70 @@
+import pytest
+from egctools.egcdata import EGCData
+from egctools.sqlindex import IndexedEGCData, build
+from egctools.extractor import Extractor
+from .helpers import RECORD_TYPES, egc_dump, graph_nodes, graph_edges
+from .test_egcdata import _edit
+
+@pytest.fixture
+def indexed(egc_copy):
+  egc = IndexedEGCData.from_file(egc_copy)
+  yield egc
+  egc.close()
+
+def test_build(egc_copy):
+  assert build(egc_copy)
+  assert not build(egc_copy)
+
+def test_as_egcdata(egc_copy, indexed):
+  egc = EGCData.from_file(egc_copy, cache=False)
+  nodes = graph_nodes(egc.graph)
+  assert graph_nodes(indexed.graph) == nodes
+  assert graph_edges(indexed.graph, nodes) == graph_edges(egc.graph, nodes)
+  assert egc_dump(indexed) == egc_dump(egc)
+  for rt in RECORD_TYPES:
+    for record_id in egc.find_all_ids(rt):
+      for rt2 in RECORD_TYPES:
+        assert list(egc._refs_ids(rt, record_id, rt2)) == \
+            list(indexed._refs_ids(rt, record_id, rt2))
+        assert list(egc._ref_by_ids(rt, record_id, rt2)) == \
+            list(indexed._ref_by_ids(rt, record_id, rt2))
+  for record_id in ["G1", "U1", "A1", "V1", "S1"]:
+    assert Extractor(indexed).extract(record_id, True, True) == \
+        Extractor(egc).extract(record_id, True, True)
+
+def test_edit_and_save(egc_copy):
+  indexed = IndexedEGCData.from_file(egc_copy)
+  egc = EGCData.from_file(egc_copy, cache=False)
+  _edit(egc)
+  with indexed.batch():
+    _edit(indexed)
+  assert egc_dump(indexed) == egc_dump(egc)
+  indexed.save()
+  indexed.close()
+  reopened = IndexedEGCData.from_file(egc_copy)
+  assert reopened.is_up_to_date()
+  assert egc_dump(reopened) == egc_dump(egc)
+  assert egc_dump(EGCData.from_file(egc_copy, cache=False)) == egc_dump(egc)
+  reopened.close()
+
+def test_rollback(indexed):
+  before = egc_dump(indexed)
+  with pytest.raises(RuntimeError):
+    with indexed.batch():
+      _edit(indexed)
+      raise RuntimeError()
+  assert egc_dump(indexed) == before
+
+def test_journal(egc_copy):
+  journaled = IndexedEGCData.from_file(egc_copy, journal=True)
+  _edit(journaled)
+  journaled.save()
+  journaled.close()
+  egc = EGCData.from_file(egc_copy, cache=False)
+  reopened = IndexedEGCData.from_file(egc_copy, journal=True)
+  assert egc_dump(reopened) == egc_dump(egc)
+  reopened.compact()
+  reopened.close()
+  reopened = IndexedEGCData.from_file(egc_copy)
+  assert egc_dump(reopened) == egc_dump(egc)
+  reopened.close()
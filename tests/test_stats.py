@@ -0,0 +1,73 @@
+import os
+import shutil
+import pytest
+from egctools import stats, synthetic, cache
+from egctools.egcdata import EGCData
+
+def _plain(value):
+  # comparable representation of the stats (the order of the sets
+  # is not defined)
+  if isinstance(value, dict):
+    return {str(k): _plain(v) for k, v in value.items()}
+  if isinstance(value, set):
+    return sorted(value)
+  if isinstance(value, (list, tuple)):
+    return [_plain(v) for v in value]
+  return value
+
+@pytest.fixture(scope="module")
+def egc_files(tmp_path_factory):
+  # the IDs of the synthetic records are partly the same in all files
+  path = tmp_path_factory.mktemp("stats")
+  fnames = []
+  for seed, n_records in enumerate([600, 300, 900]):
+    fname = str(path / f"{seed}.egc")
+    synthetic.write(fname, n_records, seed=seed)
+    fnames.append(fname)
+  return fnames + fnames[:1]
+
+@pytest.mark.parametrize("skip_double", [False, True])
+def test_parallel_as_sequential(egc_files, skip_double):
+  collected = None
+  skip_ids = set() if skip_double else None
+  for fname in egc_files:
+    collected = stats.collect(fname, collected, skip_ids, cache=False)
+  expected = _plain(collected)
+  # with multiple jobs, the partial stats of the files are merged
+  for jobs in [1, 3, len(egc_files)]:
+    result = stats.collect_files(egc_files, skip_double, jobs, cache=False)
+    assert _plain(result) == expected
+    assert stats.report(result) == stats.report(collected)
+
+def test_parallel_skip_double_cached(egc_files, cache_dir):
+  for fname in egc_files:
+    EGCData.from_file(fname, cache=True, cache_dir=cache_dir)
+  assert _plain(stats.collect_files(egc_files, True, 3, cache=True,
+                                    cache_dir=cache_dir)) == \
+      _plain(stats.collect_files(egc_files, True, 1, cache=False))
+
+def test_cached_records(egc_files, tmp_path):
+  cache_dir = str(tmp_path)
+  fname = egc_files[0]
+  expected = _plain(stats.collect(fname, cache=False))
+  assert _plain(stats.collect(fname, cache=True,
+                              cache_dir=cache_dir)) == expected
+  # the stats do not write the cache, but use the one of EGCData
+  assert not os.path.exists(cache.cache_path(fname, cache_dir))
+  EGCData.from_file(fname, cache=True, cache_dir=cache_dir)
+  assert _plain(stats.collect(fname, cache=True,
+                              cache_dir=cache_dir)) == expected
+
+def test_observer(egc_files, tmp_path):
+  fname = str(tmp_path / "edited.egc")
+  shutil.copyfile(egc_files[0], fname)
+  egc = EGCData.from_file(fname, cache=False)
+  observer = stats.StatsObserver(egc)
+  egc.add_observer(observer)
+  egc.delete("V1")
+  egc.delete("V2")
+  u = dict(egc.find("U1"))
+  u["id"] = "U1_renamed"
+  egc.update("U1", u)
+  egc.compact()
+  assert _plain(observer.stats) == _plain(stats.collect(fname, cache=False))
@@ -0,0 +1,16 @@
+import io
+import pytest
+from egctools import stats, table
+
+@pytest.fixture(scope="module")
+def egc_stats(egc_file):
+  return stats.collect(egc_file)
+
+def test_create_out(egc_stats):
+  out = io.StringIO()
+  assert table.create(egc_stats, "latex", "u_with_a", out=out) is None
+  assert out.getvalue() == table.create(egc_stats, "latex", "u_with_a")
+
+def test_out_is_keyword_only(egc_stats):
+  with pytest.raises(TypeError):
+    table.create(egc_stats, "latex", "u_with_a", io.StringIO())